@@ -0,0 +1,329 @@
+"""
+Harness end-to-end: chunk → extract → load por pipeline contra el servidor QBO local
+y un Postgres local, con regresiones de throughput y memoria contra un baseline.
+
+Por pipeline (--pipelines invoices,customers,items[,all]):
+  - borra lo cargado antes para el realm del bench (--realm) en raw.qb_*,
+    raw.extract_windows y raw.window_fingerprints (--keep-data lo evita),
+  - corre los bloques reales (chunk_fecha_* → extract_qbo_* → load_postgres_*) en un
+    proceso hijo, con QBO_BASE_URL / QBO_TOKEN_URL apuntando al mock levantado acá
+    (qbo_mock_server.py, en un hilo, con el dataset de qbo_dataset.py),
+  - mide: wall time y por bloque, requests al mock y reintentos (respuestas 429/5xx/401),
+    filas en RAW, rows/s y RSS pico del hijo (ru_maxrss vía os.wait4; con
+    --tracemalloc también el pico del heap Python, más lento).
+
+Resultados: una línea JSON por pipeline y una fila en raw.bench_runs (suite 'e2e').
+Baseline: la última corrida guardada con --save-baseline para el mismo pipeline,
+modo y setup (dataset, fallas del mock, kwargs). Falla (código 1) si rows/s cae más
+de --max-slowdown o el RSS pico crece más de --max-mem-growth respecto del baseline.
+
+Credenciales: los bloques leen Mage Secrets como en una corrida normal (el mock
+acepta cualquier QBO_CLIENT_ID / QBO_CLIENT_SECRET / QBO_REFRESH_TOKEN); este script
+se conecta con PG_DSN o PG_HOST/... (defaults = docker-compose) a la misma base.
+Correr dentro del contenedor de Mage.
+
+Uso:
+  python benchmarks/bench_e2e.py [--pipelines invoices,customers,items] [--invoices 50000]
+      [--latency-ms 20] [--p429 0.01] [--kwarg mode=fused] [--save-baseline]
+"""
+import argparse
+import importlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+
+MAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mage')
+
+# pipeline → (chunk, extract, exporter, función del exporter, tablas RAW que carga)
+PIPELINES = {
+    'invoices': ('transformers.chunk_fecha_invoices', 'transformers.extract_qbo_invoices',
+                 'data_exporters.load_postgres_invoices', 'export_invoices_to_postgres', ('invoices',)),
+    'customers': ('transformers.chunk_fecha_customers', 'transformers.extract_qbo_customers',
+                  'data_exporters.load_postgres_customers', 'export_data_to_postgres', ('customers',)),
+    'items': ('transformers.chunk_fecha_items', 'transformers.extract_qbo_items',
+              'data_exporters.load_postgres_items', 'export_items_to_postgres', ('items',)),
+    'all': ('transformers.chunk_fecha_all', 'transformers.extract_qbo_all',
+            'data_exporters.load_postgres_all', 'export_all_to_postgres',
+            ('invoices', 'customers', 'items', 'payments', 'bills')),
+}
+RETRY_STATUSES = ('401', '429', '500', '502', '503', '504')
+
+
+def _now_utc_iso():
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+# ====== Proceso hijo: un pipeline ======
+def run_child(opts):
+    """Corre los tres bloques del pipeline en este proceso y escribe tiempos en --result."""
+    sys.path.insert(0, MAGE_DIR)
+    chunk_name, extract_name, export_name, export_fn, _ = PIPELINES[opts.child]
+    kwargs = json.loads(opts.kwargs)
+    if opts.tracemalloc:
+        tracemalloc.start()
+
+    stage_secs = {}
+    t0 = time.perf_counter()
+    chunk, extract, export = (importlib.import_module(f"default_repo.{m}")
+                              for m in (chunk_name, extract_name, export_name))
+    stage_secs["import"] = round(time.perf_counter() - t0, 3)
+
+    t = time.perf_counter()
+    tramos = chunk.chunk_fecha(**kwargs)
+    stage_secs["chunk"] = round(time.perf_counter() - t, 3)
+    t = time.perf_counter()
+    data = extract.transform(tramos, **kwargs)
+    stage_secs["extract"] = round(time.perf_counter() - t, 3)
+    t = time.perf_counter()
+    getattr(export, export_fn)(data, **kwargs)
+    stage_secs["load"] = round(time.perf_counter() - t, 3)
+
+    result = {
+        "wall_secs": round(time.perf_counter() - t0 - stage_secs["import"], 3),
+        "stage_secs": stage_secs, "tramos": len(tramos or []),
+    }
+    if opts.tracemalloc:
+        result["tracemalloc_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+    with open(opts.result, 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+
+
+# ====== Proceso padre ======
+def start_mock(opts):
+    """Levanta qbo_mock_server.py en un hilo (puerto libre). Devuelve (server, base_url)."""
+    from qbo_mock_server import build_parser, serve, synthetic
+
+    argv = ['--port', '0', '--seed', str(opts.seed), '--invoices', str(opts.invoices),
+            '--customers', str(opts.customers), '--items', str(opts.items),
+            '--payments', str(opts.payments), '--bills', str(opts.bills), '--lines', str(opts.lines),
+            '--start', opts.start, '--end', opts.end, '--skew', opts.skew,
+            '--latency-ms', str(opts.latency_ms), '--jitter-ms', str(opts.jitter_ms),
+            '--p429', str(opts.p429), '--p5xx', str(opts.p5xx),
+            '--rate-per-min', str(opts.rate_per_min), '--max-concurrent', str(opts.max_concurrent)]
+    server = serve(build_parser().parse_args(argv), synthetic(opts))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+
+def mock_stats(server):
+    state = server.RequestHandlerClass.state
+    with state.lock:
+        return Counter(state.stats)
+
+
+def reset_realm(conn, realm_id, tables):
+    """Borra lo que cargó una corrida anterior del bench (filas, ventanas, fingerprints)."""
+    with conn.cursor() as cur:
+        for table in tables:
+            if conn.execute("SELECT to_regclass(%s)", (f"raw.qb_{table}",)).fetchone()[0] is None:
+                continue
+            cur.execute(f"DELETE FROM raw.qb_{table} WHERE realm_id = %s", (realm_id,))
+            cur.execute("DELETE FROM raw.window_fingerprints WHERE realm_id = %s AND entity = %s", (realm_id, table))
+            cur.execute("DELETE FROM raw.extract_windows WHERE realm_id = %s AND entity = %s", (realm_id, table))
+    conn.commit()
+
+
+def raw_rows(conn, realm_id, tables):
+    total = 0
+    for table in tables:
+        if conn.execute("SELECT to_regclass(%s)", (f"raw.qb_{table}",)).fetchone()[0] is not None:
+            total += conn.execute(f"SELECT count(*) FROM raw.qb_{table} WHERE realm_id = %s", (realm_id,)).fetchone()[0]
+    conn.commit()
+    return total
+
+
+def run_pipeline(opts, name, kwargs, env, log_path):
+    """Corre el pipeline en un hijo; devuelve (resultado del hijo, RSS pico en bytes, exit code)."""
+    fd, result_path = tempfile.mkstemp(prefix=f"e2e_{name}_", suffix='.json')
+    os.close(fd)
+    cmd = [sys.executable, os.path.abspath(__file__), '--child', name,
+           '--kwargs', json.dumps(kwargs), '--result', result_path]
+    if opts.tracemalloc:
+        cmd.append('--tracemalloc')
+    try:
+        with open(log_path, 'w', encoding='utf-8') as log:
+            proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, env=env)
+            _, status, usage = os.wait4(proc.pid, 0)
+        # ru_maxrss: KiB en Linux, bytes en macOS
+        peak_rss = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        code = os.waitstatus_to_exitcode(status)
+        with open(result_path, encoding='utf-8') as f:
+            result = json.load(f) if code == 0 else {}
+    finally:
+        os.remove(result_path)
+    return result, peak_rss, code
+
+
+def load_baseline(conn, case_name, setup):
+    row = conn.execute(
+        "SELECT metrics FROM raw.bench_runs "
+        "WHERE suite = 'e2e' AND case_name = %s AND params->>'baseline' = 'true' AND params->'setup' = %s::jsonb "
+        "ORDER BY ran_at_utc DESC LIMIT 1",
+        (case_name, json.dumps(setup)),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def compare(metrics, baseline, opts):
+    """Regresiones vs. baseline: [(métrica, actual, baseline)]."""
+    if not baseline:
+        return []
+    out = []
+    rps, base_rps = metrics.get("rows_per_sec"), baseline.get("rows_per_sec")
+    if rps is not None and base_rps and rps < base_rps * (1 - opts.max_slowdown):
+        out.append(("rows_per_sec", rps, base_rps))
+    for key in ("peak_rss_bytes", "tracemalloc_peak_bytes"):
+        cur, base = metrics.get(key), baseline.get(key)
+        if cur is not None and base and cur > base * (1 + opts.max_mem_growth):
+            out.append((key, cur, base))
+    return out
+
+
+def _kwarg(text):
+    key, sep, value = text.partition('=')
+    if not sep or not key:
+        raise argparse.ArgumentTypeError(f"--kwarg espera clave=valor: {text!r}")
+    return key.strip(), value.strip()
+
+
+def build_parser():
+    from qbo_dataset import add_dataset_args
+
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument('--pipelines', default='invoices,customers,items')
+    ap.add_argument('--realm', default='e2e-bench', help='realm de las corridas (sus datos se borran)')
+    ap.add_argument('--mode', default='backfill')
+    ap.add_argument('--kwarg', type=_kwarg, action='append', default=[],
+                    help='runtime var extra clave=valor (repetible), ej. mode=fused, fetch_workers=4')
+    add_dataset_args(ap)   # --seed, --invoices, --customers, ... (qbo_dataset.py)
+    ap.add_argument('--latency-ms', type=float, default=20.0)
+    ap.add_argument('--jitter-ms', type=float, default=5.0)
+    ap.add_argument('--p429', type=float, default=0.0)
+    ap.add_argument('--p5xx', type=float, default=0.0)
+    ap.add_argument('--rate-per-min', type=int, default=0)
+    ap.add_argument('--max-concurrent', type=int, default=0)
+    ap.add_argument('--rate-backend', default='',
+                    help='QBO_RATE_BACKEND de los hijos (local | postgres; default: automático, como en producción)')
+    ap.add_argument('--tracemalloc', action='store_true', help='medir también el pico del heap Python')
+    ap.add_argument('--max-slowdown', type=float, default=0.15, help='caída de rows/s tolerada')
+    ap.add_argument('--max-mem-growth', type=float, default=0.20, help='crecimiento de memoria pico tolerado')
+    ap.add_argument('--save-baseline', action='store_true', help='guardar esta corrida como baseline')
+    ap.add_argument('--keep-data', action='store_true', help='no borrar lo cargado antes (mide re-corridas)')
+    ap.add_argument('--log-dir', default=tempfile.gettempdir(), help='logs JSON de los bloques')
+    ap.add_argument('--child', help=argparse.SUPPRESS)
+    ap.add_argument('--kwargs', help=argparse.SUPPRESS)
+    ap.add_argument('--result', help=argparse.SUPPRESS)
+    return ap
+
+
+def main(argv=None):
+    opts = build_parser().parse_args(argv)
+    if opts.child:
+        return run_child(opts)
+    os.makedirs(opts.log_dir, exist_ok=True)
+
+    import psycopg
+    from bench_exporters import ensure_results_table, git_revision
+    from qbo_dataset import pg_dsn
+
+    pipelines = [p.strip() for p in opts.pipelines.split(',') if p.strip()]
+    unknown = set(pipelines) - set(PIPELINES)
+    if unknown:
+        raise SystemExit(f"pipelines desconocidos: {sorted(unknown)}")
+
+    # Rango que cubre todo el dataset (fechas locales de la compañía, UTC-8)
+    fecha_inicio = f"{date.fromisoformat(opts.start) - timedelta(days=1)}T00:00:00Z"
+    fecha_fin = f"{date.fromisoformat(opts.end) + timedelta(days=1)}T00:00:00Z"
+    extra = dict(opts.kwarg)
+    dataset = {k: getattr(opts, k) for k in ('seed', 'invoices', 'customers', 'items', 'payments',
+                                             'bills', 'lines', 'start', 'end', 'skew')}
+    faults = {k: getattr(opts, k) for k in ('latency_ms', 'jitter_ms', 'p429', 'p5xx',
+                                            'rate_per_min', 'max_concurrent')}
+
+    t0 = time.perf_counter()
+    server, base_url = start_mock(opts)
+    print(json.dumps({"bench": "e2e", "ts": _now_utc_iso(), "mock": base_url,
+                      "mock_load_secs": round(time.perf_counter() - t0, 2)}), flush=True)
+    env = {
+        **os.environ,
+        "QBO_BASE_URL": base_url,
+        "QBO_TOKEN_URL": f"{base_url}/oauth2/v1/tokens/bearer",
+        "QBO_RATE_BACKEND": opts.rate_backend,
+        "QBO_CACHE": "off",
+        "PYTHONPATH": os.pathsep.join(p for p in (MAGE_DIR, os.environ.get('PYTHONPATH')) if p),
+    }
+
+    run_id = f"e2e_{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}_{uuid.uuid4().hex[:6]}"
+    git_rev, host = git_revision(), socket.gethostname()
+    failures = 0
+
+    try:
+        with psycopg.connect(pg_dsn()) as conn:
+            ensure_results_table(conn)
+            for name in pipelines:
+                tables = PIPELINES[name][4]
+                kwargs = {
+                    "realms": opts.realm, "fecha_inicio": fecha_inicio, "fecha_fin": fecha_fin,
+                    "mode": opts.mode, "autotune": "off", **extra,
+                }
+                if not opts.keep_data:
+                    reset_realm(conn, opts.realm, tables)
+
+                before = mock_stats(server)
+                log_path = os.path.join(opts.log_dir, f"{run_id}_{name}.log")
+                result, peak_rss, code = run_pipeline(opts, name, kwargs, env, log_path)
+                calls = mock_stats(server) - before
+                rows = raw_rows(conn, opts.realm, tables)
+
+                wall = result.get("wall_secs")
+                metrics = {
+                    **result, "exit_code": code, "rows": rows,
+                    "rows_per_sec": round(rows / wall, 1) if code == 0 and wall else None,
+                    "requests": sum(n for k, n in calls.items() if not k.startswith('stats:')),
+                    "auth_requests": sum(n for k, n in calls.items() if k.startswith('token:')),
+                    "retries": sum(n for k, n in calls.items() if k.rsplit(':', 1)[-1] in RETRY_STATUSES),
+                    "responses": dict(calls), "peak_rss_bytes": peak_rss,
+                }
+                case_name = f"{name}/{kwargs['mode']}"
+                setup = {"dataset": dataset, "faults": faults, "kwargs": extra,
+                         "rate_backend": opts.rate_backend or 'auto', "keep_data": opts.keep_data}
+                baseline = load_baseline(conn, case_name, setup)
+                regressions = compare(metrics, baseline, opts)
+                failed = code != 0 or bool(regressions)
+                failures += failed
+
+                print(json.dumps({
+                    "bench": "e2e", "ts": _now_utc_iso(), "run_id": run_id, "case": case_name,
+                    **{k: v for k, v in metrics.items() if k != "responses"},
+                    "baseline": None if baseline is None else {
+                        k: baseline.get(k) for k in ("rows_per_sec", "peak_rss_bytes", "tracemalloc_peak_bytes")},
+                    "regressions": [{"metric": m, "value": v, "baseline": b} for m, v, b in regressions],
+                    "status": "failed" if failed else "ok", "log": log_path,
+                }), flush=True)
+
+                params = {"pipeline": name, "setup": setup, "baseline": bool(opts.save_baseline and code == 0)}
+                conn.execute(
+                    "INSERT INTO raw.bench_runs (run_id, suite, case_name, params, metrics, git_rev, host) "
+                    "VALUES (%s, 'e2e', %s, %s::jsonb, %s::jsonb, %s, %s)",
+                    (run_id, case_name, json.dumps(params), json.dumps(metrics), git_rev, host),
+                )
+                conn.commit()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,265 @@
+"""
+Benchmark: estrategias de carga a RAW contra un Postgres local.
+
+Todas usan el upsert de utils/raw_load.py (ON CONFLICT (realm_id, id), guarda de
+sync_token, RETURNING (xmax = 0) para contar inserts/updates):
+  - row:      un execute por fila (lo que hacen hoy load_postgres_* vía load_records)
+  - batch:    INSERT multi-fila, --batch filas por statement
+  - copy:     COPY a una tabla temporal + un INSERT ... SELECT ... ON CONFLICT
+  - parallel: copy repartido en --workers conexiones concurrentes
+
+Por tamaño (--sizes, default 10k, 100k, 1M) y estrategia, sobre una tabla scratch
+bench.qb_<entity>_<estrategia> (LIKE raw.qb_<entity> INCLUDING ALL: columnas
+generadas, PK e índices), con payloads de qbo_dataset.py:
+  - fase insert: tabla vacía,
+  - fase reload: los mismos payloads (todos unchanged por SyncToken).
+Métricas por fase: rows/s, WAL generado (pg_wal_lsn_diff; medir con la base sin
+otra actividad), tamaño total de la tabla (con TOAST e índices) y dead tuples
+(pg_stat_user_tables, aproximado).
+
+Cada caso se imprime como una línea JSON y se guarda en raw.bench_runs
+(docker/schema/013_bench_runs.sql; se crea si falta). Se compara con el mejor
+rows/s anterior del mismo caso: `regression: true` si cae más de --tolerance;
+--fail-on-regression sale con código 1. `raw.v_bench_regressions` muestra la
+última corrida de cada caso contra la mejor.
+
+Conexión: PG_DSN o PG_HOST/PG_PORT/PG_DB/PG_USER/PG_PASSWORD (defaults = docker-compose).
+
+Uso:
+  python benchmarks/bench_exporters.py [--entity invoices] [--sizes 10000,100000,1000000]
+      [--strategies row,batch,copy,parallel] [--batch 1000] [--workers 4]
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import psycopg
+
+from qbo_dataset import add_dataset_args, dumps, pg_dsn, GENERATORS, RAW_TABLES
+
+STRATEGIES = ('row', 'batch', 'copy', 'parallel')
+REALM_ID = 'bench'
+SCHEMA_FILE = os.path.join(os.path.dirname(__file__), '..', 'docker', 'schema', '013_bench_runs.sql')
+ENTITY_OF = {table: name for name, table in RAW_TABLES.items()}
+
+UPSERT_TAIL = """
+ON CONFLICT (realm_id, id) DO UPDATE SET
+    payload = EXCLUDED.payload,
+    ingested_at_utc = EXCLUDED.ingested_at_utc,
+    window_id = EXCLUDED.window_id,
+    page_number = EXCLUDED.page_number
+WHERE {table}.sync_token IS DISTINCT FROM EXCLUDED.sync_token
+RETURNING (xmax = 0)
+"""
+COLUMNS = "(realm_id, id, payload, ingested_at_utc, window_id, page_number)"
+ROW_VALUES = "(%s, %s, %s::jsonb, %s, NULL, %s)"
+MERGE_SQL = ("INSERT INTO {table} " + COLUMNS + "\n"
+             "SELECT %(realm_id)s, id, payload::jsonb, %(ingested_at)s, NULL, page_number FROM _stage")
+
+
+def _now_utc_iso():
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__) or '.', timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def payloads(entity, n, seed):
+    """[(id, texto JSON)] de la entidad, generados con qbo_dataset.py."""
+    name = ENTITY_OF[entity]
+    args = add_dataset_args(argparse.ArgumentParser()).parse_args(['--seed', str(seed)])
+    setattr(args, RAW_TABLES[name], n)   # --invoices / --customers / --items ...
+    return [(r["Id"], dumps(r)) for r in GENERATORS[name](args)]
+
+
+def _tally(flags, counts):
+    for (inserted,) in flags:
+        counts["inserted" if inserted else "updated"] += 1
+
+
+# ====== Estrategias ======
+def load_row(conn, table, rows, opts):
+    sql = "INSERT INTO " + table + " " + COLUMNS + " VALUES " + ROW_VALUES + UPSERT_TAIL.format(table=table)
+    counts = {"inserted": 0, "updated": 0}
+    now = datetime.now(timezone.utc)
+    with conn.cursor() as cur:
+        for rid, text in rows:
+            cur.execute(sql, (REALM_ID, rid, text, now, 1))
+            _tally(cur.fetchall(), counts)
+    conn.commit()
+    return counts
+
+
+def load_batch(conn, table, rows, opts):
+    counts = {"inserted": 0, "updated": 0}
+    now = datetime.now(timezone.utc)
+    tail = UPSERT_TAIL.format(table=table)
+    with conn.cursor() as cur:
+        for i in range(0, len(rows), opts.batch):
+            chunk = rows[i:i + opts.batch]
+            sql = "INSERT INTO " + table + " " + COLUMNS + " VALUES " + ", ".join([ROW_VALUES] * len(chunk)) + tail
+            params = [v for rid, text in chunk for v in (REALM_ID, rid, text, now, 1)]
+            cur.execute(sql, params)
+            _tally(cur.fetchall(), counts)
+    conn.commit()
+    return counts
+
+
+def load_copy(conn, table, rows, opts):
+    counts = {"inserted": 0, "updated": 0}
+    with conn.cursor() as cur:
+        cur.execute("CREATE TEMP TABLE _stage (id TEXT, payload TEXT, page_number INTEGER) ON COMMIT DROP")
+        with cur.copy("COPY _stage (id, payload, page_number) FROM STDIN") as copy:
+            for rid, text in rows:
+                copy.write_row((rid, text, 1))
+        cur.execute(MERGE_SQL.format(table=table) + UPSERT_TAIL.format(table=table), {
+            "realm_id": REALM_ID, "ingested_at": datetime.now(timezone.utc),
+        })
+        _tally(cur.fetchall(), counts)
+    conn.commit()
+    return counts
+
+
+def load_parallel(conn, table, rows, opts):
+    """copy en --workers conexiones; cada una con un shard disjunto de ids."""
+    shards = [rows[k::opts.workers] for k in range(opts.workers)]
+
+    def run(shard):
+        with psycopg.connect(opts.dsn) as c:
+            return load_copy(c, table, shard, opts)
+
+    counts = {"inserted": 0, "updated": 0}
+    with ThreadPoolExecutor(max_workers=opts.workers) as pool:
+        for part in pool.map(run, shards):
+            for k in counts:
+                counts[k] += part[k]
+    return counts
+
+
+LOADERS = {'row': load_row, 'batch': load_batch, 'copy': load_copy, 'parallel': load_parallel}
+
+
+# ====== Medición ======
+def _table_stats(conn, table):
+    schema, name = table.split('.')
+    time.sleep(1.0)   # las estadísticas de pg_stat_user_tables se publican con ~1 s de demora
+    live, dead = conn.execute(
+        "SELECT n_live_tup, n_dead_tup FROM pg_stat_user_tables WHERE schemaname = %s AND relname = %s",
+        (schema, name),
+    ).fetchone() or (0, 0)
+    size = conn.execute("SELECT pg_total_relation_size(%s::regclass)", (table,)).fetchone()[0]
+    return {"table_bytes": size, "live_tuples": live, "dead_tuples": dead}
+
+
+def run_phase(conn, strategy, table, rows, opts):
+    start_lsn = conn.execute("SELECT pg_current_wal_lsn()").fetchone()[0]
+    conn.commit()
+    t0 = time.perf_counter()
+    counts = LOADERS[strategy](conn, table, rows, opts)
+    secs = time.perf_counter() - t0
+    wal = conn.execute("SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), %s)::bigint", (start_lsn,)).fetchone()[0]
+    conn.commit()
+    return {
+        "rows": len(rows), "secs": round(secs, 3),
+        "rows_per_sec": round(len(rows) / secs, 1) if secs else None,
+        "wal_bytes": wal, "wal_bytes_per_row": round(wal / len(rows), 1) if rows else None,
+        **counts, "unchanged": len(rows) - counts["inserted"] - counts["updated"],
+        **_table_stats(conn, table),
+    }
+
+
+def ensure_results_table(conn):
+    if conn.execute("SELECT to_regclass('raw.bench_runs')").fetchone()[0] is None:
+        with open(SCHEMA_FILE, encoding='utf-8') as f:
+            conn.execute(f.read())
+        conn.commit()
+
+
+def _best_previous(conn, case_name):
+    row = conn.execute(
+        "SELECT max((metrics->>'rows_per_sec')::float) FROM raw.bench_runs WHERE suite = 'exporters' AND case_name = %s",
+        (case_name,),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument('--entity', default='invoices', choices=sorted(ENTITY_OF))
+    ap.add_argument('--sizes', default='10000,100000,1000000')
+    ap.add_argument('--strategies', default=','.join(STRATEGIES))
+    ap.add_argument('--batch', type=int, default=1000, help='filas por statement en batch')
+    ap.add_argument('--workers', type=int, default=4, help='conexiones en parallel')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--tolerance', type=float, default=0.10, help='caída de rows/s tolerada vs. el mejor previo')
+    ap.add_argument('--fail-on-regression', action='store_true')
+    ap.add_argument('--no-store', action='store_true', help='no guardar en raw.bench_runs')
+    opts = ap.parse_args(argv)
+    opts.dsn = pg_dsn()
+    strategies = [s.strip() for s in opts.strategies.split(',') if s.strip()]
+    unknown = set(strategies) - set(STRATEGIES)
+    if unknown:
+        ap.error(f"estrategias desconocidas: {sorted(unknown)}")
+
+    run_id = f"exporters_{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}_{uuid.uuid4().hex[:6]}"
+    git_rev, host = git_revision(), socket.gethostname()
+    regressions = 0
+
+    with psycopg.connect(opts.dsn) as conn:
+        if not opts.no_store:
+            ensure_results_table(conn)
+        conn.execute("CREATE SCHEMA IF NOT EXISTS bench")
+        conn.commit()
+
+        for size in (int(s) for s in opts.sizes.split(',') if s.strip()):
+            rows = payloads(opts.entity, size, opts.seed)
+            for strategy in strategies:
+                table = f"bench.qb_{opts.entity}_{strategy}"
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+                conn.execute(f"CREATE TABLE {table} (LIKE raw.qb_{opts.entity} INCLUDING ALL)")
+                conn.commit()
+
+                for phase in ('insert', 'reload'):
+                    metrics = run_phase(conn, strategy, table, rows, opts)
+                    case_name = f"{opts.entity}/{strategy}/{size}/{phase}"
+                    params = {"entity": opts.entity, "strategy": strategy, "size": size, "phase": phase,
+                              "batch": opts.batch, "workers": opts.workers, "seed": opts.seed}
+                    best = None if opts.no_store else _best_previous(conn, case_name)
+                    regression = bool(best and metrics["rows_per_sec"] is not None
+                                      and metrics["rows_per_sec"] < best * (1 - opts.tolerance))
+                    regressions += regression
+                    print(json.dumps({
+                        "bench": "exporters", "ts": _now_utc_iso(), "run_id": run_id, "case": case_name,
+                        **metrics, "best_rows_per_sec": best, "regression": regression,
+                    }), flush=True)
+                    if not opts.no_store:
+                        conn.execute(
+                            "INSERT INTO raw.bench_runs (run_id, suite, case_name, params, metrics, git_rev, host) "
+                            "VALUES (%s, 'exporters', %s, %s::jsonb, %s::jsonb, %s, %s)",
+                            (run_id, case_name, json.dumps(params), json.dumps(metrics), git_rev, host),
+                        )
+                        conn.commit()
+
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+                conn.commit()
+            del rows
+
+    if regressions and opts.fail_on_regression:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+Benchmark: CPU por millón de Invoices en el camino payload extract → load.
+
+Compara:
+  - baseline:    resp.json() (json stdlib sobre str) + json.dumps(payload) por fila en el exporter
+  - passthrough: utils.qbo_json.loads(bytes) + dumps(payload) por fila en el extractor
+                 (orjson si está instalado; si no, stdlib)
+
+Uso:
+  python benchmarks/bench_payload_codec.py [--invoices 50000] [--page-size 200] [--lines 5]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'mage'))
+
+from default_repo.utils import qbo_json  # noqa: E402
+
+
+def _invoice(i, n_lines):
+    return {
+        "Id": str(i),
+        "SyncToken": "0",
+        "DocNumber": f"INV-{i:07d}",
+        "TxnDate": "2025-01-15",
+        "DueDate": "2025-02-14",
+        "CurrencyRef": {"value": "USD", "name": "United States Dollar"},
+        "CustomerRef": {"value": str(1 + i % 500), "name": f"Customer {1 + i % 500}"},
+        "BillEmail": {"Address": f"billing{i % 500}@example.com"},
+        "Line": [
+            {
+                "Id": str(n + 1), "LineNum": n + 1, "Amount": 125.5,
+                "DetailType": "SalesItemLineDetail",
+                "Description": "Servicio profesional – consultoría",
+                "SalesItemLineDetail": {
+                    "ItemRef": {"value": str(1 + (i + n) % 100), "name": f"Item {1 + (i + n) % 100}"},
+                    "UnitPrice": 125.5, "Qty": 1, "TaxCodeRef": {"value": "NON"},
+                },
+            }
+            for n in range(n_lines)
+        ] + [{"Amount": 125.5 * n_lines, "DetailType": "SubTotalLineDetail", "SubTotalLineDetail": {}}],
+        "TotalAmt": 125.5 * n_lines,
+        "Balance": 0,
+        "MetaData": {
+            "CreateTime": "2025-01-15T10:35:08-08:00",
+            "LastUpdatedTime": "2025-01-16T09:12:44-08:00",
+        },
+    }
+
+
+def _page_bytes(start, page_size, n_lines):
+    rows = [_invoice(start + k, n_lines) for k in range(page_size)]
+    return json.dumps({
+        "QueryResponse": {"Invoice": rows, "startPosition": start, "maxResults": page_size},
+        "time": "2025-09-07T10:00:00.000-07:00",
+    }).encode()
+
+
+def _baseline(pages):
+    out = 0
+    for raw in pages:
+        rows = json.loads(raw.decode())["QueryResponse"]["Invoice"]   # resp.json()
+        for r in rows:
+            _ = r["Id"]
+            out += len(json.dumps(r))                                  # exporter
+    return out
+
+
+def _passthrough(pages):
+    out = 0
+    for raw in pages:
+        rows = qbo_json.loads(raw)["QueryResponse"]["Invoice"]
+        for r in rows:
+            _ = r["Id"]
+            out += len(qbo_json.dumps(r))                              # texto final → JSONB
+    return out
+
+
+def _cpu(fn, pages, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.process_time()
+        fn(pages)
+        dt = time.process_time() - t0
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--invoices', type=int, default=50000)
+    ap.add_argument('--page-size', type=int, default=200)
+    ap.add_argument('--lines', type=int, default=5)
+    ap.add_argument('--repeat', type=int, default=3)
+    args = ap.parse_args()
+
+    pages = [_page_bytes(p, args.page_size, args.lines)
+             for p in range(1, args.invoices + 1, args.page_size)]
+    n = len(pages) * args.page_size
+    scale = 1_000_000 / n
+
+    base = _cpu(_baseline, pages, args.repeat) * scale
+    fast = _cpu(_passthrough, pages, args.repeat) * scale
+
+    print(json.dumps({
+        "bench": "payload_codec",
+        "codec": "orjson" if qbo_json.HAS_ORJSON else "json (stdlib fallback)",
+        "invoices_measured": n,
+        "lines_per_invoice": args.lines,
+        "cpu_secs_per_1M_baseline": round(base, 2),
+        "cpu_secs_per_1M_passthrough": round(fast, 2),
+        "cpu_secs_saved_per_1M": round(base - fast, 2),
+        "speedup": round(base / fast, 2) if fast else None,
+    }))
+
+
+if __name__ == '__main__':
+    main()
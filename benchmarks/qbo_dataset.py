@@ -0,0 +1,326 @@
+"""
+Dataset QBO sintético y reproducible para pruebas de carga (1M+ filas).
+
+Misma semilla → mismos registros, byte a byte, para cada entidad por separado
+(agregar bills no cambia las facturas). Forma de los datos:
+  - Invoice: `Line` con 1..50 líneas SalesItemLineDetail (media `--lines`) + SubTotal;
+    CustomerRef / ItemRef sesgados (pocos clientes e items concentran el volumen);
+    ~60% se modifican después (LastUpdatedTime días más tarde, SyncToken > 0).
+  - Customer / Item: altas en días hábiles; ~4% / ~5% inactivos.
+  - Payment / Bill: opcionales, mismo sesgo temporal que las facturas.
+Tiempos con el sesgo de una compañía real (`--skew month_end`, default): fines de
+semana ×0.25, primer día del mes ×2, últimos tres días ×3 (último ×5, ×8 en
+cierre de trimestre), horario de oficina. `--skew uniform` reparte parejo.
+Los Id crecen con CreateTime; timestamps con offset -08:00 como los de QBO.
+
+Salidas:
+  --out DIR [--gzip]   <Entity>.ndjson(.gz) para `qbo_mock_server.py --dataset DIR`
+  --postgres           directo a raw.qb_* (COPY + upsert por (realm_id, id)), con una
+                       ventana filter_field='synthetic' en raw.extract_windows.
+                       Conexión: PG_DSN o PG_HOST/PG_PORT/PG_DB/PG_USER/PG_PASSWORD
+                       (defaults = docker-compose en localhost).
+
+Uso:
+  python benchmarks/qbo_dataset.py --invoices 1000000 --customers 50000 --items 2000 --out /tmp/qbo_1m --gzip
+  python benchmarks/qbo_dataset.py --invoices 1000000 --postgres --realm bench
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+from itertools import accumulate
+
+QBO_TZ = timezone(timedelta(hours=-8))
+ENTITIES = ('Customer', 'Item', 'Invoice', 'Payment', 'Bill')
+RAW_TABLES = {'Customer': 'customers', 'Item': 'items', 'Invoice': 'invoices', 'Payment': 'payments', 'Bill': 'bills'}
+MAX_LINES = 50
+
+
+def add_dataset_args(ap):
+    """Argumentos del dataset (compartidos con qbo_mock_server.py)."""
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--invoices', type=int, default=10000)
+    ap.add_argument('--customers', type=int, default=1000)
+    ap.add_argument('--items', type=int, default=200)
+    ap.add_argument('--payments', type=int, default=0)
+    ap.add_argument('--bills', type=int, default=0)
+    ap.add_argument('--lines', type=float, default=3.0, help='líneas promedio por factura')
+    ap.add_argument('--start', default='2024-01-01', help='primer día (fecha local de la compañía)')
+    ap.add_argument('--end', default='2025-01-01', help='día siguiente al último')
+    ap.add_argument('--skew', choices=('month_end', 'uniform'), default='month_end')
+    return ap
+
+
+def _stamp(dt):
+    return dt.isoformat(timespec='seconds')
+
+
+def _day_weight(d, skew):
+    if skew == 'uniform':
+        return 1.0
+    w = 0.25 if d.weekday() >= 5 else 1.0
+    to_end = ((d.replace(day=28) + timedelta(days=4)).replace(day=1) - d).days   # 1 = último día
+    if d.day == 1:
+        w *= 2.0
+    if to_end == 1:
+        w *= 8.0 if d.month in (3, 6, 9, 12) else 5.0
+    elif to_end <= 3:
+        w *= 3.0
+    return w
+
+
+# Hora local: pico en horario de oficina
+_HOURS = list(range(24))
+_HOUR_WEIGHTS = list(accumulate(8 if 9 <= h < 18 else (2 if 7 <= h < 21 else 0.2) for h in _HOURS))
+
+
+def timestamps(rng, n, start, end, skew):
+    """n instantes ordenados en [start, end) (fechas locales), con el sesgo pedido."""
+    days = [start + timedelta(days=k) for k in range((end - start).days)]
+    cum = list(accumulate(_day_weight(d, skew) for d in days))
+    picks = rng.choices(range(len(days)), cum_weights=cum, k=n)
+    hours = rng.choices(_HOURS, cum_weights=_HOUR_WEIGHTS, k=n)
+    out = [
+        datetime(d.year, d.month, d.day, h, rng.randrange(60), rng.randrange(60), tzinfo=QBO_TZ)
+        for d, h in zip((days[p] for p in picks), hours)
+    ]
+    out.sort()
+    return out
+
+
+def _skewed_ref(rng, n):
+    """Id 1..n: mitad con cola Pareto sobre los más antiguos (~2% de los ids concentra el volumen), mitad parejo."""
+    if rng.random() < 0.5:
+        k = int(rng.paretovariate(1.16) * max(1.0, n / 50))
+        if k <= n:
+            return k
+    return rng.randrange(1, n + 1)
+
+
+def _updated(rng, created, last, p, mean_days):
+    """(LastUpdatedTime, SyncToken): con probabilidad p, modificado días después (sin pasar `last`)."""
+    if rng.random() >= p:
+        return created, 0
+    later = created + timedelta(days=rng.expovariate(1 / mean_days))
+    return (min(later, last) if later > created else created), 1 + int(rng.expovariate(1.0))
+
+
+def item_price(i):
+    return round(5 + (i * 7919 % 2000) / 10, 2)
+
+
+def _bounds(args):
+    start, end = date.fromisoformat(args.start), date.fromisoformat(args.end)
+    if end <= start:
+        raise SystemExit("--end debe ser posterior a --start")
+    last = datetime(end.year, end.month, end.day, tzinfo=QBO_TZ) - timedelta(seconds=1)
+    return start, end, last
+
+
+def customers(args):
+    rng = random.Random(f"{args.seed}:Customer")
+    start, end, last = _bounds(args)
+    for i, created in enumerate(timestamps(rng, args.customers, start, end, 'uniform'), 1):
+        updated, sync = _updated(rng, created, last, 0.3, 60)
+        yield {
+            "Id": str(i), "SyncToken": str(sync), "DisplayName": f"Customer {i}",
+            "CompanyName": f"Company {i} LLC", "PrimaryEmailAddr": {"Address": f"billing{i}@example.com"},
+            "BillAddr": {"Line1": f"{100 + i % 900} Main St", "City": "Springfield", "PostalCode": f"{10000 + i % 89999}"},
+            "Balance": 0, "Taxable": bool(i % 2), "Active": rng.random() >= 0.04,
+            "MetaData": {"CreateTime": _stamp(created), "LastUpdatedTime": _stamp(updated)},
+        }
+
+
+def items(args):
+    rng = random.Random(f"{args.seed}:Item")
+    start, end, last = _bounds(args)
+    for i, created in enumerate(timestamps(rng, args.items, start, end, 'uniform'), 1):
+        updated, sync = _updated(rng, created, last, 0.2, 90)
+        yield {
+            "Id": str(i), "SyncToken": str(sync), "Name": f"Item {i}", "Sku": f"SKU-{i:06d}",
+            "Type": "Service" if i % 3 else "NonInventory", "UnitPrice": item_price(i),
+            "IncomeAccountRef": {"value": "79", "name": "Sales of Product Income"},
+            "Active": rng.random() >= 0.05,
+            "MetaData": {"CreateTime": _stamp(created), "LastUpdatedTime": _stamp(updated)},
+        }
+
+
+def invoices(args):
+    rng = random.Random(f"{args.seed}:Invoice")
+    start, end, last = _bounds(args)
+    n_customers, n_items = max(1, args.customers), max(1, args.items)
+    extra = max(0.0, args.lines - 1)
+    for i, created in enumerate(timestamps(rng, args.invoices, start, end, args.skew), 1):
+        n_lines = 1 + min(MAX_LINES - 1, int(rng.expovariate(1 / extra) + 0.5)) if extra else 1
+        lines, total = [], 0.0
+        for n in range(n_lines):
+            item = _skewed_ref(rng, n_items)
+            qty = 1 + int(rng.expovariate(0.5))
+            amount = round(item_price(item) * qty, 2)
+            total += amount
+            lines.append({
+                "Id": str(n + 1), "LineNum": n + 1, "Amount": amount, "DetailType": "SalesItemLineDetail",
+                "Description": f"Item {item}",
+                "SalesItemLineDetail": {
+                    "ItemRef": {"value": str(item), "name": f"Item {item}"},
+                    "UnitPrice": item_price(item), "Qty": qty, "TaxCodeRef": {"value": "NON"},
+                },
+            })
+        total = round(total, 2)
+        lines.append({"Amount": total, "DetailType": "SubTotalLineDetail", "SubTotalLineDetail": {}})
+        customer = _skewed_ref(rng, n_customers)
+        updated, sync = _updated(rng, created, last, 0.6, 20)
+        yield {
+            "Id": str(i), "SyncToken": str(sync), "DocNumber": f"INV-{i:07d}",
+            "TxnDate": created.date().isoformat(), "DueDate": (created.date() + timedelta(days=30)).isoformat(),
+            "CurrencyRef": {"value": "USD", "name": "United States Dollar"},
+            "CustomerRef": {"value": str(customer), "name": f"Customer {customer}"},
+            "BillEmail": {"Address": f"billing{customer}@example.com"},
+            "Line": lines, "TotalAmt": total, "Balance": 0 if sync else total,
+            "MetaData": {"CreateTime": _stamp(created), "LastUpdatedTime": _stamp(updated)},
+        }
+
+
+def payments(args):
+    rng = random.Random(f"{args.seed}:Payment")
+    start, end, _ = _bounds(args)
+    for i, created in enumerate(timestamps(rng, args.payments, start, end, args.skew), 1):
+        customer = _skewed_ref(rng, max(1, args.customers))
+        amount = round(rng.uniform(20, 5000), 2)
+        yield {
+            "Id": str(i), "SyncToken": "0", "TxnDate": created.date().isoformat(),
+            "CustomerRef": {"value": str(customer)}, "TotalAmt": amount, "UnappliedAmt": 0,
+            "Line": [{"Amount": amount, "LinkedTxn": [{"TxnId": str(1 + i % max(1, args.invoices)), "TxnType": "Invoice"}]}],
+            "MetaData": {"CreateTime": _stamp(created), "LastUpdatedTime": _stamp(created)},
+        }
+
+
+def bills(args):
+    rng = random.Random(f"{args.seed}:Bill")
+    start, end, last = _bounds(args)
+    for i, created in enumerate(timestamps(rng, args.bills, start, end, args.skew), 1):
+        amount = round(rng.uniform(50, 8000), 2)
+        updated, sync = _updated(rng, created, last, 0.5, 25)
+        yield {
+            "Id": str(i), "SyncToken": str(sync), "TxnDate": created.date().isoformat(),
+            "VendorRef": {"value": str(1 + i % 50)}, "TotalAmt": amount, "Balance": 0 if sync else amount,
+            "Line": [{"Amount": amount, "DetailType": "AccountBasedExpenseLineDetail",
+                      "AccountBasedExpenseLineDetail": {"AccountRef": {"value": "7"}}}],
+            "MetaData": {"CreateTime": _stamp(created), "LastUpdatedTime": _stamp(updated)},
+        }
+
+
+GENERATORS = {'Customer': customers, 'Item': items, 'Invoice': invoices, 'Payment': payments, 'Bill': bills}
+
+
+def dataset(args):
+    """{Entity: iterador de registros} para las entidades con cantidad > 0 (perezoso)."""
+    counts = {'Customer': args.customers, 'Item': args.items, 'Invoice': args.invoices,
+              'Payment': args.payments, 'Bill': args.bills}
+    return {name: GENERATORS[name](args) for name in ENTITIES if counts[name] > 0}
+
+
+def dumps(record):
+    return json.dumps(record, separators=(',', ':'), ensure_ascii=False)
+
+
+# ====== Salidas ======
+def write_ndjson(args, out_dir, compress=False):
+    os.makedirs(out_dir, exist_ok=True)
+    summary = {}
+    for name, records in dataset(args).items():
+        path = os.path.join(out_dir, f"{name}.ndjson" + (".gz" if compress else ""))
+        opener = (lambda p: gzip.open(p, 'wt', encoding='utf-8', compresslevel=3)) if compress else \
+                 (lambda p: open(p, 'w', encoding='utf-8'))
+        t0, n = time.perf_counter(), 0
+        with opener(path) as f:
+            for r in records:
+                f.write(dumps(r))
+                f.write('\n')
+                n += 1
+        summary[name] = {"rows": n, "bytes": os.path.getsize(path), "secs": round(time.perf_counter() - t0, 2)}
+        print(json.dumps({"dataset": name, "path": path, **summary[name]}), flush=True)
+    return summary
+
+
+def pg_dsn():
+    if os.environ.get('PG_DSN'):
+        return os.environ['PG_DSN']
+    env = os.environ.get
+    return (f"host={env('PG_HOST') or 'localhost'} port={env('PG_PORT') or 5432} "
+            f"dbname={env('PG_DB') or 'dm'} user={env('PG_USER') or 'dm_user'} "
+            f"password={env('PG_PASSWORD') or 'dm_password'}")
+
+
+WINDOW_SQL = """
+INSERT INTO raw.extract_windows (realm_id, entity, window_start_utc, window_end_utc, page_size, filter_field)
+VALUES (%s, %s, %s, %s, 0, 'synthetic')
+ON CONFLICT (realm_id, entity, window_start_utc, window_end_utc, page_size, filter_field)
+DO UPDATE SET entity = EXCLUDED.entity
+RETURNING window_id;
+"""
+
+MERGE_SQL = """
+INSERT INTO raw.qb_{table} (realm_id, id, payload, ingested_at_utc, window_id)
+SELECT %(realm_id)s, id, payload::jsonb, %(ingested_at)s, %(window_id)s FROM _synthetic
+ON CONFLICT (realm_id, id) DO UPDATE SET
+    payload = EXCLUDED.payload,
+    ingested_at_utc = EXCLUDED.ingested_at_utc,
+    window_id = EXCLUDED.window_id;
+"""
+
+
+def write_postgres(args, realm_id, dsn=None):
+    """Carga directa a raw.qb_*: COPY a una tabla temporal + upsert, un COMMIT por entidad."""
+    import psycopg   # sólo para esta salida
+
+    start, end, _ = _bounds(args)
+    w_start = datetime(start.year, start.month, start.day, tzinfo=QBO_TZ)
+    w_end = datetime(end.year, end.month, end.day, tzinfo=QBO_TZ)
+    summary = {}
+    with psycopg.connect(dsn or pg_dsn()) as conn:
+        for name, records in dataset(args).items():
+            table = RAW_TABLES[name]
+            if conn.execute("SELECT to_regclass(%s)", (f"raw.qb_{table}",)).fetchone()[0] is None:
+                print(json.dumps({"dataset": name, "status": "skipped", "reason": f"no existe raw.qb_{table}"}))
+                continue
+            t0, n = time.perf_counter(), 0
+            with conn.cursor() as cur:
+                cur.execute(WINDOW_SQL, (realm_id, table, w_start, w_end))
+                window_id = cur.fetchone()[0]
+                cur.execute("CREATE TEMP TABLE _synthetic (id TEXT, payload TEXT) ON COMMIT DROP")
+                with cur.copy("COPY _synthetic (id, payload) FROM STDIN") as copy:
+                    for r in records:
+                        copy.write_row((r["Id"], dumps(r)))
+                        n += 1
+                cur.execute(MERGE_SQL.format(table=table), {
+                    "realm_id": realm_id, "ingested_at": datetime.now(timezone.utc), "window_id": window_id,
+                })
+            conn.commit()
+            summary[name] = {"rows": n, "secs": round(time.perf_counter() - t0, 2)}
+            print(json.dumps({"dataset": name, "table": f"raw.qb_{table}", "realm_id": realm_id, **summary[name]}),
+                  flush=True)
+    return summary
+
+
+def main(argv=None):
+    ap = add_dataset_args(argparse.ArgumentParser(description=__doc__.splitlines()[1]))
+    ap.add_argument('--out', help='directorio de salida para <Entity>.ndjson')
+    ap.add_argument('--gzip', action='store_true')
+    ap.add_argument('--postgres', action='store_true', help='cargar directo a raw.qb_*')
+    ap.add_argument('--realm', default='synthetic', help='realm_id de las filas en RAW')
+    args = ap.parse_args(argv)
+    if not args.out and not args.postgres:
+        ap.error("indicar --out DIR y/o --postgres")
+    if args.out:
+        write_ndjson(args, args.out, args.gzip)
+    if args.postgres:
+        write_postgres(args, args.realm)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,510 @@
+"""
+Servidor QBO local para medir y probar el camino de extracción sin sandbox de Intuit.
+
+Endpoints (lo que usan los extractores, más batch y CDC):
+  - POST /oauth2/v1/tokens/bearer                        → access_token (vive --token-ttl s)
+  - POST|GET /v3/company/<realm>/query                   → QueryResponse (SQL en el body o ?query=)
+  - POST /v3/company/<realm>/batch                       → BatchItemResponse (hasta 30 queries)
+  - GET  /v3/company/<realm>/cdc?entities=..&changedSince=..  → CDCResponse
+  - GET  /__stats                                        → requests por endpoint y status
+
+SQL: el subconjunto que arman utils/qbo_client.py, active_range,
+snapshot y repair (palabras clave sin distinguir mayúsculas, como QBO):
+
+    select * | count(*) from <Entity> [where <cond> [and <cond> ...]]
+    [orderby <campo> [asc|desc]] [startposition N] [maxresults M]
+    cond: <campo> (= | != | < | <= | > | >=) <valor> | <campo> in (<valor>, ...)
+
+Campos con puntos (MetaData.LastUpdatedTime); timestamps con offset se comparan
+como instantes, fechas (TxnDate) como texto. Como QBO, Item y Customer sin
+condición sobre Active devuelven sólo activos; maxresults default 100, tope 1000.
+
+Datos: el dataset de qbo_dataset.py (mismos argumentos: --seed, --invoices,
+--customers, --items, --payments, --bills, --lines, --skew, --start, --end) o,
+con --dataset DIR, los <Entity>.ndjson(.gz) que escribió `qbo_dataset.py --out`.
+Todos los realms ven el mismo dataset. Las filas se guardan como texto JSON.
+
+Fallas (por request a /query, /batch y /cdc):
+  --latency-ms / --jitter-ms   latencia agregada (uniforme en ±jitter)
+  --p429 / --p5xx              probabilidad de 429 / 503
+  --rate-per-min               requests por realm en 60 s móviles; el excedente → 429
+  --max-concurrent             requests en vuelo por realm; el excedente → 429
+  --token-ttl                  segundos de vida del access_token; vencido → 401
+
+Uso:
+  python benchmarks/qbo_mock_server.py --port 8765 --invoices 200000 --latency-ms 150 --p429 0.01
+  export QBO_BASE_URL=http://127.0.0.1:8765
+  export QBO_TOKEN_URL=http://127.0.0.1:8765/oauth2/v1/tokens/bearer
+  (QBO_CLIENT_ID / QBO_CLIENT_SECRET / QBO_REFRESH_TOKEN con cualquier valor)
+"""
+import argparse
+import bisect
+import gzip
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from qbo_dataset import add_dataset_args, dataset, dumps as compact
+
+MAX_RESULTS = 1000
+DEFAULT_RESULTS = 100
+MAX_BATCH_ITEMS = 30
+QBO_TZ = timezone(timedelta(hours=-8))   # QBO devuelve hora local de la compañía con offset
+
+_TS_RE = re.compile(r'^\d{4}-\d{2}-\d{2}T')
+_SQL_RE = re.compile(
+    r"^\s*select\s+(?P<what>\*|count\(\*\))\s+from\s+(?P<entity>\w+)"
+    r"(?:\s+where\s+(?P<where>.*?))?"
+    r"(?:\s+orderby\s+(?P<order>[\w.]+)(?:\s+(?P<dir>asc|desc))?)?"
+    r"(?:\s+startposition\s+(?P<start>\d+))?"
+    r"(?:\s+maxresults\s+(?P<max>\d+))?\s*$",
+    re.I | re.S,
+)
+_VALUE = r"'(?:[^'\\]|\\.)*'|true|false|-?[\d.]+"
+_COND_RE = re.compile(
+    rf"\s*(?P<field>[\w.]+)\s*(?:(?P<op>>=|<=|!=|=|<|>)\s*(?P<val>{_VALUE})"
+    rf"|(?P<in>in)\s*\((?P<list>[^)]*)\))\s*(?:and\b|$)",
+    re.I,
+)
+
+
+class QueryError(ValueError):
+    """SQL fuera del subconjunto soportado → 400 ValidationFault."""
+
+
+def _now_iso():
+    return datetime.now(QBO_TZ).isoformat(timespec='milliseconds')
+
+
+def _literal(text):
+    text = text.strip()
+    if text.startswith("'"):
+        return _coerce(text[1:-1].replace("\\'", "'"))
+    if text.lower() in ('true', 'false'):
+        return text.lower() == 'true'
+    return text
+
+
+def _coerce(value):
+    """Timestamps ISO con offset → datetime (comparables entre offsets); el resto tal cual."""
+    if isinstance(value, str) and _TS_RE.match(value):
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return value
+    return value
+
+
+def parse_sql(sql):
+    m = _SQL_RE.match(sql or '')
+    if not m:
+        raise QueryError(f"query no soportada: {sql!r}")
+    conds = []
+    where = (m.group('where') or '').strip()
+    pos = 0
+    while pos < len(where):
+        c = _COND_RE.match(where, pos)
+        if not c or c.end() == pos:
+            raise QueryError(f"condición no soportada: {where[pos:]!r}")
+        if c.group('in'):
+            values = [_literal(v) for v in re.findall(_VALUE, c.group('list'), re.I)]
+            conds.append((c.group('field'), 'in', values))
+        else:
+            conds.append((c.group('field'), c.group('op'), _literal(c.group('val'))))
+        pos = c.end()
+    return {
+        "count": m.group('what') != '*',
+        "entity": m.group('entity'),
+        "conds": conds,
+        "order": m.group('order'),
+        "desc": (m.group('dir') or '').lower() == 'desc',
+        "start": int(m.group('start') or 1),
+        "max": min(MAX_RESULTS, int(m.group('max') or DEFAULT_RESULTS)),
+    }
+
+
+# ====== Datos ======
+def _field(record, path):
+    """'MetaData.LastUpdatedTime' sin distinguir mayúsculas."""
+    for part in path.split('.'):
+        if not isinstance(record, dict):
+            return None
+        if part in record:
+            record = record[part]
+            continue
+        record = next((v for k, v in record.items() if k.lower() == part.lower()), None)
+    return record
+
+
+INDEXED = ('Id', 'Active', 'MetaData.CreateTime', 'MetaData.LastUpdatedTime', 'TxnDate')
+
+
+def _value(record, field):
+    v = _field(record, field)
+    if v is None:
+        return True if field.lower() == 'active' else None
+    return _coerce(v)
+
+
+class Table:
+    """
+    Filas de una entidad como texto JSON (las páginas se arman sin re-serializar)
+    + columnas para filtrar: las de INDEXED al cargar, el resto a demanda.
+    """
+
+    def __init__(self, name, records):
+        """records: iterable de (texto JSON, dict)."""
+        self.name = name
+        self.rows = []
+        self._columns = {f.lower(): [] for f in INDEXED}
+        for text, record in records:
+            self.rows.append(text)
+            for f in INDEXED:
+                self._columns[f.lower()].append(_value(record, f))
+        self._sorted = {}
+        self._lock = threading.Lock()
+
+    def column(self, field):
+        key = field.lower()
+        col = self._columns.get(key)
+        if col is None:
+            col = [_value(json.loads(text), field) for text in self.rows]
+            with self._lock:
+                self._columns[key] = col
+        return col
+
+    def sorted_index(self, field):
+        key = field.lower()
+        idx = self._sorted.get(key)
+        if idx is None:
+            col = self.column(field)
+            pairs = sorted((v, i) for i, v in enumerate(col) if v is not None)
+            idx = ([v for v, _ in pairs], [i for _, i in pairs])
+            with self._lock:
+                self._sorted[key] = idx
+        return idx
+
+
+class RawRows:
+    """Filas ya serializadas; `render` las inserta tal cual en la respuesta."""
+
+    def __init__(self, texts):
+        self.texts = texts
+
+
+def render(body):
+    """json.dumps de la respuesta con los RawRows pegados como arrays JSON."""
+    blocks = []
+
+    def placeholder(obj):
+        if isinstance(obj, RawRows):
+            blocks.append(obj.texts)
+            return f"\0raw{len(blocks) - 1}"
+        raise TypeError(type(obj).__name__)
+
+    text = json.dumps(body, default=placeholder)
+    for k, texts in enumerate(blocks):
+        text = text.replace(f'"\\u0000raw{k}"', "[" + ",".join(texts) + "]", 1)
+    return text
+
+
+_OPS = {
+    '=': lambda a, b: a == b, '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b, '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b, '>=': lambda a, b: a >= b,
+    'in': lambda a, b: a in b,
+}
+
+
+def _match(value, op, target):
+    if value is None:
+        return False
+    try:
+        return _OPS[op](value, target)
+    except TypeError:   # fecha vs timestamp, etc.
+        return _OPS[op](str(value), str(target))
+
+
+def run_query(tables, q):
+    table = tables.get(q['entity'].lower())
+    if table is None:
+        raise QueryError(f"entidad desconocida: {q['entity']}")
+    conds = list(q['conds'])
+    if table.name in ('Item', 'Customer') and not any(f.lower() == 'active' for f, _, _ in conds):
+        conds.append(('Active', '=', True))
+
+    # Rango sobre un campo → bisect sobre el índice ordenado; el resto se filtra fila a fila
+    ranged = next((f for f, op, _ in conds if op in ('<', '<=', '>', '>=')), None)
+    try:
+        keys, idxs = table.sorted_index(ranged) if ranged else (None, None)
+    except TypeError:   # columna con tipos mezclados: sin índice
+        ranged = None
+    if ranged:
+        lo, hi = 0, len(keys)
+        rest = []
+        for f, op, v in conds:
+            if f.lower() != ranged.lower() or op not in ('<', '<=', '>', '>='):
+                rest.append((f, op, v))
+                continue
+            try:
+                if op == '>=':
+                    lo = max(lo, bisect.bisect_left(keys, v))
+                elif op == '>':
+                    lo = max(lo, bisect.bisect_right(keys, v))
+                elif op == '<':
+                    hi = min(hi, bisect.bisect_left(keys, v))
+                else:
+                    hi = min(hi, bisect.bisect_right(keys, v))
+            except TypeError:
+                rest.append((f, op, v))
+        candidates = sorted(idxs[lo:hi]) if lo < hi else []
+    else:
+        candidates, rest = range(len(table.rows)), conds
+
+    for f, op, v in rest:
+        col = table.column(f)
+        candidates = [i for i in candidates if _match(col[i], op, v)]
+    candidates = list(candidates)
+
+    if q['count']:
+        return {"totalCount": len(candidates)}
+    if q['order']:
+        col = table.column(q['order'])
+        candidates.sort(key=lambda i: (col[i] is None, col[i]), reverse=q['desc'])
+    page = candidates[q['start'] - 1:q['start'] - 1 + q['max']]
+    if not page:
+        return {}
+    return {table.name: RawRows([table.rows[i] for i in page]), "startPosition": q['start'], "maxResults": len(page)}
+
+
+def load_dataset(path):
+    """{Entity: (texto, dict)} desde <Entity>.ndjson(.gz) (salida de qbo_dataset.py --out)."""
+    def rows(file_path):
+        opener = gzip.open if file_path.endswith('.gz') else open
+        with opener(file_path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line, json.loads(line)
+
+    data = {}
+    for name in sorted(os.listdir(path)):
+        for ext in ('.ndjson', '.ndjson.gz'):
+            if name.endswith(ext):
+                data[name[:-len(ext)]] = rows(os.path.join(path, name))
+    return data
+
+
+def synthetic(args):
+    """{Entity: (texto, dict)} generado con qbo_dataset.py (mismos argumentos y semilla)."""
+    return {name: ((compact(r), r) for r in records) for name, records in dataset(args).items()}
+
+
+# ====== Servidor ======
+class MockState:
+    def __init__(self, args, dataset):
+        self.args = args
+        self.tables = {name.lower(): Table(name, records) for name, records in dataset.items()}
+        self.tokens = {}
+        self.window = {}        # realm → deque de timestamps (rate limit)
+        self.in_flight = Counter()
+        self.stats = Counter()
+        self.lock = threading.Lock()
+        self.rng = random.Random(args.seed)
+
+    def issue_token(self):
+        token = f"mock-{uuid.uuid4().hex}"
+        with self.lock:
+            self.tokens[token] = time.time() + self.args.token_ttl
+        return token
+
+    def token_ok(self, header):
+        token = (header or '')[len('Bearer '):]
+        with self.lock:
+            return self.tokens.get(token, 0) > time.time()
+
+    def admit(self, realm):
+        """None si el request pasa; (status, motivo) si se rechaza. Toma un lugar en vuelo."""
+        a = self.args
+        with self.lock:
+            now = time.time()
+            w = self.window.setdefault(realm, deque())
+            while w and w[0] < now - 60:
+                w.popleft()
+            if a.rate_per_min and len(w) >= a.rate_per_min:
+                return 429, "ThrottleExceeded: rate"
+            if a.max_concurrent and self.in_flight[realm] >= a.max_concurrent:
+                return 429, "ThrottleExceeded: concurrency"
+            roll = self.rng.random()
+            w.append(now)
+            if roll < a.p429:
+                return 429, "ThrottleExceeded: injected"
+            if roll < a.p429 + a.p5xx:
+                return 503, "ServiceUnavailable: injected"
+            self.in_flight[realm] += 1
+            delay = max(0.0, a.latency_ms + self.rng.uniform(-a.jitter_ms, a.jitter_ms)) / 1000
+        time.sleep(delay)
+        return None
+
+    def release(self, realm):
+        with self.lock:
+            self.in_flight[realm] -= 1
+
+
+def _fault(kind, message, code):
+    return {"Fault": {"Error": [{"Message": message, "code": code}], "type": kind}, "time": _now_iso()}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # keep-alive, como la requests.Session de QboClient
+    state = None
+
+    def log_message(self, fmt, *args):
+        if self.state.args.verbose:
+            super().log_message(fmt, *args)
+
+    def _send(self, status, body, endpoint):
+        raw = render(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+        with self.state.lock:
+            self.state.stats[f"{endpoint}:{status}"] += 1
+
+    def _body(self):
+        n = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(n).decode('utf-8') if n else ''
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_POST(self):
+        self._route('POST')
+
+    def _route(self, method):
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        params = parse_qs(url.query)
+        body = self._body() if method == 'POST' else ''
+
+        if url.path == '/__stats':
+            return self._send(200, dict(self.state.stats), 'stats')
+        if url.path.endswith('/oauth2/v1/tokens/bearer') and method == 'POST':
+            form = parse_qs(body)
+            if form.get('grant_type') != ['refresh_token'] or not form.get('refresh_token'):
+                return self._send(400, {"error": "invalid_grant"}, 'token')
+            return self._send(200, {
+                "access_token": self.state.issue_token(), "token_type": "bearer",
+                "expires_in": self.state.args.token_ttl, "refresh_token": form['refresh_token'][0],
+                "x_refresh_token_expires_in": 8726400,
+            }, 'token')
+        if len(parts) != 4 or parts[:2] != ['v3', 'company'] or parts[3] not in ('query', 'batch', 'cdc'):
+            return self._send(404, _fault("ValidationFault", f"ruta desconocida {url.path}", "4000"), 'unknown')
+
+        realm, endpoint = parts[2], parts[3]
+        if not self.state.token_ok(self.headers.get('Authorization')):
+            return self._send(401, _fault("AuthenticationFault", "AuthenticationFailed", "3200"), endpoint)
+        rejected = self.state.admit(realm)
+        if rejected:
+            status, message = rejected
+            return self._send(status, _fault("SystemFault", message, str(status)), endpoint)
+        try:
+            status, payload = getattr(self, f"_{endpoint}")(method, params, body)
+        finally:
+            self.state.release(realm)
+        self._send(status, payload, endpoint)
+
+    def _query(self, method, params, body):
+        sql = body if method == 'POST' else (params.get('query') or [''])[0]
+        try:
+            return 200, {"QueryResponse": run_query(self.state.tables, parse_sql(sql)), "time": _now_iso()}
+        except QueryError as e:
+            return 400, _fault("ValidationFault", str(e), "4000")
+
+    def _batch(self, method, params, body):
+        try:
+            items = json.loads(body or '{}').get("BatchItemRequest") or []
+        except ValueError:
+            return 400, _fault("ValidationFault", "body JSON inválido", "4000")
+        if len(items) > MAX_BATCH_ITEMS:
+            return 400, _fault("ValidationFault", f"más de {MAX_BATCH_ITEMS} operaciones", "4000")
+        out = []
+        for item in items:
+            try:
+                res = run_query(self.state.tables, parse_sql(item.get("Query")))
+                out.append({"bId": item.get("bId"), "QueryResponse": res})
+            except QueryError as e:
+                out.append({"bId": item.get("bId"), **_fault("ValidationFault", str(e), "4000")})
+        return 200, {"BatchItemResponse": out, "time": _now_iso()}
+
+    def _cdc(self, method, params, body):
+        since = _coerce((params.get('changedSince') or [''])[0])
+        if not isinstance(since, datetime):
+            return 400, _fault("ValidationFault", "changedSince requerido (ISO con offset)", "4000")
+        responses = []
+        for name in (params.get('entities') or [''])[0].split(','):
+            if not name.strip():
+                continue
+            q = {"count": False, "entity": name.strip(), "order": None, "desc": False,
+                 "start": 1, "max": MAX_RESULTS, "conds": [('MetaData.LastUpdatedTime', '>=', since)]}
+            try:
+                responses.append(run_query(self.state.tables, q))
+            except QueryError as e:
+                return 400, _fault("ValidationFault", str(e), "4000")
+        return 200, {"CDCResponse": [{"QueryResponse": responses}], "time": _now_iso()}
+
+
+def serve(args, dataset):
+    """Levanta el servidor (bloqueante salvo que se use en un hilo). Devuelve el ThreadingHTTPServer."""
+    handler = type('MockHandler', (Handler,), {"state": MockState(args, dataset)})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def build_parser():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=8765)
+    ap.add_argument('--dataset', help='directorio con <Entity>.ndjson(.gz) (reemplaza al dataset sintético)')
+    add_dataset_args(ap)   # --seed, --invoices, --customers, ... (qbo_dataset.py)
+    ap.add_argument('--latency-ms', type=float, default=0.0)
+    ap.add_argument('--jitter-ms', type=float, default=0.0)
+    ap.add_argument('--p429', type=float, default=0.0)
+    ap.add_argument('--p5xx', type=float, default=0.0)
+    ap.add_argument('--rate-per-min', type=int, default=0, help='0 = sin límite')
+    ap.add_argument('--max-concurrent', type=int, default=0, help='0 = sin límite')
+    ap.add_argument('--token-ttl', type=int, default=3600)
+    ap.add_argument('--verbose', action='store_true')
+    return ap
+
+
+def main():
+    args = build_parser().parse_args()
+    t0 = time.perf_counter()
+    server = serve(args, load_dataset(args.dataset) if args.dataset else synthetic(args))
+    print(json.dumps({
+        "mock": "qbo", "listen": f"http://{args.host}:{args.port}",
+        "rows": {t.name: len(t.rows) for t in server.RequestHandlerClass.state.tables.values()},
+        "load_secs": round(time.perf_counter() - t0, 2),
+    }), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+-- Columnas generadas (STORED) + índices para los campos JSONB más consultados.
+-- Evitan decodificar/detoastear `payload` en watermarks, reconciliación y upserts.
+-- Idempotente: puede re-ejecutarse sobre una base ya creada con 001_raw_schema.sql.
+-- Nota: ADD COLUMN ... GENERATED reescribe la tabla (lock ACCESS EXCLUSIVE);
+-- en tablas grandes ejecutar en ventana de mantenimiento.
+
+-- Los casts text -> timestamptz no son IMMUTABLE (dependen de TimeZone), por lo que
+-- no pueden usarse directo en una columna generada. QBO envía el offset explícito
+-- (ej. '2015-07-24T10:35:08-07:00'); un valor sin offset se interpretaría con la
+-- TimeZone de la sesión, así que la función fija TimeZone = 'UTC' para que el
+-- resultado sea determinista (y el IMMUTABLE sea cierto) en cualquier caso.
+-- Si la función ya existía sin SET, las filas sin offset cargadas desde sesiones con
+-- otra TimeZone se recalculan con un UPDATE no-op (ej. SET payload = payload).
+CREATE OR REPLACE FUNCTION raw.qbo_ts(txt TEXT) RETURNS TIMESTAMPTZ
+LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+SET TimeZone = 'UTC'
+AS $$ SELECT txt::timestamptz $$;
+
+-- Campos DATE de QBO ('YYYY-MM-DD'); make_date es IMMUTABLE, a diferencia de ::date.
+CREATE OR REPLACE FUNCTION raw.qbo_date(txt TEXT) RETURNS DATE
+LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+AS $$ SELECT make_date(substr(txt, 1, 4)::int, substr(txt, 6, 2)::int, substr(txt, 9, 2)::int) $$;
+
+-- Customers (ventana por MetaData.CreateTime)
+ALTER TABLE raw.qb_customers
+  ADD COLUMN IF NOT EXISTS create_time TIMESTAMPTZ
+    GENERATED ALWAYS AS (raw.qbo_ts(payload->'MetaData'->>'CreateTime')) STORED,
+  ADD COLUMN IF NOT EXISTS last_updated_time TIMESTAMPTZ
+    GENERATED ALWAYS AS (raw.qbo_ts(payload->'MetaData'->>'LastUpdatedTime')) STORED,
+  ADD COLUMN IF NOT EXISTS sync_token INTEGER
+    GENERATED ALWAYS AS ((payload->>'SyncToken')::int) STORED;
+
+CREATE INDEX IF NOT EXISTS qb_customers_create_time_idx       ON raw.qb_customers (create_time);
+CREATE INDEX IF NOT EXISTS qb_customers_last_updated_time_idx ON raw.qb_customers (last_updated_time);
+
+-- Items (ventana por MetaData.LastUpdatedTime)
+ALTER TABLE raw.qb_items
+  ADD COLUMN IF NOT EXISTS create_time TIMESTAMPTZ
+    GENERATED ALWAYS AS (raw.qbo_ts(payload->'MetaData'->>'CreateTime')) STORED,
+  ADD COLUMN IF NOT EXISTS last_updated_time TIMESTAMPTZ
+    GENERATED ALWAYS AS (raw.qbo_ts(payload->'MetaData'->>'LastUpdatedTime')) STORED,
+  ADD COLUMN IF NOT EXISTS sync_token INTEGER
+    GENERATED ALWAYS AS ((payload->>'SyncToken')::int) STORED;
+
+CREATE INDEX IF NOT EXISTS qb_items_last_updated_time_idx ON raw.qb_items (last_updated_time);
+
+-- Invoices (ventana por MetaData.LastUpdatedTime o TxnDate)
+ALTER TABLE raw.qb_invoices
+  ADD COLUMN IF NOT EXISTS txn_date DATE
+    GENERATED ALWAYS AS (raw.qbo_date(payload->>'TxnDate')) STORED,
+  ADD COLUMN IF NOT EXISTS customer_ref TEXT
+    GENERATED ALWAYS AS (payload->'CustomerRef'->>'value') STORED,
+  ADD COLUMN IF NOT EXISTS last_updated_time TIMESTAMPTZ
+    GENERATED ALWAYS AS (raw.qbo_ts(payload->'MetaData'->>'LastUpdatedTime')) STORED,
+  ADD COLUMN IF NOT EXISTS sync_token INTEGER
+    GENERATED ALWAYS AS ((payload->>'SyncToken')::int) STORED;
+
+CREATE INDEX IF NOT EXISTS qb_invoices_txn_date_idx          ON raw.qb_invoices (txn_date);
+CREATE INDEX IF NOT EXISTS qb_invoices_customer_ref_idx      ON raw.qb_invoices (customer_ref);
+CREATE INDEX IF NOT EXISTS qb_invoices_last_updated_time_idx ON raw.qb_invoices (last_updated_time);
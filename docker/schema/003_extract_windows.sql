@@ -0,0 +1,91 @@
+-- Metadatos por tramo normalizados: antes cada fila RAW repetía ventana, page_size
+-- y request_payload (JSONB). Ahora las filas guardan sólo (window_id, page_number)
+-- y las vistas raw.v_qb_* (definidas en 006_multi_realm.sql, con realm_id) exponen
+-- las columnas originales.
+-- Idempotente: puede re-ejecutarse sobre una base con 001/002 aplicados.
+
+CREATE TABLE IF NOT EXISTS raw.extract_windows (
+  window_id BIGSERIAL PRIMARY KEY,
+  entity TEXT NOT NULL,
+  window_start_utc TIMESTAMP WITH TIME ZONE NOT NULL,
+  window_end_utc TIMESTAMP WITH TIME ZONE NOT NULL,
+  page_size INTEGER NOT NULL,
+  filter_field TEXT NOT NULL,
+  created_at_utc TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  UNIQUE (entity, window_start_utc, window_end_utc, page_size, filter_field)
+);
+
+-- Columnas legacy pasan a ser opcionales (NULL no ocupa espacio en la tupla).
+ALTER TABLE raw.qb_customers
+  ADD COLUMN IF NOT EXISTS window_id BIGINT REFERENCES raw.extract_windows (window_id),
+  ALTER COLUMN extract_window_start_utc DROP NOT NULL,
+  ALTER COLUMN extract_window_end_utc DROP NOT NULL;
+
+ALTER TABLE raw.qb_items
+  ADD COLUMN IF NOT EXISTS window_id BIGINT REFERENCES raw.extract_windows (window_id),
+  ALTER COLUMN extract_window_start_utc DROP NOT NULL,
+  ALTER COLUMN extract_window_end_utc DROP NOT NULL;
+
+ALTER TABLE raw.qb_invoices
+  ADD COLUMN IF NOT EXISTS window_id BIGINT REFERENCES raw.extract_windows (window_id),
+  ALTER COLUMN extract_window_start_utc DROP NOT NULL,
+  ALTER COLUMN extract_window_end_utc DROP NOT NULL;
+
+CREATE INDEX IF NOT EXISTS qb_customers_window_id_idx ON raw.qb_customers (window_id);
+CREATE INDEX IF NOT EXISTS qb_items_window_id_idx     ON raw.qb_items (window_id);
+CREATE INDEX IF NOT EXISTS qb_invoices_window_id_idx  ON raw.qb_invoices (window_id);
+
+-- Vistas raw.v_qb_customers / v_qb_items / v_qb_invoices (contrato RAW original):
+-- una sola definición, en 006_multi_realm.sql. Definirlas también acá (sin realm_id)
+-- haría fallar la re-ejecución de este archivo ("cannot drop columns from view").
+
+-- Migración opcional de filas cargadas antes de este script (no-op en bases nuevas).
+-- Sólo se vacían extract_window_start/end_utc: son timestamptz y el join es por
+-- igualdad, así que la vista los devuelve idénticos desde raw.extract_windows.
+-- request_payload y page_size de esas filas se conservan tal cual: reconstruirlos
+-- (to_char, COALESCE a 200) perdería el texto original del request, sus fracciones
+-- de segundo y los page_size NULL. Las filas nuevas ya no los escriben.
+-- Tras ejecutarla, VACUUM FULL (o pg_repack) recupera el espacio liberado.
+INSERT INTO raw.extract_windows (entity, window_start_utc, window_end_utc, page_size, filter_field)
+SELECT DISTINCT 'customers', extract_window_start_utc, extract_window_end_utc, COALESCE(page_size, 200),
+       COALESCE(request_payload->>'filter_field', 'MetaData.CreateTime')
+FROM raw.qb_customers WHERE window_id IS NULL AND extract_window_start_utc IS NOT NULL
+UNION
+SELECT DISTINCT 'items', extract_window_start_utc, extract_window_end_utc, COALESCE(page_size, 200),
+       COALESCE(request_payload->>'filter_field', 'MetaData.LastUpdatedTime')
+FROM raw.qb_items WHERE window_id IS NULL AND extract_window_start_utc IS NOT NULL
+UNION
+SELECT DISTINCT 'invoices', extract_window_start_utc, extract_window_end_utc, COALESCE(page_size, 200),
+       COALESCE(request_payload->>'filter_field', 'MetaData.LastUpdatedTime')
+FROM raw.qb_invoices WHERE window_id IS NULL AND extract_window_start_utc IS NOT NULL
+ON CONFLICT DO NOTHING;
+
+UPDATE raw.qb_customers r SET
+  window_id = w.window_id,
+  extract_window_start_utc = NULL, extract_window_end_utc = NULL
+FROM raw.extract_windows w
+WHERE r.window_id IS NULL AND w.entity = 'customers'
+  AND w.window_start_utc = r.extract_window_start_utc
+  AND w.window_end_utc = r.extract_window_end_utc
+  AND w.page_size = COALESCE(r.page_size, 200)
+  AND w.filter_field = COALESCE(r.request_payload->>'filter_field', 'MetaData.CreateTime');
+
+UPDATE raw.qb_items r SET
+  window_id = w.window_id,
+  extract_window_start_utc = NULL, extract_window_end_utc = NULL
+FROM raw.extract_windows w
+WHERE r.window_id IS NULL AND w.entity = 'items'
+  AND w.window_start_utc = r.extract_window_start_utc
+  AND w.window_end_utc = r.extract_window_end_utc
+  AND w.page_size = COALESCE(r.page_size, 200)
+  AND w.filter_field = COALESCE(r.request_payload->>'filter_field', 'MetaData.LastUpdatedTime');
+
+UPDATE raw.qb_invoices r SET
+  window_id = w.window_id,
+  extract_window_start_utc = NULL, extract_window_end_utc = NULL
+FROM raw.extract_windows w
+WHERE r.window_id IS NULL AND w.entity = 'invoices'
+  AND w.window_start_utc = r.extract_window_start_utc
+  AND w.window_end_utc = r.extract_window_end_utc
+  AND w.page_size = COALESCE(r.page_size, 200)
+  AND w.filter_field = COALESCE(r.request_payload->>'filter_field', 'MetaData.LastUpdatedTime');
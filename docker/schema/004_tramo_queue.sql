@@ -0,0 +1,34 @@
+-- Cola de tramos compartida: chunk_fecha_* publica los tramos de una corrida y
+-- cualquier cantidad de workers (bloques Mage con mode=worker o procesos
+-- `python -m default_repo.utils.tramo_worker`) los reclaman con
+-- SELECT ... FOR UPDATE SKIP LOCKED. Cada reclamo es un lease con vencimiento:
+-- si el worker muere, el tramo vuelve a estar disponible al expirar el lease.
+-- Idempotente: puede re-ejecutarse.
+
+CREATE TABLE IF NOT EXISTS raw.tramo_queue (
+  queue_id BIGSERIAL PRIMARY KEY,
+  run_id TEXT NOT NULL,
+  entity TEXT NOT NULL,
+  tramo_id INTEGER,
+  window_start_utc TIMESTAMP WITH TIME ZONE NOT NULL,
+  window_end_utc TIMESTAMP WITH TIME ZONE NOT NULL,
+  page_size INTEGER NOT NULL,
+  status TEXT NOT NULL DEFAULT 'pending',      -- pending | leased | done | failed
+  attempts INTEGER NOT NULL DEFAULT 0,
+  leased_by TEXT,
+  lease_expires_at TIMESTAMP WITH TIME ZONE,
+  metrics JSONB,
+  last_error TEXT,
+  created_at_utc TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  updated_at_utc TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  UNIQUE (run_id, entity, window_start_utc, window_end_utc),
+  CHECK (status IN ('pending', 'leased', 'done', 'failed'))
+);
+
+-- Índice parcial para el reclamo: sólo filas todavía reclamables.
+CREATE INDEX IF NOT EXISTS tramo_queue_claim_idx
+  ON raw.tramo_queue (entity, window_start_utc)
+  WHERE status IN ('pending', 'leased');
+
+-- Progreso por corrida y realm: raw.v_tramo_queue_progress, definida sólo en
+-- 006_multi_realm.sql (redefinirla acá haría fallar la re-ejecución).
@@ -0,0 +1,119 @@
+-- Límite de requests a QBO compartido entre procesos (utils/rate_limit.py).
+-- Todos los extractores/workers de un mismo realm toman permisos de aquí:
+--   - raw.qbo_rate_buckets: token bucket por realm (tasa sostenida + ráfaga).
+--   - raw.qbo_rate_slots:   slots de concurrencia con vencimiento (un proceso
+--                           caído no retiene su slot más allá de ttl).
+-- Idempotente: puede re-ejecutarse.
+
+CREATE TABLE IF NOT EXISTS raw.qbo_rate_buckets (
+  realm_id TEXT PRIMARY KEY,
+  tokens DOUBLE PRECISION NOT NULL,
+  updated_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS raw.qbo_rate_slots (
+  realm_id TEXT NOT NULL,
+  slot INTEGER NOT NULL,
+  held_by TEXT,
+  held_until TIMESTAMP WITH TIME ZONE,
+  PRIMARY KEY (realm_id, slot)
+);
+
+-- Toma un token. Devuelve 0 si lo concedió; si no, los segundos a esperar.
+-- El FOR UPDATE serializa a todos los procesos del realm sobre una sola fila.
+CREATE OR REPLACE FUNCTION raw.qbo_take_token(
+  p_realm TEXT, p_rate DOUBLE PRECISION, p_capacity DOUBLE PRECISION
+) RETURNS DOUBLE PRECISION
+LANGUAGE plpgsql AS $$
+DECLARE
+  v_tokens DOUBLE PRECISION;
+  v_updated TIMESTAMP WITH TIME ZONE;
+  v_now TIMESTAMP WITH TIME ZONE;
+BEGIN
+  INSERT INTO raw.qbo_rate_buckets (realm_id, tokens, updated_at)
+  VALUES (p_realm, p_capacity, clock_timestamp())
+  ON CONFLICT (realm_id) DO NOTHING;
+
+  SELECT tokens, updated_at INTO v_tokens, v_updated
+  FROM raw.qbo_rate_buckets WHERE realm_id = p_realm FOR UPDATE;
+
+  v_now := clock_timestamp();
+  v_tokens := least(p_capacity,
+                    v_tokens + greatest(0, extract(epoch FROM v_now - v_updated)) * p_rate);
+
+  IF v_tokens >= 1 THEN
+    UPDATE raw.qbo_rate_buckets SET tokens = v_tokens - 1, updated_at = v_now
+    WHERE realm_id = p_realm;
+    RETURN 0;
+  END IF;
+
+  UPDATE raw.qbo_rate_buckets SET tokens = v_tokens, updated_at = v_now
+  WHERE realm_id = p_realm;
+  RETURN (1 - v_tokens) / p_rate;
+END $$;
+
+-- Tras un 429: vacía el bucket (tokens negativos = pausa de p_secs) para que
+-- todos los procesos frenen juntos en vez de reintentar cada uno por su cuenta.
+CREATE OR REPLACE FUNCTION raw.qbo_penalize(
+  p_realm TEXT, p_rate DOUBLE PRECISION, p_secs DOUBLE PRECISION
+) RETURNS VOID
+LANGUAGE sql AS $$
+  UPDATE raw.qbo_rate_buckets
+  SET tokens = least(tokens, -p_rate * p_secs), updated_at = clock_timestamp()
+  WHERE realm_id = p_realm;
+$$;
+
+-- Toma un slot de concurrencia libre (o vencido). NULL si no hay.
+CREATE OR REPLACE FUNCTION raw.qbo_take_slot(
+  p_realm TEXT, p_slots INTEGER, p_holder TEXT, p_ttl_secs DOUBLE PRECISION
+) RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+  v_slot INTEGER;
+BEGIN
+  INSERT INTO raw.qbo_rate_slots (realm_id, slot)
+  SELECT p_realm, g FROM generate_series(1, p_slots) AS g
+  ON CONFLICT DO NOTHING;
+
+  UPDATE raw.qbo_rate_slots s
+  SET held_by = p_holder, held_until = clock_timestamp() + make_interval(secs => p_ttl_secs)
+  WHERE s.realm_id = p_realm AND s.slot = (
+    SELECT slot FROM raw.qbo_rate_slots
+    WHERE realm_id = p_realm AND slot <= p_slots
+      AND (held_until IS NULL OR held_until < clock_timestamp())
+    ORDER BY slot
+    FOR UPDATE SKIP LOCKED
+    LIMIT 1
+  )
+  RETURNING s.slot INTO v_slot;
+  RETURN v_slot;
+END $$;
+
+CREATE OR REPLACE FUNCTION raw.qbo_release_slot(
+  p_realm TEXT, p_slot INTEGER, p_holder TEXT
+) RETURNS VOID
+LANGUAGE sql AS $$
+  UPDATE raw.qbo_rate_slots SET held_by = NULL, held_until = NULL
+  WHERE realm_id = p_realm AND slot = p_slot AND held_by = p_holder;
+$$;
+
+-- Token + slot en un solo round trip (utils/rate_limit.py). Primero el slot: si no
+-- hay, no se gasta token. Si hay slot pero no token, el slot se devuelve en la misma
+-- llamada. out_slot NULL → reintentar tras out_wait segundos (NULL = sin slot libre).
+CREATE OR REPLACE FUNCTION raw.qbo_acquire(
+  p_realm TEXT, p_rate DOUBLE PRECISION, p_capacity DOUBLE PRECISION,
+  p_slots INTEGER, p_holder TEXT, p_ttl_secs DOUBLE PRECISION,
+  OUT out_wait DOUBLE PRECISION, OUT out_slot INTEGER
+)
+LANGUAGE plpgsql AS $$
+BEGIN
+  out_slot := raw.qbo_take_slot(p_realm, p_slots, p_holder, p_ttl_secs);
+  IF out_slot IS NULL THEN
+    RETURN;
+  END IF;
+  out_wait := raw.qbo_take_token(p_realm, p_rate, p_capacity);
+  IF out_wait > 0 THEN
+    PERFORM raw.qbo_release_slot(p_realm, out_slot, p_holder);
+    out_slot := NULL;
+  END IF;
+END $$;
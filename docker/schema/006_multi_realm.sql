@@ -0,0 +1,133 @@
+-- Multi-realm: varias compañías QBO en las mismas tablas RAW.
+-- Cada fila registra su realm y la clave pasa de (id) a (realm_id, id):
+-- los Id de QBO sólo son únicos dentro de una compañía.
+--
+-- Migración de una base con datos de un solo realm: antes de correr este archivo
+--   SET qbo.realm_id = '<QBO_REALM_ID>';
+-- para etiquetar las filas existentes (si no, quedan como 'legacy').
+-- Idempotente: puede re-ejecutarse.
+
+ALTER TABLE raw.qb_customers  ADD COLUMN IF NOT EXISTS realm_id TEXT;
+ALTER TABLE raw.qb_items      ADD COLUMN IF NOT EXISTS realm_id TEXT;
+ALTER TABLE raw.qb_invoices   ADD COLUMN IF NOT EXISTS realm_id TEXT;
+ALTER TABLE raw.extract_windows ADD COLUMN IF NOT EXISTS realm_id TEXT;
+ALTER TABLE raw.tramo_queue   ADD COLUMN IF NOT EXISTS realm_id TEXT;
+
+UPDATE raw.qb_customers    SET realm_id = coalesce(nullif(current_setting('qbo.realm_id', true), ''), 'legacy') WHERE realm_id IS NULL;
+UPDATE raw.qb_items        SET realm_id = coalesce(nullif(current_setting('qbo.realm_id', true), ''), 'legacy') WHERE realm_id IS NULL;
+UPDATE raw.qb_invoices     SET realm_id = coalesce(nullif(current_setting('qbo.realm_id', true), ''), 'legacy') WHERE realm_id IS NULL;
+UPDATE raw.extract_windows SET realm_id = coalesce(nullif(current_setting('qbo.realm_id', true), ''), 'legacy') WHERE realm_id IS NULL;
+UPDATE raw.tramo_queue     SET realm_id = coalesce(nullif(current_setting('qbo.realm_id', true), ''), 'legacy') WHERE realm_id IS NULL;
+
+ALTER TABLE raw.qb_customers    ALTER COLUMN realm_id SET NOT NULL;
+ALTER TABLE raw.qb_items        ALTER COLUMN realm_id SET NOT NULL;
+ALTER TABLE raw.qb_invoices     ALTER COLUMN realm_id SET NOT NULL;
+ALTER TABLE raw.extract_windows ALTER COLUMN realm_id SET NOT NULL;
+ALTER TABLE raw.tramo_queue     ALTER COLUMN realm_id SET NOT NULL;
+
+-- PK (id) → (realm_id, id)
+ALTER TABLE raw.qb_customers DROP CONSTRAINT IF EXISTS qb_customers_pkey, ADD PRIMARY KEY (realm_id, id);
+ALTER TABLE raw.qb_items     DROP CONSTRAINT IF EXISTS qb_items_pkey,     ADD PRIMARY KEY (realm_id, id);
+ALTER TABLE raw.qb_invoices  DROP CONSTRAINT IF EXISTS qb_invoices_pkey,  ADD PRIMARY KEY (realm_id, id);
+
+-- Unicidad de ventanas y de tramos publicados, ahora por realm.
+DO $$
+DECLARE
+  c RECORD;
+BEGIN
+  FOR c IN
+    SELECT conrelid::regclass AS tbl, conname FROM pg_constraint
+    WHERE contype = 'u'
+      AND conrelid IN ('raw.extract_windows'::regclass, 'raw.tramo_queue'::regclass)
+  LOOP
+    EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I', c.tbl, c.conname);
+  END LOOP;
+END $$;
+
+CREATE UNIQUE INDEX IF NOT EXISTS extract_windows_realm_key
+  ON raw.extract_windows (realm_id, entity, window_start_utc, window_end_utc, page_size, filter_field);
+CREATE UNIQUE INDEX IF NOT EXISTS tramo_queue_realm_key
+  ON raw.tramo_queue (run_id, entity, realm_id, window_start_utc, window_end_utc);
+
+-- Reparto justo en el reclamo: tramos en curso por realm.
+CREATE INDEX IF NOT EXISTS tramo_queue_leased_idx
+  ON raw.tramo_queue (entity, realm_id)
+  WHERE status = 'leased';
+
+-- Vistas: contrato RAW original (003) + realm_id al final. Única definición de
+-- raw.v_qb_* y raw.v_tramo_queue_progress: 003/004 no las crean, así todos los
+-- archivos se pueden re-ejecutar en orden.
+CREATE OR REPLACE VIEW raw.v_qb_customers AS
+SELECT
+  r.id, r.payload, r.ingested_at_utc,
+  COALESCE(r.extract_window_start_utc, w.window_start_utc) AS extract_window_start_utc,
+  COALESCE(r.extract_window_end_utc, w.window_end_utc)     AS extract_window_end_utc,
+  r.page_number,
+  CASE WHEN r.request_payload IS NULL THEN w.page_size ELSE r.page_size END AS page_size,   -- legacy: tal cual (puede ser NULL)
+  COALESCE(r.request_payload, jsonb_build_object(
+    'start', to_char(w.window_start_utc AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"'),
+    'end', to_char(w.window_end_utc AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"'),
+    'page', r.page_number,
+    'page_size', w.page_size,
+    'filter_field', w.filter_field
+  )) AS request_payload,
+  r.create_time, r.last_updated_time, r.sync_token, r.window_id,
+  r.realm_id
+FROM raw.qb_customers r
+LEFT JOIN raw.extract_windows w USING (window_id);
+
+CREATE OR REPLACE VIEW raw.v_qb_items AS
+SELECT
+  r.id, r.payload, r.ingested_at_utc,
+  COALESCE(r.extract_window_start_utc, w.window_start_utc) AS extract_window_start_utc,
+  COALESCE(r.extract_window_end_utc, w.window_end_utc)     AS extract_window_end_utc,
+  r.page_number,
+  CASE WHEN r.request_payload IS NULL THEN w.page_size ELSE r.page_size END AS page_size,   -- legacy: tal cual (puede ser NULL)
+  COALESCE(r.request_payload, jsonb_build_object(
+    'start', to_char(w.window_start_utc AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"'),
+    'end', to_char(w.window_end_utc AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"'),
+    'page', r.page_number,
+    'page_size', w.page_size,
+    'filter_field', w.filter_field
+  )) AS request_payload,
+  r.create_time, r.last_updated_time, r.sync_token, r.window_id,
+  r.realm_id
+FROM raw.qb_items r
+LEFT JOIN raw.extract_windows w USING (window_id);
+
+CREATE OR REPLACE VIEW raw.v_qb_invoices AS
+SELECT
+  r.id, r.payload, r.ingested_at_utc,
+  COALESCE(r.extract_window_start_utc, w.window_start_utc) AS extract_window_start_utc,
+  COALESCE(r.extract_window_end_utc, w.window_end_utc)     AS extract_window_end_utc,
+  r.page_number,
+  CASE WHEN r.request_payload IS NULL THEN w.page_size ELSE r.page_size END AS page_size,   -- legacy: tal cual (puede ser NULL)
+  COALESCE(r.request_payload, jsonb_build_object(
+    'start', to_char(w.window_start_utc AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"'),
+    'end', to_char(w.window_end_utc AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"'),
+    'page', r.page_number,
+    'page_size', w.page_size,
+    'filter_field', w.filter_field
+  )) AS request_payload,
+  r.txn_date, r.customer_ref, r.last_updated_time, r.sync_token, r.window_id,
+  r.realm_id
+FROM raw.qb_invoices r
+LEFT JOIN raw.extract_windows w USING (window_id);
+
+-- Progreso de la cola, por realm. El DROP cubre bases con la versión anterior de 004
+-- (sin realm_id en el medio de las columnas).
+DROP VIEW IF EXISTS raw.v_tramo_queue_progress;
+CREATE VIEW raw.v_tramo_queue_progress AS
+SELECT
+  run_id, entity, realm_id,
+  count(*) AS tramos,
+  count(*) FILTER (WHERE status = 'pending') AS pending,
+  count(*) FILTER (WHERE status = 'leased' AND lease_expires_at >= now()) AS leased,
+  count(*) FILTER (WHERE status = 'leased' AND lease_expires_at <  now()) AS lease_expired,
+  count(*) FILTER (WHERE status = 'done')    AS done,
+  count(*) FILTER (WHERE status = 'failed')  AS failed,
+  sum((metrics->>'rows_read')::bigint) AS rows_read,
+  min(created_at_utc) AS created_at_utc,
+  max(updated_at_utc) AS updated_at_utc
+FROM raw.tramo_queue
+GROUP BY run_id, entity, realm_id;
@@ -0,0 +1,75 @@
+-- Entidades adicionales del pipeline combinado (qb_all_backfill, qbo_entities.yaml).
+-- Misma estructura que raw.qb_items: PK (realm_id, id), columnas generadas
+-- create_time / last_updated_time / sync_token e índices (LIKE ... INCLUDING ALL).
+-- Una entidad nueva en qbo_entities.yaml sin tabla la crea el exporter con el mismo
+-- LIKE; este archivo agrega además FK de ventana, TxnDate y vistas para Payment/Bill.
+-- Idempotente: puede re-ejecutarse (requiere 001–006).
+
+CREATE TABLE IF NOT EXISTS raw.qb_payments (LIKE raw.qb_items INCLUDING ALL);
+CREATE TABLE IF NOT EXISTS raw.qb_bills    (LIKE raw.qb_items INCLUDING ALL);
+
+DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'qb_payments_window_id_fkey') THEN
+    ALTER TABLE raw.qb_payments ADD CONSTRAINT qb_payments_window_id_fkey
+      FOREIGN KEY (window_id) REFERENCES raw.extract_windows (window_id);
+  END IF;
+  IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'qb_bills_window_id_fkey') THEN
+    ALTER TABLE raw.qb_bills ADD CONSTRAINT qb_bills_window_id_fkey
+      FOREIGN KEY (window_id) REFERENCES raw.extract_windows (window_id);
+  END IF;
+END $$;
+
+ALTER TABLE raw.qb_payments
+  ADD COLUMN IF NOT EXISTS txn_date DATE
+    GENERATED ALWAYS AS (raw.qbo_date(payload->>'TxnDate')) STORED,
+  ADD COLUMN IF NOT EXISTS customer_ref TEXT
+    GENERATED ALWAYS AS (payload->'CustomerRef'->>'value') STORED;
+
+ALTER TABLE raw.qb_bills
+  ADD COLUMN IF NOT EXISTS txn_date DATE
+    GENERATED ALWAYS AS (raw.qbo_date(payload->>'TxnDate')) STORED,
+  ADD COLUMN IF NOT EXISTS vendor_ref TEXT
+    GENERATED ALWAYS AS (payload->'VendorRef'->>'value') STORED;
+
+CREATE INDEX IF NOT EXISTS qb_payments_txn_date_idx     ON raw.qb_payments (txn_date);
+CREATE INDEX IF NOT EXISTS qb_payments_customer_ref_idx ON raw.qb_payments (customer_ref);
+CREATE INDEX IF NOT EXISTS qb_bills_txn_date_idx        ON raw.qb_bills (txn_date);
+CREATE INDEX IF NOT EXISTS qb_bills_vendor_ref_idx      ON raw.qb_bills (vendor_ref);
+
+-- Vistas con el mismo contrato que raw.v_qb_* (filas nuevas: ventana vía window_id).
+CREATE OR REPLACE VIEW raw.v_qb_payments AS
+SELECT
+  r.id, r.payload, r.ingested_at_utc,
+  w.window_start_utc AS extract_window_start_utc,
+  w.window_end_utc   AS extract_window_end_utc,
+  r.page_number, w.page_size,
+  jsonb_build_object(
+    'start', to_char(w.window_start_utc AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"'),
+    'end', to_char(w.window_end_utc AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"'),
+    'page', r.page_number,
+    'page_size', w.page_size,
+    'filter_field', w.filter_field
+  ) AS request_payload,
+  r.txn_date, r.customer_ref, r.last_updated_time, r.sync_token, r.window_id,
+  r.realm_id
+FROM raw.qb_payments r
+LEFT JOIN raw.extract_windows w USING (window_id);
+
+CREATE OR REPLACE VIEW raw.v_qb_bills AS
+SELECT
+  r.id, r.payload, r.ingested_at_utc,
+  w.window_start_utc AS extract_window_start_utc,
+  w.window_end_utc   AS extract_window_end_utc,
+  r.page_number, w.page_size,
+  jsonb_build_object(
+    'start', to_char(w.window_start_utc AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"'),
+    'end', to_char(w.window_end_utc AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"'),
+    'page', r.page_number,
+    'page_size', w.page_size,
+    'filter_field', w.filter_field
+  ) AS request_payload,
+  r.txn_date, r.vendor_ref, r.last_updated_time, r.sync_token, r.window_id,
+  r.realm_id
+FROM raw.qb_bills r
+LEFT JOIN raw.extract_windows w USING (window_id);
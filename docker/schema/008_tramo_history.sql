@@ -0,0 +1,53 @@
+-- Historial de métricas por tramo para el autotuning (utils/autotune.py).
+-- Cada extractor agrega una fila por tramo al terminar la corrida; el planner
+-- elige chunk / page_size / prefetch / fetch_workers con más filas por segundo.
+-- Idempotente: puede re-ejecutarse.
+
+CREATE TABLE IF NOT EXISTS raw.tramo_history (
+  history_id BIGSERIAL PRIMARY KEY,
+  run_id TEXT NOT NULL,
+  pipeline TEXT,                   -- entidad del pipeline o 'all' (combinado); NULL = filas previas
+  entity TEXT NOT NULL,
+  realm_id TEXT NOT NULL,
+  mode TEXT NOT NULL,
+  window_start_utc TIMESTAMP WITH TIME ZONE NOT NULL,
+  window_end_utc TIMESTAMP WITH TIME ZONE NOT NULL,
+  chunk TEXT,                      -- NULL si el tramo no vino de chunk_fecha (cola)
+  page_size INTEGER NOT NULL,
+  prefetch INTEGER NOT NULL,
+  fetch_workers INTEGER NOT NULL,
+  concurrency INTEGER,             -- límite AIMD al cerrar el tramo
+  pages_read INTEGER NOT NULL DEFAULT 0,
+  rows_read INTEGER NOT NULL DEFAULT 0,
+  retries INTEGER NOT NULL DEFAULT 0,
+  duration_secs DOUBLE PRECISION NOT NULL DEFAULT 0,
+  started_at_utc TIMESTAMP WITH TIME ZONE NOT NULL,
+  finished_at_utc TIMESTAMP WITH TIME ZONE NOT NULL,
+  status TEXT,
+  recorded_at_utc TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+-- Bases existentes: el pipeline separa el historial del combinado del de cada entidad
+ALTER TABLE raw.tramo_history ADD COLUMN IF NOT EXISTS pipeline TEXT;
+
+CREATE INDEX IF NOT EXISTS tramo_history_lookup_idx
+  ON raw.tramo_history (entity, mode, recorded_at_utc);
+
+-- Throughput por corrida (wall clock: primer inicio → último fin).
+CREATE OR REPLACE VIEW raw.v_tramo_history_runs AS
+SELECT
+  run_id, entity, mode, chunk, page_size, prefetch, fetch_workers,
+  array_agg(DISTINCT realm_id) AS realms,
+  count(*) AS tramos,
+  sum(pages_read) AS pages_read,
+  sum(rows_read) AS rows_read,
+  sum(retries) AS retries,
+  round(avg(concurrency), 1) AS avg_concurrency,
+  extract(epoch FROM max(finished_at_utc) - min(started_at_utc)) AS wall_secs,
+  round((sum(rows_read) / nullif(extract(epoch FROM max(finished_at_utc) - min(started_at_utc)), 0))::numeric, 1)
+    AS rows_per_sec,
+  min(started_at_utc) AS started_at_utc,
+  COALESCE(pipeline, entity) AS pipeline,
+  extract(epoch FROM max(window_end_utc) - min(window_start_utc)) AS range_secs
+FROM raw.tramo_history
+GROUP BY run_id, COALESCE(pipeline, entity), entity, mode, chunk, page_size, prefetch, fetch_workers;
@@ -0,0 +1,11 @@
+-- mode=snapshot (utils/snapshot.py): ids que desaparecen de QBO quedan marcados
+-- con deleted_at_utc en vez de borrarse; si reaparecen la marca se limpia.
+-- Idempotente: puede re-ejecutarse.
+
+ALTER TABLE raw.qb_items     ADD COLUMN IF NOT EXISTS deleted_at_utc TIMESTAMP WITH TIME ZONE;
+ALTER TABLE raw.qb_customers ADD COLUMN IF NOT EXISTS deleted_at_utc TIMESTAMP WITH TIME ZONE;
+
+CREATE INDEX IF NOT EXISTS qb_items_deleted_idx
+  ON raw.qb_items (realm_id, deleted_at_utc) WHERE deleted_at_utc IS NOT NULL;
+CREATE INDEX IF NOT EXISTS qb_customers_deleted_idx
+  ON raw.qb_customers (realm_id, deleted_at_utc) WHERE deleted_at_utc IS NOT NULL;
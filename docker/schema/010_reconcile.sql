@@ -0,0 +1,30 @@
+-- Reporte de mode=reconcile (utils/reconcile.py): count(*) por ventana en QBO
+-- vs RAW, una fila por ventana chequeada. Idempotente: puede re-ejecutarse.
+
+CREATE TABLE IF NOT EXISTS raw.reconcile_windows (
+  reconcile_id BIGSERIAL PRIMARY KEY,
+  run_id TEXT NOT NULL,
+  entity TEXT NOT NULL,
+  realm_id TEXT NOT NULL,
+  window_start_utc TIMESTAMP WITH TIME ZONE NOT NULL,
+  window_end_utc TIMESTAMP WITH TIME ZONE NOT NULL,
+  filter_field TEXT NOT NULL,
+  qbo_count INTEGER NOT NULL,
+  raw_count INTEGER NOT NULL,
+  checked_at_utc TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS reconcile_windows_lookup_idx
+  ON raw.reconcile_windows (entity, realm_id, window_start_utc, checked_at_utc DESC);
+
+-- Último chequeo de cada ventana, sólo las que no coinciden.
+CREATE OR REPLACE VIEW raw.v_reconcile_drift AS
+SELECT *
+FROM (
+  SELECT DISTINCT ON (entity, realm_id, window_start_utc, window_end_utc)
+    entity, realm_id, window_start_utc, window_end_utc, filter_field,
+    qbo_count, raw_count, qbo_count - raw_count AS diff, run_id, checked_at_utc
+  FROM raw.reconcile_windows
+  ORDER BY entity, realm_id, window_start_utc, window_end_utc, checked_at_utc DESC
+) last_check
+WHERE diff <> 0;
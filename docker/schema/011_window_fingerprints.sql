@@ -0,0 +1,16 @@
+-- Fingerprint por ventana cargada (utils/fingerprint.py): filas y max(last_updated_time)
+-- en RAW. Al re-correr un rango, las ventanas cuyo fingerprint QBO confirma con
+-- count(*) se omiten sin paginar. Idempotente: puede re-ejecutarse.
+
+CREATE TABLE IF NOT EXISTS raw.window_fingerprints (
+  realm_id TEXT NOT NULL,
+  entity TEXT NOT NULL,
+  filter_field TEXT NOT NULL,
+  window_start_utc TIMESTAMP WITH TIME ZONE NOT NULL,
+  window_end_utc TIMESTAMP WITH TIME ZONE NOT NULL,
+  row_count INTEGER NOT NULL,
+  max_updated_utc TIMESTAMP WITH TIME ZONE,
+  extracted_at_utc TIMESTAMP WITH TIME ZONE NOT NULL,   -- inicio de la extracción de la ventana
+  saved_at_utc TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  PRIMARY KEY (realm_id, entity, filter_field, window_start_utc, window_end_utc)
+);
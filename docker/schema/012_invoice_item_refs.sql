@@ -0,0 +1,18 @@
+-- mode=repair (utils/repair_refs.py): ItemRef de las líneas de cada factura como
+-- columna generada, para encontrar en una sola query los items referenciados que
+-- faltan en raw.qb_items (CustomerRef ya tiene columna e índice en 002).
+-- `.**` incluye las líneas anidadas de GroupLineDetail; jsonb_path_query_array
+-- (sin vars) es IMMUTABLE. Idempotente: puede re-ejecutarse.
+-- Nota: ADD COLUMN ... GENERATED reescribe la tabla (lock ACCESS EXCLUSIVE);
+-- en tablas grandes ejecutar en ventana de mantenimiento.
+
+ALTER TABLE raw.qb_invoices
+  ADD COLUMN IF NOT EXISTS item_refs JSONB
+    GENERATED ALWAYS AS (jsonb_path_query_array(payload, '$.Line[*].**.ItemRef.value')) STORED;
+
+CREATE INDEX IF NOT EXISTS qb_invoices_item_refs_idx
+  ON raw.qb_invoices USING gin (item_refs);
+
+-- Anti-join por realm contra la PK (realm_id, id) de customers / items
+CREATE INDEX IF NOT EXISTS qb_invoices_realm_customer_ref_idx
+  ON raw.qb_invoices (realm_id, customer_ref);
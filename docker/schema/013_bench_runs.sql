@@ -0,0 +1,39 @@
+-- Resultados de benchmarks (benchmarks/bench_exporters.py, ...): una fila por caso
+-- medido, para que una regresión se vea contra corridas anteriores.
+-- Idempotente: puede re-ejecutarse.
+
+CREATE TABLE IF NOT EXISTS raw.bench_runs (
+  id BIGSERIAL PRIMARY KEY,
+  run_id TEXT NOT NULL,
+  suite TEXT NOT NULL,                 -- 'exporters', ...
+  case_name TEXT NOT NULL,             -- ej. 'invoices/copy/100000/insert'
+  params JSONB NOT NULL DEFAULT '{}'::jsonb,
+  metrics JSONB NOT NULL,              -- rows_per_sec, wal_bytes, table_bytes, dead_tuples, ...
+  git_rev TEXT,
+  host TEXT,
+  ran_at_utc TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS bench_runs_case_idx
+  ON raw.bench_runs (suite, case_name, ran_at_utc DESC);
+
+-- Última corrida de cada caso vs. el mejor rows/s anterior (ratio < 1 = más lento).
+CREATE OR REPLACE VIEW raw.v_bench_regressions AS
+WITH ranked AS (
+  SELECT suite, case_name, run_id, git_rev, ran_at_utc,
+         (metrics->>'rows_per_sec')::numeric AS rows_per_sec,
+         (metrics->>'wal_bytes')::numeric AS wal_bytes,
+         row_number() OVER (PARTITION BY suite, case_name ORDER BY ran_at_utc DESC) AS rn
+  FROM raw.bench_runs
+)
+SELECT l.suite, l.case_name, l.run_id, l.git_rev, l.ran_at_utc,
+       l.rows_per_sec, b.best_rows_per_sec,
+       round(l.rows_per_sec / NULLIF(b.best_rows_per_sec, 0), 3) AS ratio_vs_best,
+       l.wal_bytes, b.min_wal_bytes
+FROM ranked l
+CROSS JOIN LATERAL (
+  SELECT max(p.rows_per_sec) AS best_rows_per_sec, min(p.wal_bytes) AS min_wal_bytes
+  FROM ranked p
+  WHERE p.suite = l.suite AND p.case_name = l.case_name AND p.rn > 1
+) b
+WHERE l.rn = 1;
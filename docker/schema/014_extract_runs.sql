@@ -0,0 +1,109 @@
+-- Métricas persistidas por corrida y por tramo (utils/run_metrics.py): lo que antes
+-- sólo salía por stdout en el dict `metrics` de cada tramo. El extractor registra la
+-- corrida y sus tramos; el exporter completa inserted/updated/unchanged por tramo.
+-- run_id = el de raw.tramo_history. Idempotente: puede re-ejecutarse.
+
+CREATE TABLE IF NOT EXISTS raw.extract_runs (
+  run_id TEXT NOT NULL,
+  entity TEXT NOT NULL,
+  mode TEXT NOT NULL,
+  realms TEXT[] NOT NULL DEFAULT '{}',
+  status TEXT NOT NULL,                  -- extracted | loaded
+  tramos INTEGER NOT NULL DEFAULT 0,
+  pages_read INTEGER NOT NULL DEFAULT 0,
+  rows_read INTEGER NOT NULL DEFAULT 0,
+  rows_inserted INTEGER NOT NULL DEFAULT 0,
+  rows_updated INTEGER NOT NULL DEFAULT 0,
+  rows_unchanged INTEGER NOT NULL DEFAULT 0,
+  retries INTEGER NOT NULL DEFAULT 0,
+  started_at_utc TIMESTAMP WITH TIME ZONE NOT NULL,    -- inicio del primer tramo
+  extracted_at_utc TIMESTAMP WITH TIME ZONE NOT NULL,  -- fin de la extracción
+  loaded_at_utc TIMESTAMP WITH TIME ZONE,
+  load_secs DOUBLE PRECISION,            -- sólo exporter (en fused/worker la carga va con la extracción)
+  params JSONB NOT NULL DEFAULT '{}'::jsonb,
+  PRIMARY KEY (run_id, entity)
+);
+
+CREATE INDEX IF NOT EXISTS extract_runs_entity_idx
+  ON raw.extract_runs (entity, started_at_utc DESC);
+
+CREATE TABLE IF NOT EXISTS raw.extract_tramos (
+  run_id TEXT NOT NULL,
+  entity TEXT NOT NULL,
+  realm_id TEXT NOT NULL,
+  filter_field TEXT NOT NULL,
+  window_start_utc TIMESTAMP WITH TIME ZONE NOT NULL,
+  window_end_utc TIMESTAMP WITH TIME ZONE NOT NULL,
+  tramo_id INTEGER,
+  chunk TEXT,
+  page_size INTEGER NOT NULL,
+  pages_read INTEGER NOT NULL DEFAULT 0,
+  rows_read INTEGER NOT NULL DEFAULT 0,
+  rows_inserted INTEGER,                 -- NULL hasta que el exporter carga el tramo
+  rows_updated INTEGER,
+  rows_unchanged INTEGER,
+  retries INTEGER NOT NULL DEFAULT 0,
+  extract_secs DOUBLE PRECISION NOT NULL DEFAULT 0,
+  status TEXT,                           -- extracted | loaded
+  started_at_utc TIMESTAMP WITH TIME ZONE NOT NULL,
+  loaded_at_utc TIMESTAMP WITH TIME ZONE,
+  PRIMARY KEY (run_id, entity, realm_id, filter_field, window_start_utc, window_end_utc)
+);
+
+CREATE INDEX IF NOT EXISTS extract_tramos_entity_idx
+  ON raw.extract_tramos (entity, started_at_utc DESC);
+
+-- Throughput por corrida. retry_rate ≈ reintentos por request de página.
+CREATE OR REPLACE VIEW raw.v_extract_run_throughput AS
+SELECT r.run_id, r.entity, r.mode, r.status, r.realms, r.started_at_utc,
+       r.tramos, r.pages_read, r.rows_read, r.rows_inserted, r.rows_updated, r.rows_unchanged, r.retries,
+       round(extract(epoch FROM r.extracted_at_utc - r.started_at_utc)::numeric, 3) AS extract_secs,
+       r.load_secs,
+       round(r.rows_read / NULLIF(extract(epoch FROM r.extracted_at_utc - r.started_at_utc)::numeric, 0), 1) AS rows_per_sec,
+       round(r.pages_read / NULLIF(extract(epoch FROM r.extracted_at_utc - r.started_at_utc)::numeric, 0), 2) AS pages_per_sec,
+       round(r.retries::numeric / NULLIF(r.pages_read + r.retries, 0), 4) AS retry_rate,
+       round((r.rows_inserted + r.rows_updated + r.rows_unchanged) / NULLIF(r.load_secs, 0)::numeric, 1) AS load_rows_per_sec
+FROM raw.extract_runs r;
+
+-- Evolución diaria por entidad y modo (capacity planning / autotuning).
+CREATE OR REPLACE VIEW raw.v_extract_entity_daily AS
+WITH runs AS (
+  SELECT entity, mode, date_trunc('day', started_at_utc) AS day,
+         count(*) AS runs, sum(tramos) AS tramos, sum(pages_read) AS pages_read,
+         sum(rows_read) AS rows_read, sum(retries) AS retries, sum(extract_secs) AS extract_secs,
+         sum(rows_inserted) AS rows_inserted, sum(rows_updated) AS rows_updated
+  FROM raw.v_extract_run_throughput
+  GROUP BY 1, 2, 3
+), tramos AS (
+  SELECT t.entity, r.mode, date_trunc('day', r.started_at_utc) AS day,
+         percentile_cont(0.5) WITHIN GROUP (ORDER BY t.extract_secs) AS p50_tramo_secs,
+         percentile_cont(0.95) WITHIN GROUP (ORDER BY t.extract_secs) AS p95_tramo_secs,
+         max(t.extract_secs) AS max_tramo_secs
+  FROM raw.extract_tramos t
+  JOIN raw.extract_runs r ON r.run_id = t.run_id AND r.entity = t.entity
+  GROUP BY 1, 2, 3
+)
+SELECT runs.entity, runs.mode, runs.day, runs.runs, runs.tramos, runs.pages_read, runs.rows_read,
+       runs.rows_inserted, runs.rows_updated, runs.retries,
+       round(runs.rows_read / NULLIF(runs.extract_secs, 0), 1) AS rows_per_sec,
+       round(runs.pages_read / NULLIF(runs.extract_secs, 0), 2) AS pages_per_sec,
+       round(runs.retries::numeric / NULLIF(runs.pages_read + runs.retries, 0), 4) AS retry_rate,
+       round(tramos.p50_tramo_secs::numeric, 3) AS p50_tramo_secs,
+       round(tramos.p95_tramo_secs::numeric, 3) AS p95_tramo_secs,
+       round(tramos.max_tramo_secs::numeric, 3) AS max_tramo_secs
+FROM runs
+LEFT JOIN tramos USING (entity, mode, day);
+
+-- Las 50 ventanas más lentas por entidad en los últimos 30 días.
+CREATE OR REPLACE VIEW raw.v_extract_slowest_windows AS
+SELECT *
+FROM (
+  SELECT t.entity, t.realm_id, t.run_id, t.window_start_utc, t.window_end_utc, t.chunk, t.page_size,
+         t.pages_read, t.rows_read, t.retries, t.extract_secs,
+         round(t.rows_read / NULLIF(t.extract_secs, 0)::numeric, 1) AS rows_per_sec,
+         t.rows_inserted, t.rows_updated, t.started_at_utc,
+         rank() OVER (PARTITION BY t.entity ORDER BY t.extract_secs DESC) AS slow_rank
+  FROM raw.extract_tramos t
+  WHERE t.started_at_utc >= now() - interval '30 days'
+) s
+WHERE slow_rank <= 50;
@@ -0,0 +1,94 @@
+if 'data_exporter' not in globals():
+    from mage_ai.data_preparation.decorators import data_exporter
+
+import json
+import psycopg
+import time
+from datetime import datetime, timezone
+
+from default_repo.utils.entities import load_entities, ensure_tables
+from default_repo.utils.raw_load import load_records, pg_conn_str
+from default_repo.utils.fingerprint import save_fingerprints
+from default_repo.utils.run_metrics import record_load
+from default_repo.utils.spool import iter_records, count_records, remove_spool
+from default_repo.utils.telemetry import report
+
+def _now_utc_iso():
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+@data_exporter
+def export_all_to_postgres(data, **kwargs) -> None:
+    """
+    Exporta la salida de extract_qbo_all: cada entidad a su tabla raw.qb_<entity>.
+
+    - Una conexión para toda la corrida; COMMIT por entidad (una entidad que falla
+      no deshace las ya cargadas).
+    - Conteos inserted/updated/unchanged/skipped separados por entidad.
+    """
+    windows = (data or {}).get("windows") or []
+    records = (data or {}).get("records") or []
+
+    if (data or {}).get("dry_run"):
+        # dry_run=true: el extractor sólo estimó la corrida (utils/dry_run.py)
+        print(json.dumps({
+            "phase": "load", "entity": "all", "ts": _now_utc_iso(),
+            "status": "skip", "reason": "dry_run"
+        }))
+        return
+    if (data or {}).get("loaded"):
+        # mode=fused: el extractor ya cargó RAW en paralelo a la extracción
+        print(json.dumps({
+            "phase": "load", "entity": "all", "ts": _now_utc_iso(),
+            "status": "skip", "reason": "loaded_in_extract",
+            "entities": data.get("entities")
+        }))
+        return
+
+    if not count_records(windows, records):
+        print(json.dumps({
+            "phase": "load", "entity": "all", "ts": _now_utc_iso(),
+            "status": "skip", "reason": "no_records"
+        }))
+        return
+
+    # Ventanas y registros en memoria agrupados por entidad (orden de qbo_entities.yaml)
+    by_entity = {}
+    for w in windows:
+        by_entity.setdefault(w["entity"], []).append(w)
+    configured = load_entities()
+    ref_entity = {w["window_ref"]: w["entity"] for w in windows}
+
+    with psycopg.connect(pg_conn_str()) as conn:
+        with conn.cursor() as cur:
+            ensure_tables(cur, [configured[e] for e in by_entity])
+        conn.commit()
+
+        for entity, ent_windows in by_entity.items():
+            t_load = time.perf_counter()
+            ent_records = [r for r in records if ref_entity.get(r.get("window_ref")) == entity]
+            incoming = count_records(ent_windows, ent_records)
+            print(json.dumps({
+                "phase": "load", "entity": entity, "ts": _now_utc_iso(),
+                "status": "start", "incoming_records": incoming,
+                "windows": len(ent_windows)
+            }))
+
+            with conn.cursor() as cur:
+                counts = load_records(cur, entity, ent_windows, iter_records(ent_windows, ent_records))
+            conn.commit()
+            save_fingerprints(entity, ent_windows)   # omite ventanas sin cambios al re-correr
+            record_load(entity, ent_windows, time.perf_counter() - t_load)   # utils/run_metrics.py
+
+            if not kwargs.get('keep_spool'):
+                remove_spool(ent_windows)
+
+            total = counts["inserted"] + counts["updated"] + counts["unchanged"]
+            print(json.dumps({
+                "phase": "load", "entity": entity, "ts": _now_utc_iso(),
+                "status": "done", **counts,
+                "total_processed": total, "total_input": incoming
+            }))
+            print(f"[load {entity}] Insertados={counts['inserted']} | Actualizados={counts['updated']} | "
+                  f"Sin cambios={counts['unchanged']} | Omitidos={counts['skipped']} | Total={total} (raw.qb_{entity})")
+            report('load', entity, total, time.perf_counter() - t_load)   # utils/telemetry.py
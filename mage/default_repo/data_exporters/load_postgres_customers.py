@@ -4,14 +4,21 @@ if 'data_exporter' not in globals():
 from mage_ai.data_preparation.shared.secrets import get_secret_value
 import json
 import psycopg
+import time
 from datetime import datetime, timezone
 
+from default_repo.utils.raw_load import load_records
+from default_repo.utils.fingerprint import save_fingerprints
+from default_repo.utils.run_metrics import record_load
+from default_repo.utils.spool import iter_records, count_records, remove_spool
+from default_repo.utils.telemetry import report
+
 def _now_utc_iso():
     return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
 
 
 @data_exporter
-def export_data_to_postgres(records, **kwargs) -> None:
+def export_data_to_postgres(data, **kwargs) -> None:
     """
     Exporta registros a la tabla raw.qb_customers en Postgres.
 
@@ -20,8 +27,29 @@ def export_data_to_postgres(records, **kwargs) -> None:
       - Idempotencia vía ON CONFLICT
       - Logging estructurado por fase "load" con métricas.
     """
+    # Salida de extract_qbo_*: {'windows': [...], 'records': [...], 'spool_dir'}
+    windows = (data or {}).get("windows") or []
+    records = (data or {}).get("records") or []
+    incoming = count_records(windows, records)   # en memoria + spool por tramo
+
+    if (data or {}).get("dry_run"):
+        # dry_run=true: el extractor sólo estimó la corrida (utils/dry_run.py)
+        print(json.dumps({
+            "phase": "load", "ts": _now_utc_iso(),
+            "status": "skip", "reason": "dry_run"
+        }))
+        return
     # integridad antes de abrir conexión
-    if not records:
+    if (data or {}).get("loaded"):
+        # mode=fused: el extractor ya cargó RAW en paralelo a la extracción
+        print(json.dumps({
+            "phase": "load", "ts": _now_utc_iso(),
+            "status": "skip", "reason": "loaded_in_extract",
+            "pipeline": data.get("pipeline")
+        }))
+        return
+
+    if not incoming:
         print(json.dumps({
             "phase": "load", "ts": _now_utc_iso(),
             "status": "skip", "reason": "no_records"
@@ -37,92 +65,48 @@ def export_data_to_postgres(records, **kwargs) -> None:
 
     conn_str = f"host={host} port={port} dbname={db} user={user} password={password}"
 
-    # Upsert con métrica de insert/updates vía RETURNING (xmax = 0)
-    # registrar filas insertadas/actualizadas
-    # idempotencia (ON CONFLICT)
-    sql = """
-    INSERT INTO raw.qb_customers (
-        id, payload, ingested_at_utc,
-        extract_window_start_utc, extract_window_end_utc,
-        page_number, page_size, request_payload
-    )
-    VALUES (
-        %(id)s, %(payload)s, %(ingested_at_utc)s,
-        %(extract_window_start_utc)s, %(extract_window_end_utc)s,
-        %(page_number)s, %(page_size)s, %(request_payload)s
-    )
-    ON CONFLICT (id) DO UPDATE SET
-        payload = EXCLUDED.payload,
-        ingested_at_utc = EXCLUDED.ingested_at_utc,
-        extract_window_start_utc = EXCLUDED.extract_window_start_utc,
-        extract_window_end_utc = EXCLUDED.extract_window_end_utc,
-        page_number = EXCLUDED.page_number,
-        page_size = EXCLUDED.page_size,
-        request_payload = EXCLUDED.request_payload
-    RETURNING (xmax = 0) AS inserted;
-    """
-
-    inserted = 0
-    updated = 0
-    skipped = 0  # métrica de omitidos si falta PK o metadatos críticos
-
-    # Validación básica por registro antes de upsert
-    def _valid(r):
-        return all([
-            r.get("id"),
-            r.get("payload") is not None,
-            r.get("ingested_at_utc"),
-            r.get("extract_window_start_utc"),
-            r.get("extract_window_end_utc"),
-        ])
+    # Upsert idempotente (ON CONFLICT + sync_token) y conteo insert/update/unchanged
+    # vía RETURNING (xmax = 0); ventanas → raw.extract_windows. Ver utils/raw_load.py.
 
     # Inicio de fase de carga
     print(json.dumps({
         "phase": "load", "ts": _now_utc_iso(),
-        "status": "start", "incoming_records": len(records)
+        "status": "start", "incoming_records": incoming,
+        "windows": len(windows)
     }))
 
+    t_load = time.perf_counter()
     with psycopg.connect(conn_str) as conn:
         with conn.cursor() as cur:
-            for r in records:
-                if not _valid(r):
-                    skipped += 1
-                    # Log de registro omitido
-                    print(json.dumps({
-                        "phase": "load", "ts": _now_utc_iso(),
-                        "status": "skipped", "reason": "invalid_row_min_requirements",
-                        "id": r.get("id")
-                    }))
-                    continue
-
-                # Casts a JSONB
-                params = {
-                    "id": r["id"],
-                    "payload": json.dumps(r["payload"]),
-                    "ingested_at_utc": r["ingested_at_utc"],
-                    "extract_window_start_utc": r["extract_window_start_utc"],
-                    "extract_window_end_utc": r["extract_window_end_utc"],
-                    "page_number": r.get("page_number"),
-                    "page_size": r.get("page_size"),
-                    "request_payload": json.dumps(r.get("request_payload")),
-                }
-
-                cur.execute(sql, params)
-                was_insert = cur.fetchone()[0]
-                if was_insert:
-                    inserted += 1
-                else:
-                    updated += 1
-
+            # streaming desde spool (o registros en memoria con handoff=memory)
+            counts = load_records(cur, "customers", windows, iter_records(windows, records))
         conn.commit()
 
-    total = inserted + updated
+    # Fingerprint por ventana para omitir ventanas sin cambios al re-correr (utils/fingerprint.py)
+    save_fingerprints("customers", windows, conn_str)
+    # inserted/updated/unchanged por tramo en raw.extract_tramos y cierre de la corrida (utils/run_metrics.py)
+    record_load("customers", windows, time.perf_counter() - t_load, conn_str)
+
+    inserted = counts["inserted"]
+    updated = counts["updated"]
+    unchanged = counts["unchanged"]  # mismo SyncToken: no se reescribe la fila
+    skipped = counts["skipped"]      # falta PK/payload o ventana desconocida
+
+    # Spool ya persistido en RAW; keep_spool=true lo conserva para re-cargas/debug
+    if not kwargs.get('keep_spool'):
+        remove_spool(windows)
+
+    total = inserted + updated + unchanged
     # Reporte final de carga
     print(json.dumps({
         "phase": "load", "ts": _now_utc_iso(),
         "status": "done",
-        "inserted": inserted, "updated": updated, "skipped": skipped,
-        "total_processed": total, "total_input": len(records)
+        "inserted": inserted, "updated": updated, "unchanged": unchanged,
+        "skipped": skipped,
+        "total_processed": total, "total_input": incoming
     }))
 
-    print(f"[load] Insertados={inserted} | Actualizados={updated} | Omitidos={skipped} | Total={total} (raw.qb_customers)")
+    print(f"[load] Insertados={inserted} | Actualizados={updated} | Sin cambios={unchanged} | Omitidos={skipped} | Total={total} (raw.qb_customers)")
+
+    # Latencia por lote, filas y rows/s de la carga (utils/telemetry.py)
+    report('load', "customers", total, time.perf_counter() - t_load)
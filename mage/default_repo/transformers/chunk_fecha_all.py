@@ -0,0 +1,168 @@
+from datetime import datetime, timezone, timedelta
+import psycopg
+
+if 'transformer' not in globals():
+    from mage_ai.data_preparation.decorators import transformer
+if 'test' not in globals():
+    from mage_ai.data_preparation.decorators import test
+
+from default_repo.utils.entities import select_entities
+from default_repo.utils.qbo_json import dumps
+from default_repo.utils.raw_load import pg_conn_str
+from default_repo.utils.realms import load_realms
+from default_repo.utils.dry_run import is_dry_run, plan, run_params
+from default_repo.utils.active_range import clamp_range
+from default_repo.utils.autotune import range_span, tuned_settings
+
+
+def _add_months(dt, months):
+    # Suma meses sin dependencias externas
+    y = dt.year + (dt.month - 1 + months) // 12
+    m = (dt.month - 1 + months) % 12 + 1
+    d = min(dt.day, [31,
+                     29 if y % 4 == 0 and (y % 100 != 0 or y % 400 == 0) else 28,
+                     31, 30, 31, 30, 31, 31, 30, 31, 30, 31][m - 1])
+    return dt.replace(year=y, month=m, day=d)
+
+
+def _add_years(dt, years):
+    try:
+        return dt.replace(year=dt.year + years)
+    except ValueError:
+        # 29 feb → 28 feb si el nuevo año no es bisiesto
+        return dt.replace(month=2, day=28, year=dt.year + years)
+
+
+def _step(cursor, chunk):
+    """Fin del tramo que empieza en cursor (sin recortar a fecha_fin)."""
+    if chunk in ('day', 'daily'):
+        return cursor + timedelta(days=1)
+    if chunk in ('week', 'weekly', 'semana', 'semanal'):
+        return cursor + timedelta(days=7)
+    if chunk in ('quarter', 'q', 'trim'):
+        return _add_months(cursor, 3)
+    if chunk in ('year', 'y', 'anual', 'año', 'ano'):
+        return _add_years(cursor, 1)
+    return _add_months(cursor, 1)  # month
+
+
+def _watermark_from_raw(entities, realms):
+    """
+    Watermark común de la corrida: el menor de los max(<watermark_column>) por entidad
+    y realm (así ninguna entidad ni realm se saltea datos). None si alguna entidad no
+    tiene tabla o algún realm no tiene filas en alguna entidad.
+    """
+    realm_ids = [r for r, _ in realms]
+    marks = {}
+    with psycopg.connect(pg_conn_str()) as conn:
+        with conn.cursor() as cur:
+            for cfg in entities:
+                name = cfg['name']
+                cur.execute("SELECT to_regclass(%s)", (f"raw.qb_{name}",))
+                if cur.fetchone()[0] is None:
+                    marks.update({(name, r): None for r in realm_ids})
+                    continue
+                cur.execute(
+                    f"SELECT realm_id, max({cfg['watermark_column']}) FROM raw.qb_{name} "
+                    "WHERE realm_id = ANY(%s) GROUP BY realm_id", (realm_ids,))
+                found = dict(cur.fetchall())
+                marks.update({(name, r): found.get(r) for r in realm_ids})
+
+    print(dumps({
+        "phase": "chunk", "entity": "all", "ts": datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'),
+        "watermarks": {f"{name}:{r}": v.isoformat() if v else None for (name, r), v in marks.items()}
+    }))
+    if any(v is None for v in marks.values()):
+        return None
+    wm = min(marks.values())
+    return wm.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+@transformer
+def chunk_fecha(*args, **kwargs):
+    """
+    Tramos comunes a todas las entidades del pipeline combinado (qb_all_backfill).
+    Runtime vars:
+      - fecha_inicio (ISO UTC | 'watermark' → el menor de los watermarks por entidad y realm)
+      - fecha_fin    (ISO UTC)
+      - chunk        ('day' | 'week' | 'month' | 'quarter' | 'year') [default: 'week']
+      - page_size    (int) [default: 200]
+      - entities     ('invoices,payments') [default: habilitadas en qbo_entities.yaml]
+      - autotune     ('on' | 'recommend' | 'off') [default: 'on'] → chunk/page_size no
+                      seteados salen del historial del pipeline combinado
+      - active_range ('on' | 'off') [default: 'on'] → recorta el rango al primer/último
+                      registro en QBO (dos sondas por realm)
+      - dry_run      (bool) [default: false] → sólo estima la corrida por entidad
+
+    El extractor combinado multiplica cada tramo por entidad y realm.
+    """
+    fi = kwargs.get('fecha_inicio')
+    ff = kwargs.get('fecha_fin')
+
+    if not fi or not ff:
+        raise Exception("Variables faltantes: fecha_inicio y/o fecha_fin")
+
+    if str(fi).lower() == 'watermark':
+        wm = _watermark_from_raw(select_entities(kwargs), load_realms(kwargs))
+        if wm is None:
+            raise Exception("fecha_inicio=watermark pero alguna entidad no tiene filas de algún realm en RAW; usar fecha ISO")
+        print(f"[chunk_fecha_all] watermark={wm}")
+        fi = wm
+
+    start = datetime.fromisoformat(fi.replace('Z', '+00:00')).astimezone(timezone.utc)
+    end   = datetime.fromisoformat(ff.replace('Z', '+00:00')).astimezone(timezone.utc)
+    if end <= start:
+        raise Exception("fecha_fin debe ser mayor que fecha_inicio")
+
+    # Autotuning (utils/autotune.py): chunk / page_size no seteados toman la combinación
+    # con más filas/segundo en corridas combinadas anteriores con las mismas entidades
+    # y un rango de tamaño parecido (autotune=off lo desactiva)
+    tuning = tuned_settings(kwargs, 'all', ('chunk', 'page_size'), (kwargs.get('mode') or 'backfill').lower(),
+                            span=range_span(start, end),
+                            entities=[cfg['name'] for cfg in select_entities(kwargs)])
+    chunk = (kwargs.get('chunk') or tuning.get('chunk') or 'week').lower()   # default week
+    page_size = int(kwargs.get('page_size') or tuning.get('page_size') or 200)
+
+    # Rango activo (utils/active_range.py): sondea el primer/último registro en QBO y
+    # recorta [start, end) para no pedir tramos vacíos, alineado a los límites de tramo
+    # del rango pedido (mismas ventanas que sin recorte; active_range=off lo desactiva)
+    start, end = clamp_range(kwargs, 'all', select_entities(kwargs), start, end,
+                             step=lambda dt: _step(dt, chunk))
+    if end <= start:
+        print("[chunk_fecha_all] sin registros en el rango pedido | tramos=0")
+        return []
+
+    tramos = []
+    cursor = start
+    tramo_id = 1
+
+    while cursor < end:
+        tramo_end = min(_step(cursor, chunk), end)
+
+        tramos.append({
+            'tramo_id': tramo_id,
+            'start': cursor.isoformat().replace('+00:00', 'Z'),
+            'end': tramo_end.isoformat().replace('+00:00', 'Z'),
+            'page_size': page_size,
+            'chunk': chunk,
+            # Estructura para métricas por tramo (cada entidad recibe su copia)
+            'metrics': {
+                'pages_read': 0,
+                'rows_read': 0,
+                'rows_inserted': 0,
+                'rows_updated': 0,
+                'duration_secs': 0.0,
+                'status': 'pending'
+            }
+        })
+        cursor = tramo_end
+        tramo_id += 1
+
+    print(f"[chunk_fecha_all] chunk={chunk} | page_size={page_size} | tramos={len(tramos)}")
+
+    # dry_run=true: un plan por entidad con el historial (el extractor afina con count(*))
+    if is_dry_run(kwargs):
+        realms = load_realms(kwargs)
+        for cfg in select_entities(kwargs):
+            plan(cfg['name'], tramos, realms, kwargs, *run_params(kwargs))
+    return tramos
@@ -1,10 +1,29 @@
 from datetime import datetime, timezone, timedelta
+import psycopg
 
 if 'transformer' not in globals():
     from mage_ai.data_preparation.decorators import transformer
 if 'test' not in globals():
     from mage_ai.data_preparation.decorators import test
 
+from default_repo.utils.raw_load import pg_conn_str
+from default_repo.utils.realms import fair_order, load_realms
+from default_repo.utils.tramo_queue import new_run_id, publish
+from default_repo.utils.autotune import range_span, tuned_settings
+from default_repo.utils.dry_run import is_dry_run, plan, run_params
+from default_repo.utils.active_range import clamp_range
+from default_repo.utils.entities import load_entities
+from default_repo.utils.rate_limit import use_shared_backend
+
+# Watermark incremental: columna generada e indexada (docker/schema/002_generated_columns.sql)
+# equivalente a payload->'MetaData'->>'LastUpdatedTime', sin decodificar el JSONB.
+# Un máximo por realm: la corrida usa el menor, así ningún realm saltea datos.
+WATERMARK_SQL = """
+SELECT realm_id, max(last_updated_time) FROM raw.qb_items
+WHERE realm_id = ANY(%s)
+GROUP BY realm_id
+"""
+
 
 def _add_months(dt, months):
     # Suma meses sin dependencias externas
@@ -24,53 +43,125 @@ def _add_years(dt, years):
         return dt.replace(month=2, day=28, year=dt.year + years)
 
 
+def _step(cursor, chunk):
+    """Fin del tramo que empieza en cursor (sin recortar a fecha_fin)."""
+    if chunk in ('day', 'daily'):
+        return cursor + timedelta(days=1)
+    if chunk in ('week', 'weekly', 'semana', 'semanal'):
+        return cursor + timedelta(days=7)
+    if chunk in ('quarter', 'q', 'trim'):
+        return _add_months(cursor, 3)
+    if chunk in ('year', 'y', 'anual', 'año', 'ano'):
+        return _add_years(cursor, 1)
+    return _add_months(cursor, 1)  # month
+
+
+def _watermark_from_raw(realms):
+    """
+    Watermark de la corrida como ISO UTC ('...Z'): el menor de los max(MetaData.LastUpdatedTime)
+    de cada realm de `realms`. None si algún realm no tiene filas en RAW (realm nuevo:
+    hay que traer su historia con una fecha ISO).
+    """
+    realm_ids = [r for r, _ in realms]
+    with psycopg.connect(pg_conn_str()) as conn:
+        with conn.cursor() as cur:
+            cur.execute(WATERMARK_SQL, (realm_ids,))
+            marks = dict(cur.fetchall())
+
+    if any(marks.get(r) is None for r in realm_ids):
+        return None
+    wm = min(marks[r] for r in realm_ids)
+    return wm.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
 @transformer
 def chunk_fecha(*args, **kwargs):
     """
     Genera tramos entre [fecha_inicio, fecha_fin) con tamaño configurable.
     Runtime vars:
-      - fecha_inicio (ISO UTC, ej: '2000-01-01T00:00:00Z')
+      - fecha_inicio (ISO UTC, ej: '2000-01-01T00:00:00Z' | 'watermark' → último
+                      MetaData.LastUpdatedTime cargado en raw.qb_items; el menor por realm)
       - fecha_fin    (ISO UTC, ej: '2050-01-01T00:00:00Z')
       - chunk        ('day' | 'week' | 'month' | 'quarter' | 'year') [default: 'day']
       - page_size    (int) [default: 200]
+      - publish_queue (bool) [default: false] → publica los tramos en raw.tramo_queue
+                      para que workers (mode=worker) los reclamen
+      - run_id       (str) [default: generado] id de la corrida en la cola
+      - realms       ('realm[:peso],...') [default: secret QBO_REALMS / QBO_REALM_ID]
+                      con publish_queue, se publica un tramo por realm
+      - autotune     ('on' | 'recommend' | 'off') [default: 'on'] → chunk/page_size no
+                      seteados salen del historial raw.tramo_history
+      - active_range ('on' | 'off') [default: 'on'] → recorta el rango al primer/último
+                      registro en QBO (dos sondas por realm)
+      - mode         ('snapshot' → sin tramos: el extractor trae la entidad completa;
+                      'repair' → sin tramos: trae por Id los referenciados que faltan)
+      - dry_run      (bool) [default: false] → sólo estima la corrida (tramos, requests,
+                      duración, memoria pico); no publica ni extrae
 
     parámetros UTC y segmentación día/semana
     devuelve campos para registrar métricas por tramo (páginas, inserts/updates, duración).
     """
+    # mode=snapshot: el extractor trae la entidad completa (utils/snapshot.py), sin tramos;
+    # mode=repair: trae por Id los referenciados por facturas que faltan (utils/repair_refs.py)
+    mode = (kwargs.get('mode') or '').lower()
+    if mode in ('snapshot', 'repair'):
+        print(f"[chunk_fecha] mode={mode} | tramos=0")
+        return []
+
     fi = kwargs.get('fecha_inicio')
     ff = kwargs.get('fecha_fin')
-    chunk = (kwargs.get('chunk') or 'week').lower()   # default week
-    page_size = int(kwargs.get('page_size') or 200)
 
     if not fi or not ff:
         raise Exception("Variables faltantes: fecha_inicio y/o fecha_fin")
 
+    # publish_queue: la corrida se reparte entre workers de varios procesos, así que el
+    # límite por realm pasa a Postgres desde el sondeo de rango activo (utils/rate_limit.py)
+    publish_queue = str(kwargs.get('publish_queue') or '').lower() in ('1', 'true', 'yes')
+    if publish_queue:
+        use_shared_backend('publish_queue')
+
+    if str(fi).lower() == 'watermark':
+        wm = _watermark_from_raw(load_realms(kwargs))
+        if wm is None:
+            raise Exception("fecha_inicio=watermark pero raw.qb_items no tiene filas de algún realm; usar fecha ISO")
+        print(f"[chunk_fecha] watermark={wm}")
+        fi = wm
+
     start = datetime.fromisoformat(fi.replace('Z', '+00:00')).astimezone(timezone.utc)
     end   = datetime.fromisoformat(ff.replace('Z', '+00:00')).astimezone(timezone.utc)
     if end <= start:
         raise Exception("fecha_fin debe ser mayor que fecha_inicio")
 
+    # Autotuning (utils/autotune.py): chunk / page_size no seteados toman la combinación
+    # con más filas/segundo en corridas anteriores con un rango de tamaño parecido
+    # (autotune=off lo desactiva)
+    tuning = tuned_settings(kwargs, 'items', ('chunk', 'page_size'), (kwargs.get('mode') or 'backfill').lower(),
+                            span=range_span(start, end))
+    chunk = (kwargs.get('chunk') or tuning.get('chunk') or 'week').lower()   # default week
+    page_size = int(kwargs.get('page_size') or tuning.get('page_size') or 200)
+
+    # Rango activo (utils/active_range.py): sondea el primer/último registro en QBO y
+    # recorta [start, end) para no pedir tramos vacíos, alineado a los límites de tramo
+    # del rango pedido (mismas ventanas que sin recorte; active_range=off lo desactiva)
+    start, end = clamp_range(kwargs, 'items', [load_entities()['items']], start, end,
+                             step=lambda dt: _step(dt, chunk))
+    if end <= start:
+        print("[chunk_fecha] sin registros en el rango pedido | tramos=0")
+        return []
+
     tramos = []
     cursor = start
     tramo_id = 1
 
     while cursor < end:
-        if chunk in ('day', 'daily'):
-            tramo_end = min(cursor + timedelta(days=1), end)
-        elif chunk in ('week', 'weekly', 'semana', 'semanal'):
-            tramo_end = min(cursor + timedelta(days=7), end)
-        elif chunk in ('quarter', 'q', 'trim'):
-            tramo_end = min(_add_months(cursor, 3), end)
-        elif chunk in ('year', 'y', 'anual', 'año', 'ano'):
-            tramo_end = min(_add_years(cursor, 1), end)
-        else:  # month
-            tramo_end = min(_add_months(cursor, 1), end)
+        tramo_end = min(_step(cursor, chunk), end)
 
         tramos.append({
             'tramo_id': tramo_id,
             'start': cursor.isoformat().replace('+00:00', 'Z'),
             'end': tramo_end.isoformat().replace('+00:00', 'Z'),
             'page_size': page_size,
+            'chunk': chunk,
             # Estructura para métricas por tramo
             'metrics': {
                 'pages_read': 0,
@@ -85,4 +176,22 @@ def chunk_fecha(*args, **kwargs):
         tramo_id += 1
 
     print(f"[chunk_fecha] chunk={chunk} | page_size={page_size} | tramos={len(tramos)}")
+
+    # dry_run=true: estima requests, duración y memoria (utils/dry_run.py) y no publica
+    # en la cola; el extractor afina la estimación con count(*) si no hay historial.
+    if is_dry_run(kwargs):
+        plan('items', tramos, load_realms(kwargs), kwargs, *run_params(kwargs))
+        return tramos
+
+    # Cola distribuida: los tramos quedan en raw.tramo_queue y cualquier número de
+    # workers (bloques con mode=worker o `python -m default_repo.utils.tramo_worker`)
+    # los reclama con SKIP LOCKED. Re-publicar el mismo run_id es no-op.
+    if publish_queue:
+        run_id = kwargs.get('run_id') or new_run_id('items')
+        jobs = fair_order(load_realms(kwargs), tramos)   # un tramo por realm, intercalados
+        published = publish(pg_conn_str(), 'items', run_id, jobs)
+        for t in tramos:
+            t['run_id'] = run_id
+        print(f"[chunk_fecha] run_id={run_id} | publicados={published} (raw.tramo_queue)")
+
     return tramos
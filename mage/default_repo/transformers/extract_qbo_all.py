@@ -0,0 +1,235 @@
+# --- EXTRACT: QBO, todas las entidades configuradas (pipeline combinado) ---
+# Entidades en qbo_entities.yaml (utils/entities.py); extractor genérico en utils/qbo_client.py.
+
+if 'transformer' not in globals():
+    from mage_ai.data_preparation.decorators import transformer
+if 'test' not in globals():
+    from mage_ai.data_preparation.decorators import test
+
+from datetime import datetime, timezone
+from itertools import zip_longest
+import json
+import time
+
+import psycopg
+
+from default_repo.utils.qbo_json import dumps
+from default_repo.utils.spool import run_spool_dir, write_tramo, count_records
+from default_repo.utils.fused import run_fused
+from default_repo.utils.raw_load import pg_conn_str
+from default_repo.utils.rate_limit import MAX_CONCURRENT
+from default_repo.utils.entities import select_entities, ensure_tables
+from default_repo.utils.qbo_client import QboClient, entity_summary, entity_where, new_metrics
+from default_repo.utils.realms import fair_order, load_realms, run_pool
+from default_repo.utils.autotune import record_history, tramo_span, tuned_settings
+from default_repo.utils.run_metrics import record_extract
+from default_repo.utils.dry_run import is_dry_run, plan
+from default_repo.utils.fingerprint import attach_fingerprints, save_fingerprints
+from default_repo.utils.telemetry import report
+
+
+def _now_utc_iso():
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def _plan_jobs(entities, realms, tramos):
+    """
+    Un job por (entidad, realm, tramo). Dentro de cada entidad los realms se intercalan
+    por peso (fair_order) y las entidades se alternan job a job, así todas avanzan
+    a la vez en el pool compartido en lugar de una detrás de otra.
+    """
+    per_entity = [[{**job, 'entity': cfg['name']} for job in fair_order(realms, tramos)]
+                  for cfg in entities]
+    return [job for batch in zip_longest(*per_entity) for job in batch if job is not None]
+
+
+def _normalize_tramos(data, **kwargs):
+    """
+    Normaliza la entrada a list[dict] con 'start','end','page_size','metrics'.
+    (Los tramos provienen de chunk_fecha_all)
+    """
+    if data is None:
+        fi = kwargs.get('fecha_inicio')
+        ff = kwargs.get('fecha_fin')
+        if fi and ff:
+            return [{'start': fi, 'end': ff, 'page_size': 200, 'metrics': new_metrics()}]
+        return []
+
+    try:
+        to_dict = getattr(data, 'to_dict', None)
+        if callable(to_dict):
+            return data.to_dict('records')
+    except Exception:
+        pass
+
+    if isinstance(data, list):
+        if data and isinstance(data[0], str):
+            try:
+                return [json.loads(s) for s in data]
+            except Exception:
+                pass
+        return data
+
+    if isinstance(data, str):
+        try:
+            obj = json.loads(data)
+            if isinstance(obj, dict):
+                return [obj]
+            if isinstance(obj, list):
+                return obj
+        except Exception:
+            return []
+
+    return []
+
+
+def _log_summary(windows, status, **extra):
+    """Una línea por entidad: las métricas no se mezclan entre entidades."""
+    for entity, summary in entity_summary(windows).items():
+        print(dumps({
+            "phase": "extract", "entity": entity, "ts": _now_utc_iso(),
+            "status": status, **summary, **extra
+        }))
+
+
+def _report(windows, t_run, phases=('extract',)):
+    """
+    Telemetría por entidad (utils/telemetry.py); rows/s sobre el tiempo de todo el bloque,
+    porque las entidades corren a la vez. 'all' lleva el refresh de tokens (compartido).
+    """
+    secs = time.perf_counter() - t_run
+    summaries = entity_summary(windows)
+    for phase in phases:
+        for entity, summary in summaries.items():
+            report(phase, entity, summary["rows_read"], secs)
+    report('extract', 'all', sum(s["rows_read"] for s in summaries.values()), secs)
+
+
+@transformer
+def transform(data=None, *args, **kwargs):
+    """
+    Extrae todas las entidades de la corrida (runtime var `entities`, default: habilitadas
+    en qbo_entities.yaml) en un solo proceso y con clientes compartidos:
+    sesión HTTP, token por realm y presupuesto de requests por realm.
+
+    Salida: como extract_qbo_<entity>, pero cada ventana lleva 'entity';
+    load_postgres_all carga cada entidad en su tabla raw.qb_<entity>.
+    Modos: 'backfill' (default) y 'fused'. La cola de tramos (mode=worker) sigue
+    siendo por entidad: usar los pipelines qb_<entity>_backfill.
+    """
+    t_run = time.perf_counter()
+    tramos = _normalize_tramos(data, **kwargs)
+    mode = (kwargs.get('mode') or 'backfill').lower()
+    if mode not in ('backfill', 'fused'):
+        raise Exception(f"mode={mode} no soportado en el pipeline combinado (backfill | fused)")
+    if not tramos:
+        print("No hay tramos")
+        return {"windows": [], "records": []}
+
+    entities = select_entities(kwargs)
+    by_name = {cfg['name']: cfg for cfg in entities}
+    realms = load_realms(kwargs)
+    payload_mode = (kwargs.get('payload_mode') or 'raw').lower()
+
+    # Autotuning (utils/autotune.py): prefetch_pages / fetch_workers no seteados salen de
+    # corridas combinadas anteriores con las mismas entidades y tramos de largo parecido
+    kwargs = {**kwargs, **tuned_settings(kwargs, 'all', ('prefetch_pages', 'fetch_workers'), mode, realms,
+                                          span=tramo_span(tramos), entities=list(by_name))}
+    prefetch_pages = str(kwargs.get('prefetch_pages') or 1).lower()
+    prefetch = MAX_CONCURRENT if prefetch_pages == 'auto' else max(1, int(prefetch_pages))
+
+    jobs = _plan_jobs(entities, realms, tramos)
+    client = QboClient()   # una sesión/pool HTTP para todas las entidades
+
+    # dry_run=true: un plan por entidad (utils/dry_run.py); el exporter no carga nada
+    if is_dry_run(kwargs):
+        def counter(cfg):
+            def count(t, realm_id):
+                sql = f"select count(*) from {cfg['qbo_entity']} {entity_where(cfg, t['start'], t['end'])}"
+                resp = client.query(cfg, client.access_token(realm_id), realm_id, sql.rstrip(), "count")
+                return resp.get("totalCount", 0)
+            return count
+
+        workers = int(kwargs.get('fetch_workers') or (max(2, len(entities)) if mode == 'fused' else len(entities)))
+        try:
+            estimates = {cfg['name']: plan(cfg['name'], tramos, realms, kwargs, prefetch, workers, counter(cfg))
+                         for cfg in entities}
+        finally:
+            client.close()
+        return {"windows": [], "records": [], "dry_run": estimates}
+
+    # Re-corridas: ventanas con fingerprint guardado se chequean antes de paginar
+    for cfg in entities:
+        attach_fingerprints(cfg['name'], cfg['filter_field'], [j for j in jobs if j['entity'] == cfg['name']], kwargs)
+
+    print(dumps({
+        "phase": "extract", "entity": "all", "ts": _now_utc_iso(), "status": "start",
+        "entities": list(by_name), "realms": len(realms), "tramos": len(tramos), "jobs": len(jobs),
+        "mode": mode
+    }))
+
+    try:
+        if mode == 'fused':
+            # Las tablas de entidades nuevas deben existir antes de que los loaders escriban
+            with psycopg.connect(pg_conn_str()) as conn:
+                with conn.cursor() as cur:
+                    ensure_tables(cur, entities)
+
+            def fetch(t, window_ref, emit):
+                window, _ = client.extract_tramo(by_name[t['entity']], t, window_ref, t['realm_id'],
+                                                 payload_mode, on_page=emit, prefetch=prefetch)
+                return window
+
+            fetch_workers = int(kwargs.get('fetch_workers') or max(2, len(entities)))
+            windows, stats = run_fused(
+                'all', jobs, fetch, pg_conn_str(),
+                fetch_workers=fetch_workers,
+                load_workers=int(kwargs.get('load_workers') or 2),
+                queue_pages=int(kwargs.get('queue_pages') or 8),
+            )
+            save_fingerprints('all', windows)
+            run_id = record_extract('all', windows, kwargs, mode, chunk=tramos[0].get('chunk'), loaded=True)
+            record_history('all', windows, kwargs, mode, prefetch, fetch_workers,
+                           chunk=tramos[0].get('chunk'), run_id=run_id)
+            _log_summary(windows, "loaded")
+            _report(windows, t_run, ('extract', 'load'))
+            return {"windows": windows, "records": [], "spool_dir": None, "loaded": True,
+                    "pipeline": stats, "entities": entity_summary(windows)}
+
+        handoff = (kwargs.get('handoff') or 'spool').lower()
+        run_dir = run_spool_dir('all', kwargs.get('spool_dir')) if handoff == 'spool' else None
+
+        def extract_job(ref, t):
+            window, records = client.extract_tramo(by_name[t['entity']], t, ref, t['realm_id'],
+                                                   payload_mode, prefetch=prefetch)
+            if window is not None and run_dir:
+                window["spool"] = write_tramo(run_dir, ref, records)
+                records = []
+            return window, records
+
+        # Default: un hilo por entidad, así las entidades corren a la vez
+        workers = int(kwargs.get('fetch_workers') or len(entities))
+        windows, out = [], []
+        for window, records in run_pool(extract_job, jobs, workers):
+            if window is None:
+                continue
+            out.extend(records)
+            windows.append(window)
+    finally:
+        client.close()
+
+    # Historial por tramo (una fila por entidad/realm/tramo) para el autotuning
+    # y métricas persistidas por entidad (raw.extract_runs/extract_tramos); el exporter las completa
+    run_id = record_extract('all', windows, kwargs, mode, chunk=tramos[0].get('chunk'))
+    record_history('all', windows, kwargs, mode, prefetch, workers, chunk=tramos[0].get('chunk'), run_id=run_id)
+
+    _log_summary(windows, "completed", handoff=handoff)
+    print(dumps({
+        "phase": "extract", "entity": "all", "ts": _now_utc_iso(),
+        "status": "completed", "jobs": len(jobs), "windows": len(windows),
+        "total_records": count_records(windows, out), "handoff": handoff
+    }))
+    _report(windows, t_run)
+
+    return {"windows": windows, "records": out, "spool_dir": run_dir,
+            "entities": entity_summary(windows)}
@@ -3,208 +3,252 @@ if 'transformer' not in globals():
 if 'test' not in globals():
     from mage_ai.data_preparation.decorators import test
 
-from mage_ai.data_preparation.shared.secrets import get_secret_value
 from datetime import datetime, timezone
-import base64
 import time
-import requests
 import json
-import math
 
-
-TOKEN_URL = "https://oauth.platform.intuit.com/oauth2/v1/tokens/bearer"
-QBO_BASE  = "https://sandbox-quickbooks.api.intuit.com"
-
-# Parámetros de robustez
-MAX_ATTEMPTS_PER_REQ = 6        # Circuit breaker por request
-BACKOFF_BASE_SECONDS = 1.5       # Backoff exponencial
-BACKOFF_CAP_SECONDS  = 30
+from default_repo.utils.qbo_json import dumps
+from default_repo.utils.spool import run_spool_dir, write_tramo, count_records
+from default_repo.utils.fused import run_fused
+from default_repo.utils.raw_load import pg_conn_str
+from default_repo.utils.rate_limit import concurrency, MAX_CONCURRENT, use_shared_backend
+from default_repo.utils.prefetch import iter_pages
+from default_repo.utils.tramo_queue import run_worker, LEASE_SECS
+from default_repo.utils.realms import fair_order, load_realms, run_pool
+from default_repo.utils.autotune import record_history, tramo_span, tuned_settings
+from default_repo.utils.run_metrics import record_extract
+from default_repo.utils.dry_run import is_dry_run, plan
+from default_repo.utils.telemetry import report, rows_read
+from default_repo.utils.reconcile import reconcile, repair_enabled
+from default_repo.utils.fingerprint import attach_fingerprints, save_fingerprints
+from default_repo.utils.qbo_client import QboClient
+from default_repo.utils.snapshot import (
+    SNAPSHOT_PAGE_SIZE, apply_snapshot, snapshot_page, snapshot_where, snapshot_window
+)
+from default_repo.utils.repair_refs import (
+    REPAIR_BATCH, fetch_ids, load_rows, missing_ids, repair_window
+)
+
+
+# Campo de ventana para Customers (se registra en raw.extract_windows)
+CUSTOMER_FILTER_FIELD = "MetaData.CreateTime"
+
+# Entidad para utils/qbo_client.QboClient: auth, reintentos + circuit breaker, límite
+# por realm, cache de respuestas y prefetch viven ahí (misma pila que qb_all_backfill)
+CUSTOMERS = {'name': 'customers', 'qbo_entity': 'Customer', 'filter_field': CUSTOMER_FILTER_FIELD}
+
+# Sesión HTTP + tokens del bloque; se cierra al terminar transform
+_client = QboClient('customers')
 
 # ====== Helpers ======
 def _now_utc_iso():
     return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
 
 
-def _get_access_token():
-    """
-    Usa CLIENT_ID/CLIENT_SECRET + REFRESH_TOKEN para obtener un access_token.
-    Cumple 7.2: OAuth 2.0: obtener Access Token desde el Refresh Token
-    al inicio de cada ejecución/tramo (se invoca dentro del loop de tramos).
-    """
-    client_id = get_secret_value('QBO_CLIENT_ID')
-    client_secret = get_secret_value('QBO_CLIENT_SECRET')
-    refresh_token = get_secret_value('QBO_REFRESH_TOKEN')
-
-    if not all([client_id, client_secret, refresh_token]):
-        raise Exception("Faltan secretos QBO: QBO_CLIENT_ID / QBO_CLIENT_SECRET / QBO_REFRESH_TOKEN")
-
-    basic = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
-    headers = {
-        "Authorization": f"Basic {basic}",
-        "Accept": "application/json",
-        "Content-Type": "application/x-www-form-urlencoded",
-    }
-    data = {"grant_type": "refresh_token", "refresh_token": refresh_token}
-
-    resp = requests.post(TOKEN_URL, headers=headers, data=data, timeout=30)
-
-    # Logging por fase 
-    print(json.dumps({
-        "phase": "auth", "ts": _now_utc_iso(),
-        "status_code": resp.status_code, "ok": resp.ok
-    }))
+def _get_access_token(realm_id=None, force=False):
+    """Token por realm (cacheado; se renueva al expirar o ante 401)."""
+    return _client.access_token(realm_id, force)
 
-    if resp.status_code == 400 and "invalid_grant" in (resp.text or ""):
-        # Error de RT inválido o caducado
-        raise PermissionError("invalid_grant: refresh_token inválido/expirado/rotado. Reautorizar QBO.")
 
-    if resp.status_code != 200:
-        raise Exception(f"Token error {resp.status_code}: {resp.text}")
+def _qbo_count_customers(access_token, realm_id, start_iso, end_iso, metrics=None, updated_after=None):
+    """select count(*) de la ventana, sin payloads (dry-run, reconcile, fingerprint)."""
+    return _client.count(CUSTOMERS, access_token, realm_id, start_iso, end_iso, metrics, updated_after)
 
-    js = resp.json()
 
-    return js["access_token"]
+def _qbo_select_customers(access_token, realm_id, sql, label, metrics=None):
+    """POST /query de un select armado por el llamador (mode=snapshot / repair); devuelve el QueryResponse."""
+    return _client.query(CUSTOMERS, access_token, realm_id, sql, label, metrics)
 
 
-def _qbo_time(iso_z: str) -> str:
-    """
-    para UTC usa +00:00.
-    filtros históricos en UTC.
-    """
-    return iso_z.replace('Z', '+00:00') if iso_z.endswith('Z') else iso_z
+def _build_customer_snapshot_sql(start_position=None, max_results=None):
+    """Customer completo (activos e inactivos, sin ventana); sin paginación = count(*)."""
+    if start_position is None:
+        return "select count(*) from Customer " + snapshot_where().rstrip()
+    return "select * from Customer " + snapshot_where() + snapshot_page(start_position, max_results)
 
 
-def _post_with_retries(url, headers, data, label="query"):
+def _extract_tramo(t, window_ref, realm_id, payload_mode='raw', on_page=None, prefetch=1):
     """
-    POST con reintentos/backoff y circuit breaker.
-    rate limits y errores con backoff exponencial + circuit breaker y logs
+    Extrae un tramo completo con token propio (401 → renueva y reintenta una vez).
+    Devuelve (window, records); (None, []) si el tramo se omite.
+    Con on_page(window, page_records) las páginas se entregan al callback (modo fused)
+    y records queda vacío.
     """
-    attempts = 0
-    while True:
-        attempts += 1
-        try:
-            resp = requests.post(url, headers=headers, data=data, timeout=60)
-        except Exception as e:
-            # Log de error de transporte
-            print(json.dumps({
-                "phase": "extract", "stage": label, "ts": _now_utc_iso(),
-                "attempt": attempts, "transport_error": str(e)
-            }))
-            if attempts >= MAX_ATTEMPTS_PER_REQ:
-                raise TimeoutError(f"circuit_breaker: transporte fallido {attempts} veces")
-            sleep_s = min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS ** attempts)
-            time.sleep(sleep_s)
-            continue
-
-        # Log por intento
-        print(json.dumps({
-            "phase": "extract", "stage": label, "ts": _now_utc_iso(),
-            "attempt": attempts, "status_code": resp.status_code
-        }))
-
-        if resp.status_code == 200:
-            return resp
-
-        if resp.status_code in (429,) or 500 <= resp.status_code < 600:
-            # Backoff ante límites o 5xx
-            if attempts >= MAX_ATTEMPTS_PER_REQ:
-                raise TimeoutError(f"circuit_breaker: {resp.status_code} tras {attempts} intentos")
-            sleep_s = min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS ** attempts)
-            time.sleep(sleep_s)
-            continue
-
-        if resp.status_code == 401:
-            # Token expirado; que lo maneje el caller (PermissionError)
-            raise PermissionError("401 Unauthorized (token expirado).")
+    return _client.extract_tramo(CUSTOMERS, t, window_ref, realm_id, payload_mode, on_page, prefetch)
 
-        # Otros errores → fail rápido con SQL visible para troubleshooting (7.5 Runbook)
-        raise Exception(f"QBO POST error {resp.status_code}: {resp.text}")
 
-
-def _qbo_query_customers(access_token, realm_id, start_position=1, max_results=200,
-                         start_iso=None, end_iso=None):
+def _run_fused(jobs, payload_mode, prefetch=1, **kwargs):
     """
-    Ejecuta /query para traer Customer por ventana usando MetaData.CreateTime.
-    Cumple 7.2: filtros históricos (UTC) + paginación hasta agotar resultados.
-    Variante que tu sandbox acepta:
-      - sin minorversion
-      - Content-Type: application/text
-      - SQL en minúsculas, sin ORDERBY
+    mode='fused': extract + load solapados con cola acotada (utils/fused.py).
+    Las páginas se cargan a RAW mientras se siguen pidiendo; el exporter no recibe registros.
+    `jobs` = tramos por realm en orden justo (utils/realms.fair_order).
     """
-    if not (start_iso and end_iso):
-        raise Exception("Faltan start_iso y end_iso para la consulta.")
+    def fetch(t, window_ref, emit):
+        window, _ = _extract_tramo(t, window_ref, t['realm_id'], payload_mode,
+                                   on_page=emit, prefetch=prefetch)
+        return window
+
+    fetch_workers = int(kwargs.get('fetch_workers') or 2)
+    windows, stats = run_fused(
+        'customers', jobs, fetch, pg_conn_str(),
+        fetch_workers=fetch_workers,
+        load_workers=int(kwargs.get('load_workers') or 2),
+        queue_pages=int(kwargs.get('queue_pages') or 8),
+    )
+    save_fingerprints('customers', windows)
+    chunk = jobs[0].get('chunk') if jobs else None
+    run_id = record_extract('customers', windows, kwargs, 'fused', chunk=chunk, loaded=True)
+    record_history('customers', windows, kwargs, 'fused', prefetch, fetch_workers, chunk=chunk, run_id=run_id)
+    return {"windows": windows, "records": [], "spool_dir": None, "loaded": True, "pipeline": stats}
 
-    start_qbo = _qbo_time(start_iso)
-    end_qbo   = _qbo_time(end_iso)
 
-    sql = (
-        "select * from Customer "
-        f"where MetaData.CreateTime >= '{start_qbo}' "
-        f"and MetaData.CreateTime <  '{end_qbo}' "
-        f"startposition {start_position} maxresults {max_results}"
+def _run_worker(tramos, realms, payload_mode, prefetch=1, **kwargs):
+    """
+    mode='worker': reclama tramos de raw.tramo_queue (utils/tramo_queue.py) hasta
+    vaciar la cola, extrae y carga cada uno. Varios workers pueden repartirse una corrida.
+    El run_id sale de la variable `run_id` o de los tramos publicados por chunk_fecha.
+    Sólo se reclaman tramos de los realms configurados (hay credenciales para ellos).
+    """
+    # Varios workers contra los mismos realms: límite de requests compartido (Postgres)
+    use_shared_backend('worker')
+    run_id = kwargs.get('run_id') or next((t.get('run_id') for t in tramos if t.get('run_id')), None)
+
+    def fetch(t, window_ref, emit):
+        # Fingerprint del tramo reclamado (una lookup por tramo): sin cambios → skipped_unchanged
+        attach_fingerprints('customers', CUSTOMER_FILTER_FIELD, [t], kwargs)
+        window, _ = _extract_tramo(t, window_ref, t['realm_id'], payload_mode,
+                                   on_page=emit, prefetch=prefetch)
+        return window, t['metrics']['status']   # 'skipped_*' completa el tramo en la cola
+
+    windows, stats = run_worker(
+        'customers', fetch, pg_conn_str(), [r for r, _ in realms], run_id=run_id,
+        lease_secs=int(kwargs.get('lease_secs') or LEASE_SECS),
+        max_tramos=int(kwargs['max_tramos']) if kwargs.get('max_tramos') else None,
     )
+    save_fingerprints('customers', windows)
+    run_id = record_extract('customers', windows, kwargs, 'worker', run_id=run_id, loaded=True)
+    record_history('customers', windows, kwargs, 'worker', prefetch, 1, run_id=run_id)
+    return {"windows": windows, "records": [], "spool_dir": None, "loaded": True, "pipeline": stats}
+
 
-    url = f"{QBO_BASE}/v3/company/{realm_id}/query"   # <- sin minorversion
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Content-Type": "application/text",           # <- clave en tu sandbox
-    }
+def _run_snapshot(realms, prefetch=1, **kwargs):
+    """
+    mode='snapshot': Customer completo por realm en páginas de 1000, diff contra RAW
+    por SyncToken y marca de ids desaparecidos (utils/snapshot.py). No usa tramos;
+    carga en el bloque y el exporter no recibe registros. 401 → token nuevo y se
+    repite el realm (la transacción del intento fallido ya hizo rollback).
+    """
+    if is_dry_run(kwargs):
+        estimate = {}
+        for realm_id, _ in realms:
+            qres = _qbo_select_customers(_get_access_token(realm_id), realm_id,
+                                           _build_customer_snapshot_sql(), "count")
+            rows = int(qres.get("totalCount", 0))
+            estimate[realm_id] = {"rows_estimated": rows, "query_calls": rows // SNAPSHOT_PAGE_SIZE + 1}
+        print(dumps({
+            "phase": "dry_run", "ts": _now_utc_iso(),
+            "mode": "snapshot", "realms": estimate
+        }))
+        return {"windows": [], "records": [], "dry_run": estimate}
+
+    def load_realm(realm_id, access_token):
+        window = snapshot_window(realm_id)
+        metrics = window["metrics"]
+        metrics['retries'] = 0
+
+        def fetch_page(pos):
+            qres = _qbo_select_customers(access_token, realm_id,
+                                           _build_customer_snapshot_sql(pos, SNAPSHOT_PAGE_SIZE),
+                                           "snapshot", metrics)
+            rows = qres.get("Customer", []) or []
+            print(dumps({
+                "phase": "extract", "ts": _now_utc_iso(), "stage": "snapshot",
+                "realm_id": realm_id, "startpos": pos, "returned_rows": len(rows),
+                "has_more": len(rows) == SNAPSHOT_PAGE_SIZE, "concurrency": concurrency(realm_id)
+            }))
+            return rows
 
-    resp = _post_with_retries(url, headers, sql, label="customers.query")
-    js = resp.json()
-    qres = js.get("QueryResponse", {})
-    rows = qres.get("Customer", []) or []
+        # count(*) al empezar: con menos ids distintos no se marcan borrados
+        qres = _qbo_select_customers(access_token, realm_id, _build_customer_snapshot_sql(), "count", metrics)
+        expected = int(qres.get("totalCount", 0))
 
-    has_more = len(rows) == max_results
-    next_pos = start_position + max_results if has_more else None
+        pages = iter_pages(fetch_page, SNAPSHOT_PAGE_SIZE, prefetch)
+        return window, apply_snapshot(pg_conn_str(), 'customers', window, pages, expected)
 
-    # Métrica por página (7.1/7.5): logging con filas devueltas
-    print(json.dumps({
-        "phase": "extract", "ts": _now_utc_iso(),
-        "startpos": start_position, "returned_rows": len(rows), "has_more": has_more
-    }))
+    windows, totals = [], {}
+    for realm_id, _ in realms:
+        t0 = time.time()
+        try:
+            window, counts = load_realm(realm_id, _get_access_token(realm_id))
+        except PermissionError:
+            window, counts = load_realm(realm_id, _get_access_token(realm_id, force=True))
+        window["metrics"]['duration_secs'] = round(time.time() - t0, 3)
+        window["metrics"]['concurrency'] = concurrency(realm_id)
+        # Log consolidado por realm (Cumple 7.5)
+        print(dumps({
+            "phase": "load", "ts": _now_utc_iso(),
+            "status": "snapshot", "realm_id": realm_id,
+            "pages_read": window["metrics"]['pages_read'], "rows_read": window["metrics"]['rows_read'],
+            **counts, "duration_secs": window["metrics"]['duration_secs']
+        }))
+        windows.append(window)
+        totals[realm_id] = counts
 
-    return rows, has_more, next_pos
+    return {"windows": windows, "records": [], "spool_dir": None, "loaded": True, "snapshot": totals}
 
 
-def _fetch_customers_window(access_token, realm_id, start_iso, end_iso, page_size):
+def _run_repair(realms, **kwargs):
     """
-    Trae todos los Customer creados en [start_iso, end_iso).
-    Devuelve:
-      - records: lista de dicts {'id','payload','page_number'}
-      - pages_read: número de páginas leídas
-      - rows_read: total de filas devueltas
-
-    7.1: registrar por tramo páginas leídas y filas leídas.
-    7.2: completa paginación hasta lote incompleto.
+    mode='repair': Customer referenciados por raw.qb_invoices que faltan en raw.qb_customers
+    (una query anti-join), traídos con `where Id in (...)` de a `repair_batch` ids por
+    request y cargados en el bloque (utils/repair_refs.py). No usa tramos; el exporter
+    no recibe registros. 401 → token nuevo y se repite el realm.
     """
-    records = []
-    pos = 1
-    page_number = 0
-    total_rows = 0
+    missing = missing_ids('customers', realms)
+    batch = int(kwargs.get('repair_batch') or REPAIR_BATCH)
+
+    if is_dry_run(kwargs):
+        estimate = {realm_id: {"missing_ids": len(ids), "query_calls": -(-len(ids) // batch)}
+                    for realm_id, ids in missing.items()}
+        print(dumps({
+            "phase": "dry_run", "ts": _now_utc_iso(),
+            "mode": "repair", "realms": estimate
+        }))
+        return {"windows": [], "records": [], "dry_run": estimate}
 
-    while True:
-        page_number += 1
+    def fetch_realm(realm_id, ids, access_token, metrics):
+        def query(sql, label):
+            return _qbo_select_customers(access_token, realm_id, sql, label, metrics)
+        return fetch_ids(query, "Customer", ids, batch, metrics)
+
+    windows, totals = [], {}
+    for realm_id, ids in missing.items():
+        t0 = time.time()
+        window = repair_window(realm_id, batch)
+        metrics = window["metrics"]
+        metrics['retries'] = 0
         try:
-            rows, has_more, next_pos = _qbo_query_customers(
-                access_token, realm_id,
-                start_position=pos, max_results=page_size,
-                start_iso=start_iso, end_iso=end_iso,
-            )
+            rows = fetch_realm(realm_id, ids, _get_access_token(realm_id), metrics)
         except PermissionError:
-            # Devolver control al caller para renovar token
-            raise
-
-        for c in rows:
-            records.append({"id": c["Id"], "payload": c, "page_number": page_number})
-        total_rows += len(rows)
-
-        if not has_more:
-            break
-        pos = next_pos
+            metrics['pages_read'] = metrics['rows_read'] = 0
+            rows = fetch_realm(realm_id, ids, _get_access_token(realm_id, force=True), metrics)
+        counts = load_rows('customers', window, rows)
+        fetched = {row.get("Id") for row in rows}
+        not_found = [i for i in ids if i not in fetched]
+        metrics['duration_secs'] = round(time.time() - t0, 3)
+        # Log consolidado por realm (Cumple 7.5)
+        print(dumps({
+            "phase": "load", "ts": _now_utc_iso(),
+            "status": "repair", "realm_id": realm_id, "missing": len(ids), "fetched": len(fetched),
+            "not_found": len(not_found), "not_found_sample": not_found[:20],
+            "query_calls": metrics['pages_read'], **counts, "duration_secs": metrics['duration_secs']
+        }))
+        windows.append(window)
+        totals[realm_id] = {"missing": len(ids), "fetched": len(fetched), "not_found": len(not_found), **counts}
 
-    return records, page_number, total_rows
+    if not missing:
+        print(dumps({"phase": "load", "ts": _now_utc_iso(), "status": "repair", "missing": 0}))
+    return {"windows": windows, "records": [], "spool_dir": None, "loaded": True, "repair": totals}
 
 
 def _normalize_tramos(data, **kwargs):
@@ -259,115 +303,132 @@ def transform(data=None, *args, **kwargs):
     """
     Input real de Mage: `data` (sale de chunk_fecha).
     Normalizamos a list[dict] con claves start/end/page_size y extraemos.
+    Devuelve {'windows': metadatos por tramo, 'records': id/payload/window_ref/page_number}.
     """
-    tramos = _normalize_tramos(data, **kwargs)
-    if not tramos:
-        print("No hay tramos")
-        return []
+    try:
+        return _transform(data, **kwargs)
+    finally:
+        _client.close()   # sesión HTTP + pool del limitador (utils/rate_limit.py)
 
-    realm_id = get_secret_value('QBO_REALM_ID')
-    if not realm_id:
-        raise Exception("Falta QBO_REALM_ID en Secrets.")
-
-    out = []
-
-    for t in tramos:
-        start_iso = t.get('start')
-        end_iso   = t.get('end')
-        page_size = int(t.get('page_size', 200))
-        metrics   = t.get('metrics') or {
-            'pages_read': 0, 'rows_read': 0,
-            'rows_inserted': 0, 'rows_updated': 0,
-            'duration_secs': 0.0, 'status': 'pending'
-        }
-
-        if not start_iso or not end_iso:
-            # Log de tramo inválido
-            print(json.dumps({
-                "phase": "extract", "ts": _now_utc_iso(),
-                "status": "skip", "reason": "tramo_sin_fechas",
-                "start": start_iso, "end": end_iso
-            }))
-            continue
 
-        # Token por tramo (Cumple 7.2)
-        try:
-            access_token = _get_access_token()
-        except PermissionError as e:
-            # Log y aborta tramo con estado failed (Runbook 7.5)
-            metrics['status'] = 'failed_auth'
-            print(json.dumps({
-                "phase": "auth", "ts": _now_utc_iso(),
-                "status": "failed", "error": str(e),
-                "start": start_iso, "end": end_iso
-            }))
-            continue
+def _transform(data, **kwargs):
+    t_run = time.perf_counter()
+    tramos = _normalize_tramos(data, **kwargs)
 
-        t0 = time.time()
-        print(json.dumps({
-            "phase": "extract", "ts": _now_utc_iso(),
-            "status": "start", "start": start_iso, "end": end_iso,
-            "page_size": page_size
-        }))
+    # 'backfill' (default): extract y luego exporter; 'fused': extract+load solapados;
+    # 'worker': reclama tramos de raw.tramo_queue (no necesita tramos de entrada);
+    # 'snapshot': Customer completo con diff por SyncToken (tampoco usa tramos);
+    # 'repair': trae por Id los Customer referenciados por facturas que faltan en RAW
+    mode = (kwargs.get('mode') or 'backfill').lower()
+    if not tramos and mode not in ('worker', 'snapshot', 'repair'):
+        print("No hay tramos")
+        return {"windows": [], "records": []}
+
+    # Uno o varios realms (secret QBO_REALMS / QBO_REALM_ID o runtime var `realms`)
+    realms = load_realms(kwargs)
+
+    # 'raw' (default): payload como texto JSON listo para JSONB; 'dict': objeto anidado
+    payload_mode = (kwargs.get('payload_mode') or 'raw').lower()
+
+    # Autotuning (utils/autotune.py): prefetch_pages / fetch_workers no seteados toman la
+    # combinación con más filas/segundo en corridas anteriores con tramos de largo parecido
+    # (autotune=off lo desactiva)
+    kwargs = {**kwargs, **tuned_settings(kwargs, 'customers', ('prefetch_pages', 'fetch_workers'), mode, realms,
+                                          span=tramo_span(tramos))}
+
+    # Páginas pedidas en paralelo dentro de cada ventana (1 = secuencial; 'auto' = hasta
+    # QBO_MAX_CONCURRENT y el AIMD de utils/rate_limit.py decide cuántas van en vuelo)
+    prefetch_pages = str(kwargs.get('prefetch_pages') or 1).lower()
+    prefetch = MAX_CONCURRENT if prefetch_pages == 'auto' else max(1, int(prefetch_pages))
+
+    if mode == 'snapshot':
+        return _run_snapshot(realms, prefetch, **kwargs)
+
+    if mode == 'repair':
+        return _run_repair(realms, **kwargs)
+
+    # dry_run=true: sólo estima la corrida (utils/dry_run.py); count(*) por muestra de
+    # tramos si no hay historial, nunca payloads. El exporter no carga nada.
+    if is_dry_run(kwargs):
+        def count(t, realm_id):
+            return _qbo_count_customers(_get_access_token(realm_id), realm_id, t['start'], t['end'])
+
+        workers = int(kwargs.get('fetch_workers') or (2 if mode == 'fused' else 1))
+        estimate = plan('customers', tramos, realms, kwargs, prefetch, workers, count)
+        return {"windows": [], "records": [], "dry_run": estimate}
+
+    if mode == 'worker':
+        result = _run_worker(tramos, realms, payload_mode, prefetch, **kwargs)
+        for phase in ('extract', 'load'):   # el worker también carga
+            report(phase, "customers", rows_read(result['windows']), time.perf_counter() - t_run)
+        return result
+
+    # Un job por (realm, tramo), intercalados por peso: el pool compartido los toma en
+    # ese orden y una compañía grande no deja sin turno a las chicas.
+    jobs = fair_order(realms, tramos)
+
+    # 'reconcile': count(*) por tramo en QBO vs RAW, sin payloads (utils/reconcile.py);
+    # con reconcile_repair=true sigue como backfill sólo con los tramos con diferencia
+    if mode == 'reconcile':
+        def count(t, realm_id):
+            try:
+                return _qbo_count_customers(_get_access_token(realm_id), realm_id, t['start'], t['end'])
+            except PermissionError:
+                return _qbo_count_customers(_get_access_token(realm_id, force=True), realm_id, t['start'], t['end'])
+
+        jobs = reconcile('customers', CUSTOMER_FILTER_FIELD, jobs, count, kwargs)
+        if not jobs or not repair_enabled(kwargs):
+            return {"windows": [], "records": [], "reconciled": True}
+    else:
+        # Re-corridas: ventanas con fingerprint guardado se chequean antes de paginar
+        attach_fingerprints('customers', CUSTOMER_FILTER_FIELD, jobs, kwargs)
+
+    if mode == 'fused':
+        result = _run_fused(jobs, payload_mode, prefetch, **kwargs)
+        for phase in ('extract', 'load'):   # fused: la carga corre en este bloque
+            report(phase, "customers", rows_read(result['windows']), time.perf_counter() - t_run)
+        return result
+
+    # 'spool' (default): un gzip por tramo y la salida del bloque es sólo el manifiesto
+    # (tamaño constante sin importar el volumen); 'memory': registros en la salida.
+    handoff = (kwargs.get('handoff') or 'spool').lower()
+    run_dir = run_spool_dir('customers', kwargs.get('spool_dir')) if handoff == 'spool' else None
+
+    windows = []   # metadatos por tramo → raw.extract_windows
+    out = []       # registros compactos: id, payload, window_ref, page_number
+
+    def extract_job(ref, t):
+        window, records = _extract_tramo(t, ref, t['realm_id'], payload_mode, prefetch=prefetch)
+        # Con handoff='spool' los registros van a disco y sólo viaja el manifiesto.
+        if window is not None and run_dir:
+            window["spool"] = write_tramo(run_dir, ref, records)
+            records = []
+        return window, records
+
+    # fetch_workers > 1: pool compartido entre realms (default 1 = secuencial)
+    workers = int(kwargs.get('fetch_workers') or 1)
+    for window, records in run_pool(extract_job, jobs, workers):
+        if window is None:
+            continue
+        out.extend(records)
+        windows.append(window)
 
-        try:
-            # Extrae toda la ventana (Cumple 7.2: paginación completa)
-            records, pages_read, rows_read = _fetch_customers_window(
-                access_token, realm_id, start_iso, end_iso, page_size
-            )
-        except PermissionError:
-            # Renueva token una vez y reintenta solo este tramo (7.2)
-            access_token = _get_access_token()
-            records, pages_read, rows_read = _fetch_customers_window(
-                access_token, realm_id, start_iso, end_iso, page_size
-            )
-
-        duration = time.time() - t0
-
-        # Actualiza métricas de tramo (Cumple 7.1 / 7.5)
-        metrics['pages_read']   = int(pages_read)
-        metrics['rows_read']    = int(rows_read)
-        metrics['duration_secs']= round(duration, 3)
-        metrics['status']       = 'extracted'
-
-        # Marca de ingesta UTC (Cumple 7.3 / 7.4)
-        ingested_at = _now_utc_iso()
-
-        # Empaqueta registros con metadatos requeridos por capa RAW (Cumple 7.3)
-        for r in records:
-            page_number = r["page_number"]
-            out.append({
-                "id": r["id"],
-                "payload": r["payload"],
-                "ingested_at_utc": ingested_at,
-                "extract_window_start_utc": start_iso,
-                "extract_window_end_utc": end_iso,
-                "page_number": page_number,            # <= real por página (7.3)
-                "page_size": page_size,                # <= (7.3)
-                "request_payload": {                   # <= (7.3)
-                    "start": start_iso,
-                    "end": end_iso,
-                    "page": page_number,
-                    "page_size": page_size,
-                },
-                # Nota 7.4: Idempotencia se asegura en el exporter con ON CONFLICT (id).
-            })
-
-        # Log consolidado del tramo (Cumple 7.5: métricas por tramo)
-        print(json.dumps({
-            "phase": "extract", "ts": _now_utc_iso(),
-            "status": "done",
-            "start": start_iso, "end": end_iso,
-            "pages_read": metrics['pages_read'],
-            "rows_read": metrics['rows_read'],
-            "duration_secs": metrics['duration_secs']
-        }))
+    # Historial por tramo para el autotuning de próximas corridas
+    # y métricas persistidas de la corrida (raw.extract_runs/extract_tramos); el exporter las completa
+    run_id = record_extract('customers', windows, kwargs, mode, chunk=tramos[0].get('chunk'),
+                            run_id=tramos[0].get('run_id'))
+    record_history('customers', windows, kwargs, mode, prefetch, workers,
+                   chunk=tramos[0].get('chunk'), run_id=run_id)
 
     # Resumen total (Cumple 7.5: reporte final de extracción)
-    print(json.dumps({
+    print(dumps({
         "phase": "extract", "ts": _now_utc_iso(),
         "status": "completed",
-        "tramos": len(tramos), "total_records": len(out)
+        "tramos": len(jobs), "realms": len(realms), "windows": len(windows),
+        "total_records": count_records(windows, out), "handoff": handoff
     }))
 
-    return out
+    # Latencias, reintentos y rows/s del bloque (utils/telemetry.py)
+    report('extract', "customers", rows_read(windows), time.perf_counter() - t_run)
+
+    return {"windows": windows, "records": out, "spool_dir": run_dir}
@@ -6,222 +6,115 @@ if 'transformer' not in globals():
 if 'test' not in globals():
     from mage_ai.data_preparation.decorators import test
 
-from mage_ai.data_preparation.shared.secrets import get_secret_value
 from datetime import datetime, timezone
-import base64
 import time
-import requests
 import json
 
-# ====== Config ======
-TOKEN_URL = "https://oauth.platform.intuit.com/oauth2/v1/tokens/bearer"
-QBO_BASE  = "https://sandbox-quickbooks.api.intuit.com"   # sandbox
+from default_repo.utils.qbo_json import dumps
+from default_repo.utils.spool import run_spool_dir, write_tramo, count_records
+from default_repo.utils.fused import run_fused
+from default_repo.utils.raw_load import pg_conn_str
+from default_repo.utils.rate_limit import MAX_CONCURRENT, use_shared_backend
+from default_repo.utils.tramo_queue import run_worker, LEASE_SECS
+from default_repo.utils.realms import fair_order, load_realms, run_pool
+from default_repo.utils.autotune import record_history, tramo_span, tuned_settings
+from default_repo.utils.run_metrics import record_extract
+from default_repo.utils.dry_run import is_dry_run, plan
+from default_repo.utils.telemetry import report, rows_read
+from default_repo.utils.reconcile import reconcile, repair_enabled
+from default_repo.utils.fingerprint import attach_fingerprints, save_fingerprints
+from default_repo.utils.qbo_client import QboClient
 
+# ====== Config ======
 # Filtro por defecto para Invoices:
 # - "TxnDate" (DATE) → usa sólo YYYY-MM-DD
 # - "MetaData.LastUpdatedTime" (TIMESTAMP)
 INVOICE_FILTER_FIELD = "MetaData.LastUpdatedTime"  # puedes cambiar a "TxnDate"
 
-# Parámetros de robustez (Cumple 7.2: reintentos + circuit breaker)
-MAX_ATTEMPTS_PER_REQ = 6
-BACKOFF_BASE_SECONDS = 1.5
-BACKOFF_CAP_SECONDS  = 30
+# Entidad para utils/qbo_client.QboClient: auth, reintentos + circuit breaker, límite
+# por realm, cache de respuestas y prefetch viven ahí (misma pila que qb_all_backfill)
+INVOICES = {'name': 'invoices', 'qbo_entity': 'Invoice', 'filter_field': INVOICE_FILTER_FIELD}
+
+# Sesión HTTP + tokens del bloque; se cierra al terminar transform
+_client = QboClient('invoices')
 
 # ====== Helpers ======
 def _now_utc_iso():
     return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
 
 
-def _get_access_token():
-    """
-    Usa CLIENT_ID/CLIENT_SECRET + REFRESH_TOKEN para obtener un access_token.
-    Cumple 7.2: OAuth 2.0 (se invoca por tramo).
-    """
-    client_id = get_secret_value('QBO_CLIENT_ID')
-    client_secret = get_secret_value('QBO_CLIENT_SECRET')
-    refresh_token = get_secret_value('QBO_REFRESH_TOKEN')
-
-    if not all([client_id, client_secret, refresh_token]):
-        raise Exception("Faltan secretos QBO: QBO_CLIENT_ID / QBO_CLIENT_SECRET / QBO_REFRESH_TOKEN")
-
-    basic = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
-    headers = {
-        "Authorization": f"Basic {basic}",
-        "Accept": "application/json",
-        "Content-Type": "application/x-www-form-urlencoded",
-    }
-    data = {"grant_type": "refresh_token", "refresh_token": refresh_token}
-
-    resp = requests.post(TOKEN_URL, headers=headers, data=data, timeout=30)
-
-    # Logging por fase (Cumple 7.5)
-    print(json.dumps({
-        "phase": "auth", "entity": "invoices", "ts": _now_utc_iso(),
-        "status_code": resp.status_code, "ok": resp.ok
-    }))
-
-    if resp.status_code == 400 and "invalid_grant" in (resp.text or ""):
-        raise PermissionError("invalid_grant: refresh_token inválido/expirado/rotado. Reautorizar QBO.")
+def _get_access_token(realm_id=None, force=False):
+    """Token por realm (cacheado; se renueva al expirar o ante 401)."""
+    return _client.access_token(realm_id, force)
 
-    if resp.status_code != 200:
-        raise Exception(f"Token error {resp.status_code}: {resp.text}")
 
-    return resp.json()["access_token"]
+def _qbo_count_invoices(access_token, realm_id, start_iso, end_iso, metrics=None, updated_after=None):
+    """select count(*) de la ventana, sin payloads (dry-run, reconcile, fingerprint)."""
+    return _client.count(INVOICES, access_token, realm_id, start_iso, end_iso, metrics, updated_after)
 
 
-def _qbo_time(iso_z: str) -> str:
+def _extract_tramo(t, window_ref, realm_id, payload_mode='raw', on_page=None, prefetch=1):
     """
-    Para campos TIMESTAMP (UTC) QuickBooks prefiere offset explícito +00:00.
-    Cumple 7.2: coherencia UTC para filtros temporales tipo timestamp.
+    Extrae un tramo completo con token propio (401 → renueva y reintenta una vez).
+    Devuelve (window, records); (None, []) si el tramo se omite.
+    Con on_page(window, page_records) las páginas se entregan al callback (modo fused)
+    y records queda vacío.
     """
-    return iso_z.replace('Z', '+00:00') if iso_z.endswith('Z') else iso_z
+    return _client.extract_tramo(INVOICES, t, window_ref, realm_id, payload_mode, on_page, prefetch)
 
 
-def _qbo_date(iso_z: str) -> str:
+def _run_fused(jobs, payload_mode, prefetch=1, **kwargs):
     """
-    Convierte un ISO 'YYYY-MM-DDTHH:MM:SSZ' a 'YYYY-MM-DD' para campos DATE (TxnDate).
+    mode='fused': extract + load solapados con cola acotada (utils/fused.py).
+    Las páginas se cargan a RAW mientras se siguen pidiendo; el exporter no recibe registros.
+    `jobs` = tramos por realm en orden justo (utils/realms.fair_order).
     """
-    # Se asume ISO válido; tomamos sólo los primeros 10 chars.
-    return (iso_z or "")[:10]
-
-
-def _post_with_retries(url, headers, data, label="query"):
-    """
-    POST con reintentos/backoff y circuit breaker.
-    Cumple 7.2: rate limits y 5xx con backoff exponencial + límite de intentos, y logging claro.
-    """
-    attempts = 0
-    while True:
-        attempts += 1
-        try:
-            resp = requests.post(url, headers=headers, data=data, timeout=60)
-        except Exception as e:
-            print(json.dumps({
-                "phase": "extract", "entity": "invoices", "stage": label, "ts": _now_utc_iso(),
-                "attempt": attempts, "transport_error": str(e)
-            }))
-            if attempts >= MAX_ATTEMPTS_PER_REQ:
-                raise TimeoutError(f"circuit_breaker: transporte fallido {attempts} veces")
-            time.sleep(min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS ** attempts))
-            continue
-
-        print(json.dumps({
-            "phase": "extract", "entity": "invoices", "stage": label, "ts": _now_utc_iso(),
-            "attempt": attempts, "status_code": resp.status_code
-        }))
-
-        if resp.status_code == 200:
-            return resp
-
-        if resp.status_code in (429,) or 500 <= resp.status_code < 600:
-            if attempts >= MAX_ATTEMPTS_PER_REQ:
-                raise TimeoutError(f"circuit_breaker: {resp.status_code} tras {attempts} intentos")
-            time.sleep(min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS ** attempts))
-            continue
-
-        if resp.status_code == 401:
-            raise PermissionError("401 Unauthorized (token expirado).")
-
-        raise Exception(f"QBO POST error {resp.status_code}: {resp.text}")
-
-
-def _build_invoice_sql(start_iso, end_iso, start_position, max_results):
-    """
-    Construye el SQL para Invoice según el campo de filtro elegido.
-    - Si INVOICE_FILTER_FIELD == 'TxnDate' (DATE), usa YYYY-MM-DD.
-    - Si es 'MetaData.LastUpdatedTime' (TIMESTAMP), usa ISO con +00:00.
-
-    filtros históricos por rango [start, end).
-    """
-    if INVOICE_FILTER_FIELD.lower() == "txndate":
-        start_val = _qbo_date(start_iso)
-        end_val   = _qbo_date(end_iso)
-    else:
-        # MetaData.LastUpdatedTime (timestamp)
-        start_val = _qbo_time(start_iso)
-        end_val   = _qbo_time(end_iso)
-
-    sql = (
-        "select * from Invoice "
-        f"where {INVOICE_FILTER_FIELD} >= '{start_val}' "
-        f"and   {INVOICE_FILTER_FIELD} <  '{end_val}' "
-        f"startposition {start_position} maxresults {max_results}"
+    def fetch(t, window_ref, emit):
+        window, _ = _extract_tramo(t, window_ref, t['realm_id'], payload_mode,
+                                   on_page=emit, prefetch=prefetch)
+        return window
+
+    fetch_workers = int(kwargs.get('fetch_workers') or 2)
+    windows, stats = run_fused(
+        'invoices', jobs, fetch, pg_conn_str(),
+        fetch_workers=fetch_workers,
+        load_workers=int(kwargs.get('load_workers') or 2),
+        queue_pages=int(kwargs.get('queue_pages') or 8),
     )
-    return sql
+    save_fingerprints('invoices', windows)
+    chunk = jobs[0].get('chunk') if jobs else None
+    run_id = record_extract('invoices', windows, kwargs, 'fused', chunk=chunk, loaded=True)
+    record_history('invoices', windows, kwargs, 'fused', prefetch, fetch_workers, chunk=chunk, run_id=run_id)
+    return {"windows": windows, "records": [], "spool_dir": None, "loaded": True, "pipeline": stats}
 
 
-def _qbo_query_invoices(access_token, realm_id, start_position=1, max_results=200,
-                        start_iso=None, end_iso=None):
+def _run_worker(tramos, realms, payload_mode, prefetch=1, **kwargs):
     """
-    Ejecuta /query para traer Invoice por ventana temporal.
-    filtros históricos (UTC / DATE) + paginación hasta agotar resultados.
+    mode='worker': reclama tramos de raw.tramo_queue (utils/tramo_queue.py) hasta
+    vaciar la cola, extrae y carga cada uno. Varios workers pueden repartirse una corrida.
+    El run_id sale de la variable `run_id` o de los tramos publicados por chunk_fecha.
+    Sólo se reclaman tramos de los realms configurados (hay credenciales para ellos).
     """
-    if not (start_iso and end_iso):
-        raise Exception("Faltan start_iso y end_iso para la consulta.")
-
-    sql = _build_invoice_sql(start_iso, end_iso, start_position, max_results)
-
-    url = f"{QBO_BASE}/v3/company/{realm_id}/query"   # sin minorversion
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Content-Type": "application/text",           # requerido por sandbox
-    }
-
-    resp = _post_with_retries(url, headers, sql, label="invoices.query")
-    js = resp.json()
-    qres = js.get("QueryResponse", {})
-    rows = qres.get("Invoice", []) or []
-
-    has_more = len(rows) == max_results
-    next_pos = start_position + max_results if has_more else None
-
-    # Métrica por página
-    print(json.dumps({
-        "phase": "extract", "entity": "invoices", "ts": _now_utc_iso(),
-        "startpos": start_position, "returned_rows": len(rows), "has_more": has_more
-    }))
-
-    return rows, has_more, next_pos
-
-
-def _fetch_invoices_window(access_token, realm_id, start_iso, end_iso, page_size):
-    """
-    Trae todos los Invoice en [start_iso, end_iso).
-    Devuelve:
-      - records: lista [{'id','payload','page_number'}]
-      - pages_read: número de páginas leídas
-      - rows_read: total de filas devueltas
-
-    registra páginas y filas leídas por tramo.
-    paginación completa.
-    """
-    records = []
-    pos = 1
-    page_number = 0
-    total_rows = 0
-
-    while True:
-        page_number += 1
-        try:
-            rows, has_more, next_pos = _qbo_query_invoices(
-                access_token, realm_id,
-                start_position=pos, max_results=page_size,
-                start_iso=start_iso, end_iso=end_iso,
-            )
-        except PermissionError:
-            # Devolver control al caller para renovar token
-            raise
-
-        for c in rows:
-            records.append({"id": c["Id"], "payload": c, "page_number": page_number})
-        total_rows += len(rows)
-
-        if not has_more:
-            break
-        pos = next_pos
-
-    return records, page_number, total_rows
+    # Varios workers contra los mismos realms: límite de requests compartido (Postgres)
+    use_shared_backend('worker')
+    run_id = kwargs.get('run_id') or next((t.get('run_id') for t in tramos if t.get('run_id')), None)
+
+    def fetch(t, window_ref, emit):
+        # Fingerprint del tramo reclamado (una lookup por tramo): sin cambios → skipped_unchanged
+        attach_fingerprints('invoices', INVOICE_FILTER_FIELD, [t], kwargs)
+        window, _ = _extract_tramo(t, window_ref, t['realm_id'], payload_mode,
+                                   on_page=emit, prefetch=prefetch)
+        return window, t['metrics']['status']   # 'skipped_*' completa el tramo en la cola
+
+    windows, stats = run_worker(
+        'invoices', fetch, pg_conn_str(), [r for r, _ in realms], run_id=run_id,
+        lease_secs=int(kwargs.get('lease_secs') or LEASE_SECS),
+        max_tramos=int(kwargs['max_tramos']) if kwargs.get('max_tramos') else None,
+    )
+    save_fingerprints('invoices', windows)
+    run_id = record_extract('invoices', windows, kwargs, 'worker', run_id=run_id, loaded=True)
+    record_history('invoices', windows, kwargs, 'worker', prefetch, 1, run_id=run_id)
+    return {"windows": windows, "records": [], "spool_dir": None, "loaded": True, "pipeline": stats}
 
 
 def _normalize_tramos(data, **kwargs):
@@ -278,118 +171,127 @@ def transform(data=None, *args, **kwargs):
     Cumplimientos:
       - métricas por tramo (páginas, filas, duración; inserts/updates se llenan en exporter).
       - token por tramo, manejo de 401/invalid_grant, reintentos y paginación completa.
-      - metadatos RAW por registro (ingested_at_utc, ventanas, page_number/page_size, request_payload).
+      - metadatos RAW por tramo en `windows` (ingested_at_utc, ventana, page_size, filtro);
+        cada registro sólo lleva window_ref + page_number.
       - UTC consistente y reprocesos seguros (idempotencia en exporter).
       - logging estructurado por fase.
     """
-    tramos = _normalize_tramos(data, **kwargs)
-    if not tramos:
-        print("No hay tramos")
-        return []
+    try:
+        return _transform(data, **kwargs)
+    finally:
+        _client.close()   # sesión HTTP + pool del limitador (utils/rate_limit.py)
 
 
-    realm_id = get_secret_value('QBO_REALM_ID')
-    if not realm_id:
-        raise Exception("Falta QBO_REALM_ID en Secrets.")
-
-    out = []
-
-    for t in tramos:
-        start_iso = t.get('start')
-        end_iso   = t.get('end')
-        page_size = int(t.get('page_size', 200))
-        metrics   = t.get('metrics') or {
-            'pages_read': 0, 'rows_read': 0,
-            'rows_inserted': 0, 'rows_updated': 0,
-            'duration_secs': 0.0, 'status': 'pending'
-        }
-
-        if not start_iso or not end_iso:
-            print(json.dumps({
-                "phase": "extract", "entity": "invoices", "ts": _now_utc_iso(),
-                "status": "skip", "reason": "tramo_sin_fechas",
-                "start": start_iso, "end": end_iso
-            }))
-            continue
+def _transform(data, **kwargs):
+    t_run = time.perf_counter()
+    tramos = _normalize_tramos(data, **kwargs)
 
-        # Token por tramo
-        try:
-            access_token = _get_access_token()
-        except PermissionError as e:
-            metrics['status'] = 'failed_auth'
-            print(json.dumps({
-                "phase": "auth", "entity": "invoices", "ts": _now_utc_iso(),
-                "status": "failed", "error": str(e),
-                "start": start_iso, "end": end_iso
-            }))
-            continue
+    # 'backfill' (default): extract y luego exporter; 'fused': extract+load solapados;
+    # 'worker': reclama tramos de raw.tramo_queue (no necesita tramos de entrada)
+    mode = (kwargs.get('mode') or 'backfill').lower()
+    if not tramos and mode != 'worker':
+        print("No hay tramos")
+        return {"windows": [], "records": []}
+
+    # Uno o varios realms (secret QBO_REALMS / QBO_REALM_ID o runtime var `realms`)
+    realms = load_realms(kwargs)
+
+    # 'raw' (default): payload como texto JSON listo para JSONB; 'dict': objeto anidado
+    payload_mode = (kwargs.get('payload_mode') or 'raw').lower()
+
+    # Autotuning (utils/autotune.py): prefetch_pages / fetch_workers no seteados toman la
+    # combinación con más filas/segundo en corridas anteriores con tramos de largo parecido
+    # (autotune=off lo desactiva)
+    kwargs = {**kwargs, **tuned_settings(kwargs, 'invoices', ('prefetch_pages', 'fetch_workers'), mode, realms,
+                                          span=tramo_span(tramos))}
+
+    # Páginas pedidas en paralelo dentro de cada ventana (1 = secuencial; 'auto' = hasta
+    # QBO_MAX_CONCURRENT y el AIMD de utils/rate_limit.py decide cuántas van en vuelo)
+    prefetch_pages = str(kwargs.get('prefetch_pages') or 1).lower()
+    prefetch = MAX_CONCURRENT if prefetch_pages == 'auto' else max(1, int(prefetch_pages))
+
+    # dry_run=true: sólo estima la corrida (utils/dry_run.py); count(*) por muestra de
+    # tramos si no hay historial, nunca payloads. El exporter no carga nada.
+    if is_dry_run(kwargs):
+        def count(t, realm_id):
+            return _qbo_count_invoices(_get_access_token(realm_id), realm_id, t['start'], t['end'])
+
+        workers = int(kwargs.get('fetch_workers') or (2 if mode == 'fused' else 1))
+        estimate = plan('invoices', tramos, realms, kwargs, prefetch, workers, count)
+        return {"windows": [], "records": [], "dry_run": estimate}
+
+    if mode == 'worker':
+        result = _run_worker(tramos, realms, payload_mode, prefetch, **kwargs)
+        for phase in ('extract', 'load'):   # el worker también carga
+            report(phase, "invoices", rows_read(result['windows']), time.perf_counter() - t_run)
+        return result
+
+    # Un job por (realm, tramo), intercalados por peso: el pool compartido los toma en
+    # ese orden y una compañía grande no deja sin turno a las chicas.
+    jobs = fair_order(realms, tramos)
+
+    # 'reconcile': count(*) por tramo en QBO vs RAW, sin payloads (utils/reconcile.py);
+    # con reconcile_repair=true sigue como backfill sólo con los tramos con diferencia
+    if mode == 'reconcile':
+        def count(t, realm_id):
+            try:
+                return _qbo_count_invoices(_get_access_token(realm_id), realm_id, t['start'], t['end'])
+            except PermissionError:
+                return _qbo_count_invoices(_get_access_token(realm_id, force=True), realm_id, t['start'], t['end'])
 
-        t0 = time.time()
-        print(json.dumps({
-            "phase": "extract", "entity": "invoices", "ts": _now_utc_iso(),
-            "status": "start", "start": start_iso, "end": end_iso,
-            "page_size": page_size, "filter_field": INVOICE_FILTER_FIELD
-        }))
+        jobs = reconcile('invoices', INVOICE_FILTER_FIELD, jobs, count, kwargs)
+        if not jobs or not repair_enabled(kwargs):
+            return {"windows": [], "records": [], "reconciled": True}
+    else:
+        # Re-corridas: ventanas con fingerprint guardado se chequean antes de paginar
+        attach_fingerprints('invoices', INVOICE_FILTER_FIELD, jobs, kwargs)
+
+    if mode == 'fused':
+        result = _run_fused(jobs, payload_mode, prefetch, **kwargs)
+        for phase in ('extract', 'load'):   # fused: la carga corre en este bloque
+            report(phase, "invoices", rows_read(result['windows']), time.perf_counter() - t_run)
+        return result
+
+    # 'spool' (default): un gzip por tramo y la salida del bloque es sólo el manifiesto
+    # (tamaño constante sin importar el volumen); 'memory': registros en la salida.
+    handoff = (kwargs.get('handoff') or 'spool').lower()
+    run_dir = run_spool_dir('invoices', kwargs.get('spool_dir')) if handoff == 'spool' else None
+
+    windows = []   # metadatos por tramo → raw.extract_windows
+    out = []       # registros compactos: id, payload, window_ref, page_number
+
+    def extract_job(ref, t):
+        window, records = _extract_tramo(t, ref, t['realm_id'], payload_mode, prefetch=prefetch)
+        # Con handoff='spool' los registros van a disco y sólo viaja el manifiesto.
+        if window is not None and run_dir:
+            window["spool"] = write_tramo(run_dir, ref, records)
+            records = []
+        return window, records
+
+    # fetch_workers > 1: pool compartido entre realms (default 1 = secuencial)
+    workers = int(kwargs.get('fetch_workers') or 1)
+    for window, records in run_pool(extract_job, jobs, workers):
+        if window is None:
+            continue
+        out.extend(records)
+        windows.append(window)
 
-        try:
-            # Extrae toda la ventana 
-            records, pages_read, rows_read = _fetch_invoices_window(
-                access_token, realm_id, start_iso, end_iso, page_size
-            )
-        except PermissionError:
-            # Renueva token una vez y reintenta tramo
-            access_token = _get_access_token()
-            records, pages_read, rows_read = _fetch_invoices_window(
-                access_token, realm_id, start_iso, end_iso, page_size
-            )
-
-        duration = time.time() - t0
-
-        # Actualiza métricas tramo 
-        metrics['pages_read']    = int(pages_read)
-        metrics['rows_read']     = int(rows_read)
-        metrics['duration_secs'] = round(duration, 3)
-        metrics['status']        = 'extracted'
-
-        # Marca de ingesta UTC (Cumple 7.3 / 7.4)
-        ingested_at = _now_utc_iso()
-
-        # Empaquetar registros con metadatos RAW 
-        for r in records:
-            page_number = r["page_number"]
-            out.append({
-                "id": r["id"],                      # PK de Invoice
-                "payload": r["payload"],            # JSON completo de Invoice
-                "ingested_at_utc": ingested_at,
-                "extract_window_start_utc": start_iso,
-                "extract_window_end_utc": end_iso,
-                "page_number": page_number,
-                "page_size": page_size,
-                "request_payload": {
-                    "start": start_iso,
-                    "end": end_iso,
-                    "page": page_number,
-                    "page_size": page_size,
-                    "filter_field": INVOICE_FILTER_FIELD
-                },
-                # Idempotencia: en exporter via ON CONFLICT 
-            })
-
-        # Log consolidado tramo
-        print(json.dumps({
-            "phase": "extract", "entity": "invoices", "ts": _now_utc_iso(),
-            "status": "done",
-            "start": start_iso, "end": end_iso,
-            "pages_read": metrics['pages_read'],
-            "rows_read": metrics['rows_read'],
-            "duration_secs": metrics['duration_secs']
-        }))
+    # Historial por tramo para el autotuning de próximas corridas
+    # y métricas persistidas de la corrida (raw.extract_runs/extract_tramos); el exporter las completa
+    run_id = record_extract('invoices', windows, kwargs, mode, chunk=tramos[0].get('chunk'),
+                            run_id=tramos[0].get('run_id'))
+    record_history('invoices', windows, kwargs, mode, prefetch, workers,
+                   chunk=tramos[0].get('chunk'), run_id=run_id)
 
     # Resumen tota
-    print(json.dumps({
+    print(dumps({
         "phase": "extract", "entity": "invoices", "ts": _now_utc_iso(),
         "status": "completed",
-        "tramos": len(tramos), "total_records": len(out)
+        "tramos": len(jobs), "realms": len(realms), "windows": len(windows),
+        "total_records": count_records(windows, out), "handoff": handoff
     }))
 
-    return out
+    # Latencias, reintentos y rows/s del bloque (utils/telemetry.py)
+    report('extract', "invoices", rows_read(windows), time.perf_counter() - t_run)
+
+    return {"windows": windows, "records": out, "spool_dir": run_dir}
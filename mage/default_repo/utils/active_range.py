@@ -0,0 +1,192 @@
+"""
+Rango activo: recorta [fecha_inicio, fecha_fin) a donde la entidad tiene datos.
+
+Con rangos amplios (fecha_inicio=2000-01-01 porque nadie sabe cuándo empieza la
+compañía) cada tramo vacío antes del primer registro cuesta igual un request.
+chunk_fecha_* sondea QBO antes de armar los tramos, dos queries por entidad y realm:
+
+    select * from <QboEntity> where <rango> orderby <filter_field> asc  maxresults 1
+    select * from <QboEntity> where <rango> orderby <filter_field> desc maxresults 1
+
+El rango activo es [día del primer registro, día siguiente al último), unión de
+todas las entidades y realms de la corrida. Con `step` (el paso del chunk de
+chunk_fecha_*) se ensancha a la grilla de tramos que arma el rango pedido: el
+inicio baja al límite de tramo anterior y el fin sube al siguiente. Así los
+tramos recortados son los mismos (mismas ventanas) que sin recorte y los
+fingerprints y claves de reconcile no cambian de una corrida a otra. Nunca se
+amplía más allá del rango pedido. Sin registros el rango queda vacío (no hay tramos).
+
+Si QBO rechaza el ORDERBY (algunos sandboxes) se cae a búsqueda binaria por
+días con `select count(*)` (~2·log2(días) requests por entidad y realm). Si
+eso también falla se usa el rango pedido: el recorte es sólo una optimización.
+Con dry_run=true se usa directamente la búsqueda por count(*): el plan no baja
+payloads.
+
+Runtime var `active_range`: 'on' (default) | 'off'.
+"""
+import math
+from datetime import datetime, timedelta, timezone
+
+from default_repo.utils.qbo_json import dumps
+from default_repo.utils.qbo_client import QboClient, entity_where
+from default_repo.utils.dry_run import is_dry_run
+from default_repo.utils.realms import load_realms
+
+
+def _now_utc_iso():
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def _iso(dt):
+    return dt.isoformat().replace('+00:00', 'Z')
+
+
+def _field_value(record, field):
+    """'MetaData.LastUpdatedTime' → record['MetaData']['LastUpdatedTime']."""
+    for part in field.split('.'):
+        record = (record or {}).get(part)
+    return record
+
+
+def _day(value, field):
+    """Medianoche UTC del día del valor (TIMESTAMP con offset o DATE)."""
+    if field.lower() != 'txndate':
+        value = datetime.fromisoformat(value.replace('Z', '+00:00')).astimezone(timezone.utc).isoformat()
+    return datetime.fromisoformat(value[:10]).replace(tzinfo=timezone.utc)
+
+
+def enabled(kwargs):
+    return str(kwargs.get('active_range') or 'on').lower() not in ('off', 'false', '0', 'no')
+
+
+def probe(client, cfg, realm_id, start_iso, end_iso):
+    """Días (UTC) del primer y último registro en [start, end) para el realm; None si no hay registros."""
+    field, qbo_entity = cfg['filter_field'], cfg['qbo_entity']
+    token = client.access_token(realm_id)
+    where = entity_where(cfg, start_iso, end_iso)
+    bounds = []
+    for order in ('asc', 'desc'):
+        sql = f"select * from {qbo_entity} {where}orderby {field} {order} maxresults 1"
+        rows = client.query(cfg, token, realm_id, sql, f"probe_{order}").get(qbo_entity) or []
+        if not rows:
+            return None
+        bounds.append(_day(_field_value(rows[0], field), field))
+    return bounds[0], bounds[1]
+
+
+def _count(client, cfg, access_token, realm_id, start, end):
+    sql = f"select count(*) from {cfg['qbo_entity']} " + entity_where(cfg, _iso(start), _iso(end)).rstrip()
+    return int(client.query(cfg, access_token, realm_id, sql, "probe_count").get("totalCount", 0))
+
+
+def bisect(client, cfg, realm_id, start, end):
+    """
+    Como `probe` pero sin ORDERBY: búsqueda binaria por días con count(*).
+    Devuelve el inicio del día (contado desde start) del primer y último registro.
+    """
+    token = client.access_token(realm_id)
+    day = timedelta(days=1)
+    days = math.ceil((end - start) / day)
+
+    def at(k):
+        return min(end, start + k * day)
+
+    if not _count(client, cfg, token, realm_id, start, end):
+        return None
+
+    lo, hi = 1, days            # menor k con registros en [start, at(k))
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _count(client, cfg, token, realm_id, start, at(mid)):
+            hi = mid
+        else:
+            lo = mid + 1
+    first = at(lo - 1)
+
+    lo, hi = 0, days - 1        # mayor k con registros en [at(k), end)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if _count(client, cfg, token, realm_id, at(mid), end):
+            lo = mid
+        else:
+            hi = mid - 1
+    return first, at(lo)
+
+
+def align(start, end, first, last, step):
+    """
+    [first, last) ensanchado a la grilla start, step(start), step(step(start)), ...
+    (los límites de tramo de chunk_fecha_* para [start, end)), sin pasar de end.
+    """
+    lo = start
+    while step(lo) <= first:
+        lo = step(lo)
+    hi = lo
+    while hi < last and hi < end:
+        hi = step(hi)
+    return lo, min(end, hi)
+
+
+def clamp_range(kwargs, label, entities, start, end, step=None):
+    """
+    [start, end) (datetimes UTC) recortado al rango con datos de `entities`.
+    step: siguiente límite de tramo (cursor → datetime) para alinear al chunk;
+    None = alineado a días.
+    Devuelve (start, end); start >= end = no hay registros en el rango pedido.
+    """
+    if not enabled(kwargs):
+        return start, end
+
+    dry_run = is_dry_run(kwargs)
+    realms = load_realms(kwargs)
+    client = QboClient()
+    first = last = None
+    try:
+        for cfg in entities:
+            for realm_id, _ in realms:
+                if dry_run:
+                    # Sin payloads en el plan: sólo count(*)
+                    found = bisect(client, cfg, realm_id, start, end)
+                else:
+                    try:
+                        found = probe(client, cfg, realm_id, _iso(start), _iso(end))
+                    except PermissionError:
+                        raise
+                    except Exception as e:
+                        print(dumps({
+                            "phase": "chunk", "entity": label, "ts": _now_utc_iso(),
+                            "stage": "active_range", "status": "orderby_failed", "realm_id": realm_id,
+                            "fallback": "count_bisect", "error": str(e)
+                        }))
+                        found = bisect(client, cfg, realm_id, start, end)
+                if found is None:
+                    continue
+                lo, hi = found[0], found[1] + timedelta(days=1)
+                first = lo if first is None else min(first, lo)
+                last = hi if last is None else max(last, hi)
+    except PermissionError:
+        raise
+    except Exception as e:
+        print(dumps({
+            "phase": "chunk", "entity": label, "ts": _now_utc_iso(),
+            "stage": "active_range", "status": "failed", "error": str(e)
+        }))
+        return start, end
+    finally:
+        client.close()
+
+    if first is None:
+        new_start, new_end = end, end
+    elif step is None:
+        new_start, new_end = max(start, first), min(end, last)
+    else:
+        new_start, new_end = align(start, end, max(start, first), min(end, last), step)
+
+    print(dumps({
+        "phase": "chunk", "entity": label, "ts": _now_utc_iso(),
+        "stage": "active_range", "status": "empty" if new_start >= new_end else "trimmed",
+        "method": "count_bisect" if dry_run else "probe",
+        "requested": [_iso(start), _iso(end)], "active": [_iso(new_start), _iso(new_end)],
+        "entities": [cfg['name'] for cfg in entities], "realms": len(realms)
+    }))
+    return new_start, new_end
@@ -0,0 +1,233 @@
+"""
+Autotuning histórico de chunk / page_size / concurrencia.
+
+Cada extractor registra al final de la corrida una fila por tramo en
+raw.tramo_history (docker/schema/008_tramo_history.sql): ventana, parámetros
+usados (chunk, page_size, prefetch, fetch_workers, mode), concurrencia AIMD al
+cerrar el tramo, páginas, filas, reintentos y duración.
+
+`recommend` agrupa el historial por corrida (run_id) y calcula el throughput
+real de cada corrida: filas / (fin del último tramo - inicio del primero), así
+el paralelismo entre tramos cuenta. Gana la combinación de parámetros con más
+filas/segundo para el mismo pipeline (entidad, o 'all' con el mismo set de
+entidades), realms, modo y tamaño en los últimos QBO_AUTOTUNE_LOOKBACK_DAYS días
+(default 90), entre corridas de al menos QBO_AUTOTUNE_MIN_TRAMOS tramos (default 3).
+
+Tamaño (`span`): un backfill de un día y uno de años no comparten recomendación.
+chunk_fecha_* compara el rango pedido ('range': primer inicio → último fin de la
+corrida) y los extractores el largo de sus tramos ('tramo'); ambos se agrupan en
+SPAN_BUCKETS (day | week | month | quarter | year | multi_year).
+
+Runtime var `autotune`:
+  - 'on' (default): las variables no seteadas toman el valor recomendado,
+  - 'recommend': sólo loguea la recomendación,
+  - 'off': ni consulta ni registra historial.
+Las variables pasadas explícitamente siempre ganan. Sin historial (o sin base)
+se usan los defaults de siempre.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+
+import psycopg
+
+from default_repo.utils.qbo_json import dumps
+from default_repo.utils.raw_load import pg_conn_str
+from default_repo.utils.realms import load_realms
+from default_repo.utils.tramo_queue import new_run_id
+
+LOOKBACK_DAYS = int(os.environ.get('QBO_AUTOTUNE_LOOKBACK_DAYS') or 90)
+MIN_TRAMOS = int(os.environ.get('QBO_AUTOTUNE_MIN_TRAMOS') or 3)
+
+# (nombre, tope en días); el último no tiene tope
+SPAN_BUCKETS = (
+    ('day', 1.5), ('week', 8), ('month', 32), ('quarter', 93), ('year', 367),
+    ('multi_year', None),
+)
+
+HISTORY_SQL = """
+INSERT INTO raw.tramo_history (
+    run_id, pipeline, entity, realm_id, mode, window_start_utc, window_end_utc,
+    chunk, page_size, prefetch, fetch_workers, concurrency,
+    pages_read, rows_read, retries, duration_secs,
+    started_at_utc, finished_at_utc, status
+)
+VALUES (
+    %(run_id)s, %(pipeline)s, %(entity)s, %(realm_id)s, %(mode)s, %(start)s, %(end)s,
+    %(chunk)s, %(page_size)s, %(prefetch)s, %(fetch_workers)s, %(concurrency)s,
+    %(pages_read)s, %(rows_read)s, %(retries)s, %(duration_secs)s,
+    %(started_at_utc)s, %(finished_at_utc)s, %(status)s
+);
+"""
+
+# Throughput por corrida (wall clock) y luego promedio ponderado por configuración.
+# pipeline NULL = filas anteriores a la columna (pipeline por entidad).
+# Sólo corridas del mismo bucket de tamaño (span_kind NULL = sin filtro).
+RECOMMEND_SQL = """
+WITH runs AS (
+    SELECT run_id, chunk, page_size, prefetch, fetch_workers,
+           count(*) AS tramos,
+           sum(rows_read) AS rows_read,
+           sum(retries) AS retries,
+           extract(epoch FROM max(finished_at_utc) - min(started_at_utc)) AS wall_secs,
+           avg(extract(epoch FROM window_end_utc - window_start_utc)) AS tramo_secs,
+           extract(epoch FROM max(window_end_utc) - min(window_start_utc)) AS range_secs
+    FROM raw.tramo_history
+    WHERE COALESCE(pipeline, entity) = %(pipeline)s
+      AND entity = ANY(%(entities)s)
+      AND realm_id = ANY(%(realms)s)
+      AND mode = %(mode)s
+      AND status NOT LIKE 'failed%%'
+      AND recorded_at_utc >= now() - make_interval(days => %(days)s)
+    GROUP BY run_id, chunk, page_size, prefetch, fetch_workers
+    HAVING count(*) >= %(min_tramos)s AND sum(rows_read) > 0
+       AND count(DISTINCT entity) = cardinality(%(entities)s)
+)
+SELECT chunk, page_size, prefetch, fetch_workers,
+       sum(rows_read) / sum(wall_secs) AS rows_per_sec,
+       count(*) AS runs, sum(tramos) AS tramos, sum(retries) AS retries
+FROM runs
+WHERE wall_secs > 0
+  AND (%(span_kind)s::text IS NULL
+       OR (CASE WHEN %(span_kind)s::text = 'range' THEN range_secs ELSE tramo_secs END) > %(span_lo)s
+          AND (CASE WHEN %(span_kind)s::text = 'range' THEN range_secs ELSE tramo_secs END) <= %(span_hi)s)
+GROUP BY chunk, page_size, prefetch, fetch_workers
+ORDER BY rows_per_sec DESC
+LIMIT 1;
+"""
+
+def _now_utc_iso():
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def _parse_iso(iso_z):
+    return datetime.fromisoformat(iso_z.replace('Z', '+00:00'))
+
+
+def autotune_mode(kwargs):
+    return str(kwargs.get('autotune') or 'on').lower()
+
+
+def span_bucket(secs):
+    """(nombre, desde, hasta] en segundos del bucket de tamaño de `secs`."""
+    lo = 0.0
+    for name, days in SPAN_BUCKETS:
+        hi = float('inf') if days is None else days * 86400.0
+        if secs <= hi:
+            return name, lo, hi
+        lo = hi
+    return SPAN_BUCKETS[-1][0], lo, float('inf')
+
+
+def range_span(start, end):
+    """span de chunk_fecha_*: el rango pedido [start, end) (datetimes)."""
+    return ('range', (end - start).total_seconds())
+
+
+def tramo_span(tramos):
+    """span de los extractores: mediana del largo de los tramos; None sin tramos con fechas."""
+    secs = sorted(
+        (_parse_iso(t['end']) - _parse_iso(t['start'])).total_seconds()
+        for t in tramos or [] if t.get('start') and t.get('end')
+    )
+    return ('tramo', secs[len(secs) // 2]) if secs else None
+
+
+def recommend(entity, realms, mode='backfill', span=None, entities=None, conn_str=None):
+    """
+    Mejor configuración histórica {chunk, page_size, prefetch_pages, fetch_workers, ...} o None.
+    entity: pipeline ('invoices', ... o 'all'); entities: las del pipeline combinado.
+    span: ('range' | 'tramo', segundos) → sólo corridas del mismo bucket de tamaño.
+    """
+    kind, lo, hi = None, 0.0, 0.0
+    if span:
+        kind = span[0]
+        _, lo, hi = span_bucket(span[1])
+    with psycopg.connect(conn_str or pg_conn_str()) as conn:
+        row = conn.execute(RECOMMEND_SQL, {
+            "pipeline": entity, "entities": list(entities or [entity]),
+            "realms": [r for r, _ in realms], "mode": mode,
+            "days": LOOKBACK_DAYS, "min_tramos": MIN_TRAMOS,
+            "span_kind": kind, "span_lo": lo, "span_hi": hi,
+        }).fetchone()
+    if row is None:
+        return None
+    chunk, page_size, prefetch, fetch_workers, rows_per_sec, runs, tramos, retries = row
+    return {
+        "chunk": chunk, "page_size": page_size,
+        "prefetch_pages": prefetch, "fetch_workers": fetch_workers,
+        "rows_per_sec": round(float(rows_per_sec), 1), "runs": runs,
+        "tramos": int(tramos), "retries": int(retries or 0),
+    }
+
+
+def tuned_settings(kwargs, entity, keys, mode='backfill', realms=None, span=None, entities=None):
+    """
+    Valores recomendados para las variables de `keys` que la corrida no trae.
+    Devuelve sólo lo que se debe aplicar ({} con autotune=off/recommend, sin
+    historial o si todas las variables vienen seteadas). Nunca falla la corrida.
+    span / entities: ver `recommend` (range_span / tramo_span).
+    """
+    at = autotune_mode(kwargs)
+    missing = [k for k in keys if not kwargs.get(k)]
+    if at == 'off' or not missing:
+        return {}
+
+    try:
+        rec = recommend(entity, realms or load_realms(kwargs), mode, span, entities)
+    except psycopg.Error as e:
+        print(dumps({
+            "phase": "autotune", "entity": entity, "ts": _now_utc_iso(),
+            "status": "unavailable", "error": str(e)
+        }))
+        return {}
+
+    applied = {k: rec[k] for k in missing if rec and rec.get(k)} if at == 'on' else {}
+    print(dumps({
+        "phase": "autotune", "entity": entity, "ts": _now_utc_iso(),
+        "status": "no_history" if rec is None else ("applied" if applied else "recommended"),
+        "mode": mode, "span": span and f"{span[0]}:{span_bucket(span[1])[0]}",
+        "recommendation": rec, "applied": applied
+    }))
+    return applied
+
+
+def record_history(entity, windows, kwargs, mode, prefetch, fetch_workers, chunk=None, run_id=None,
+                   conn_str=None):
+    """
+    Guarda una fila por ventana en raw.tramo_history con los parámetros de la corrida.
+    `entity` es el pipeline ('all' en el combinado; cada fila lleva la entidad de su ventana).
+    Un error de base se loguea y no interrumpe el pipeline.
+    """
+    if autotune_mode(kwargs) == 'off' or not windows:
+        return 0
+
+    run_id = run_id or new_run_id(entity)
+    rows = []
+    for w in windows:
+        m = w.get("metrics") or {}
+        started = _parse_iso(w["ingested_at_utc"])
+        duration = float(m.get('duration_secs') or 0.0)
+        rows.append({
+            "run_id": run_id, "pipeline": entity, "entity": w.get("entity", entity),
+            "realm_id": w["realm_id"], "mode": mode,
+            "start": w["start"], "end": w["end"],
+            "chunk": chunk, "page_size": w["page_size"],
+            "prefetch": prefetch, "fetch_workers": fetch_workers,
+            "concurrency": m.get('concurrency'),
+            "pages_read": int(m.get('pages_read') or 0), "rows_read": int(m.get('rows_read') or 0),
+            "retries": int(m.get('retries') or 0), "duration_secs": duration,
+            "started_at_utc": started, "finished_at_utc": started + timedelta(seconds=duration),
+            "status": m.get('status'),
+        })
+
+    try:
+        with psycopg.connect(conn_str or pg_conn_str()) as conn:
+            with conn.cursor() as cur:
+                cur.executemany(HISTORY_SQL, rows)
+    except psycopg.Error as e:
+        print(dumps({
+            "phase": "autotune", "entity": entity, "ts": _now_utc_iso(),
+            "status": "history_failed", "error": str(e)
+        }))
+        return 0
+    return len(rows)
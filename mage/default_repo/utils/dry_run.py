@@ -0,0 +1,206 @@
+"""
+Dry-run: estima una corrida antes de lanzarla, sin pedir payloads a QBO.
+
+    dry_run=true  (chunk_fecha_* y extract_qbo_*; combinable con cualquier `mode`)
+
+Para cada job (tramo × realm) estima filas, requests, duración y memoria pico:
+
+- Filas por tramo (`dry_run_counts`):
+    'auto' (default): densidad histórica (filas por segundo de ventana en
+            raw.tramo_history); sin historial, muestreo de count(*) si el bloque
+            puede consultar QBO,
+    'sample': `select count(*)` sobre `dry_run_sample` jobs (default 20) repartidos
+            en el rango; la densidad de la muestra se extrapola al resto,
+    'all':  count(*) de cada job (exacto; cuesta un request por job),
+    'none': sin estimación de filas (una página por job).
+- Requests: páginas = filas // page_size + 1 (la última página corta cierra la
+  ventana), + 1 count por job con prefetch > 1, + refresh de token por realm cada
+  ~55 min (utils/realms.token_cache).
+- Duración: la mayor de
+    * tasa: requests por realm / (QBO_RATE_PER_MIN / 60) (los realms van en paralelo),
+    * concurrencia: requests × latencia / requests en vuelo
+      (min(fetch_workers × prefetch, QBO_MAX_CONCURRENT × realms)).
+  La latencia por página sale del historial (tramos secuenciales) o de
+  QBO_DRY_RUN_LATENCY_SECS (default 1.0).
+- Memoria pico (adicional al proceso): páginas decodificadas en vuelo + buffer
+  del handoff (tramo más grande por worker con spool; todo con handoff=memory;
+  `queue_pages` con mode=fused). Bytes por fila: muestra de RAW o
+  QBO_DRY_RUN_ROW_BYTES (default 1500).
+"""
+import math
+import os
+from datetime import datetime, timezone
+
+import psycopg
+
+from default_repo.utils.qbo_json import dumps
+from default_repo.utils.raw_load import pg_conn_str
+from default_repo.utils.rate_limit import RATE_PER_MIN, MAX_CONCURRENT
+
+DEFAULT_LATENCY_SECS = float(os.environ.get('QBO_DRY_RUN_LATENCY_SECS') or 1.0)
+DEFAULT_ROW_BYTES = int(os.environ.get('QBO_DRY_RUN_ROW_BYTES') or 1500)
+LOOKBACK_DAYS = int(os.environ.get('QBO_AUTOTUNE_LOOKBACK_DAYS') or 90)
+TOKEN_TTL_SECS = 3300     # 3600 - margen de renovación de utils/realms.py
+DICT_FACTOR = 6           # página decodificada (dicts anidados) vs texto JSON
+RECORD_OVERHEAD = 150     # dict del registro compacto + id + page_number
+
+HISTORY_SQL = """
+SELECT
+    sum(rows_read)::float
+      / nullif(sum(extract(epoch FROM window_end_utc - window_start_utc)), 0) AS rows_per_window_sec,
+    sum(duration_secs) FILTER (WHERE prefetch = 1)
+      / nullif(sum(pages_read) FILTER (WHERE prefetch = 1), 0) AS secs_per_page
+FROM raw.tramo_history
+WHERE entity = %(entity)s
+  AND realm_id = ANY(%(realms)s)
+  AND status NOT LIKE 'failed%%'
+  AND recorded_at_utc >= now() - make_interval(days => %(days)s);
+"""
+
+
+def _now_utc_iso():
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def _window_secs(t):
+    start = datetime.fromisoformat(t['start'].replace('Z', '+00:00'))
+    end = datetime.fromisoformat(t['end'].replace('Z', '+00:00'))
+    return max(0.0, (end - start).total_seconds())
+
+
+def is_dry_run(kwargs):
+    return str(kwargs.get('dry_run') or '').lower() in ('1', 'true', 'yes')
+
+
+def run_params(kwargs):
+    """(prefetch, fetch_workers) con los mismos defaults que los extractores."""
+    prefetch_pages = str(kwargs.get('prefetch_pages') or 1).lower()
+    prefetch = MAX_CONCURRENT if prefetch_pages == 'auto' else max(1, int(prefetch_pages))
+    mode = (kwargs.get('mode') or 'backfill').lower()
+    return prefetch, int(kwargs.get('fetch_workers') or (2 if mode == 'fused' else 1))
+
+
+def _history(entity, realms):
+    """(filas por segundo de ventana, segundos por página, bytes por fila); None donde no hay datos."""
+    density = secs_per_page = row_bytes = None
+    try:
+        with psycopg.connect(pg_conn_str(), autocommit=True) as conn:
+            density, secs_per_page = conn.execute(HISTORY_SQL, {
+                "entity": entity, "realms": [r for r, _ in realms], "days": LOOKBACK_DAYS,
+            }).fetchone()
+            try:
+                row_bytes = conn.execute(
+                    f"SELECT avg(octet_length(payload::text)) FROM (SELECT payload FROM raw.qb_{entity} LIMIT 500) s"
+                ).fetchone()[0]
+            except psycopg.errors.UndefinedTable:
+                pass
+    except psycopg.Error:
+        pass
+    return density, secs_per_page, row_bytes
+
+
+def _sample(jobs, n):
+    """n jobs repartidos uniformemente en el rango (primero y último incluidos)."""
+    if n >= len(jobs):
+        return list(range(len(jobs)))
+    step = (len(jobs) - 1) / max(1, n - 1)
+    return sorted({round(i * step) for i in range(n)})
+
+
+def plan(entity, tramos, realms, kwargs, prefetch=1, fetch_workers=1, count_fn=None):
+    """
+    Estima la corrida y la loguea (phase: dry_run). Devuelve el plan como dict.
+    count_fn(t, realm_id) -> int hace un `select count(*)` de la ventana (None = sin QBO).
+    """
+    mode = (kwargs.get('mode') or 'backfill').lower()
+    handoff = (kwargs.get('handoff') or 'spool').lower()
+    counts_mode = (kwargs.get('dry_run_counts') or 'auto').lower()
+    jobs = [(realm, t) for t in tramos for realm, _ in realms]
+
+    density, secs_per_page, row_bytes = _history(entity, realms)
+    latency = float(secs_per_page or DEFAULT_LATENCY_SECS)
+    row_bytes = float(row_bytes or DEFAULT_ROW_BYTES)
+
+    # ---- Filas por job ----
+    rows = [None] * len(jobs)
+    count_calls = 0
+    source = 'none'
+    if counts_mode == 'auto' and density is not None:
+        source = 'history'
+    elif counts_mode in ('auto', 'sample', 'all') and count_fn is not None and jobs:
+        picked = range(len(jobs)) if counts_mode == 'all' else _sample(jobs, int(kwargs.get('dry_run_sample') or 20))
+        counted_rows, counted_secs = 0, 0.0
+        for i in picked:
+            realm, t = jobs[i]
+            try:
+                rows[i] = int(count_fn(t, realm))
+            except Exception as e:
+                print(dumps({
+                    "phase": "dry_run", "entity": entity, "ts": _now_utc_iso(),
+                    "stage": "count", "status": "failed", "realm_id": realm, "error": str(e)
+                }))
+                continue
+            count_calls += 1
+            counted_rows += rows[i]
+            counted_secs += _window_secs(t)
+        if count_calls:
+            source = 'count' if counts_mode == 'all' else 'count_sample'
+            density = counted_rows / counted_secs if counted_secs else 0.0
+
+    for i, (_, t) in enumerate(jobs):
+        if rows[i] is None:
+            rows[i] = density * _window_secs(t) if density is not None and source != 'none' else 0.0
+
+    # ---- Requests ----
+    query_calls = 0
+    max_tramo_rows = 0.0
+    for (_, t), r in zip(jobs, rows):
+        page_size = int(t.get('page_size') or 200)
+        query_calls += int(r // page_size) + 1
+        max_tramo_rows = max(max_tramo_rows, r)
+    prefetch_counts = len(jobs) if prefetch > 1 else 0
+    api_calls = query_calls + prefetch_counts
+
+    # ---- Duración ----
+    n_realms = max(1, len(realms))
+    rate_bound = (api_calls / n_realms) / (RATE_PER_MIN / 60.0)
+    in_flight = max(1, min(fetch_workers * prefetch, MAX_CONCURRENT * n_realms))
+    concurrency_bound = api_calls * latency / in_flight
+    predicted = max(rate_bound, concurrency_bound)
+    token_calls = n_realms * max(1, math.ceil(predicted / TOKEN_TTL_SECS)) if jobs else 0
+
+    # ---- Memoria pico ----
+    page_size = int(tramos[0].get('page_size') or 200) if tramos else 200
+    total_rows = sum(rows)
+    pages_mem = fetch_workers * prefetch * page_size * row_bytes * DICT_FACTOR
+    if mode == 'fused':
+        buffer_mem = int(kwargs.get('queue_pages') or 8) * page_size * (row_bytes + RECORD_OVERHEAD)
+    elif handoff == 'memory':
+        buffer_mem = total_rows * (row_bytes + RECORD_OVERHEAD)
+    else:
+        buffer_mem = fetch_workers * max_tramo_rows * (row_bytes + RECORD_OVERHEAD)
+    peak_mb = (pages_mem + buffer_mem) / (1024 * 1024)
+
+    result = {
+        "tramos": len(tramos), "realms": len(realms), "jobs": len(jobs),
+        "rows_estimated": int(round(total_rows)), "rows_source": source,
+        "api_calls": {
+            "token": token_calls, "count": prefetch_counts, "query": query_calls,
+            "total": token_calls + api_calls,
+        },
+        "dry_run_count_calls": count_calls,
+        "predicted_secs": round(predicted, 1),
+        "bound": "rate" if rate_bound >= concurrency_bound else "concurrency",
+        "peak_memory_mb": round(peak_mb, 1),
+        "assumptions": {
+            "mode": mode, "handoff": handoff, "prefetch": prefetch, "fetch_workers": fetch_workers,
+            "rate_per_min": RATE_PER_MIN, "max_concurrent": MAX_CONCURRENT,
+            "latency_secs": round(latency, 3), "row_bytes": int(row_bytes),
+        },
+    }
+    print(dumps({"phase": "dry_run", "entity": entity, "ts": _now_utc_iso(), **result}))
+    hours, rem = divmod(int(predicted), 3600)
+    print(f"[dry_run {entity}] tramos={len(tramos)} jobs={len(jobs)} filas≈{result['rows_estimated']} "
+          f"({source}) | requests≈{result['api_calls']['total']} | duración≈{hours}h{rem // 60:02d}m{rem % 60:02d}s "
+          f"(límite: {result['bound']}) | memoria pico≈{result['peak_memory_mb']} MB")
+    return result
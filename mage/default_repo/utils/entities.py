@@ -0,0 +1,78 @@
+"""
+Registro de entidades QBO para el extractor/exporter genéricos (qb_all_backfill).
+
+La configuración vive en default_repo/qbo_entities.yaml (o env QBO_ENTITIES_FILE):
+nombre → qbo_entity, filter_field, watermark_column, enabled. Los nombres y campos
+se interpolan en SQL (QBO y Postgres), por eso se validan al cargar.
+
+La runtime var `entities` ('invoices,payments') elige qué entidades corren;
+sin ella corren todas las habilitadas.
+"""
+import os
+import re
+from functools import lru_cache
+
+import yaml
+
+DEFAULT_ENTITIES_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'qbo_entities.yaml')
+
+DEFAULTS = {
+    'filter_field': 'MetaData.LastUpdatedTime',
+    'watermark_column': 'last_updated_time',
+    'enabled': True,
+}
+
+_NAME_RE = re.compile(r'^[a-z][a-z0-9_]*$')
+_QBO_ENTITY_RE = re.compile(r'^[A-Za-z]+$')
+_FIELD_RE = re.compile(r'^[A-Za-z][A-Za-z.]*$')
+
+# Tabla nueva = misma estructura que las existentes: PK (realm_id, id), columnas
+# generadas create_time / last_updated_time / sync_token e índices.
+ENSURE_TABLE_SQL = "CREATE TABLE IF NOT EXISTS raw.qb_{name} (LIKE raw.qb_items INCLUDING ALL)"
+
+
+def _validate(name, cfg):
+    checks = (
+        (_NAME_RE, name, 'nombre'),
+        (_QBO_ENTITY_RE, cfg.get('qbo_entity') or '', 'qbo_entity'),
+        (_FIELD_RE, cfg['filter_field'], 'filter_field'),
+        (_NAME_RE, cfg['watermark_column'], 'watermark_column'),
+    )
+    for regex, value, what in checks:
+        if not regex.match(str(value)):
+            raise ValueError(f"qbo_entities: {what} inválido para '{name}': {value!r}")
+
+
+@lru_cache(maxsize=None)
+def load_entities(path=None):
+    """{nombre: cfg} desde el YAML; cfg incluye 'name' y los defaults."""
+    path = path or os.environ.get('QBO_ENTITIES_FILE') or DEFAULT_ENTITIES_FILE
+    with open(path, encoding='utf-8') as fh:
+        raw = yaml.safe_load(fh) or {}
+
+    entities = {}
+    for name, cfg in raw.items():
+        cfg = {**DEFAULTS, **(cfg or {}), 'name': name}
+        _validate(name, cfg)
+        entities[name] = cfg
+    return entities
+
+
+def select_entities(kwargs):
+    """Entidades de la corrida: runtime var `entities` o todas las habilitadas (orden del YAML)."""
+    entities = load_entities()
+    spec = kwargs.get('entities')
+    if not spec:
+        return [cfg for cfg in entities.values() if cfg['enabled']]
+
+    names = [n.strip() for n in str(spec).split(',') if n.strip()]
+    unknown = [n for n in names if n not in entities]
+    if unknown:
+        raise Exception(f"Entidades no configuradas en qbo_entities.yaml: {', '.join(unknown)}")
+    return [entities[n] for n in names]
+
+
+def ensure_tables(cur, entities):
+    """Crea raw.qb_<nombre> para las entidades que aún no tienen tabla."""
+    for cfg in entities:
+        cur.execute(ENSURE_TABLE_SQL.format(name=cfg['name']))
@@ -0,0 +1,156 @@
+"""
+Fingerprint por ventana: re-correr un rango no vuelve a paginar ventanas sin cambios.
+
+Al cargar, cada ventana guarda en raw.window_fingerprints (docker/schema/011_window_fingerprints.sql)
+su fingerprint tal como quedó en RAW: filas de la ventana y max(last_updated_time),
+con consultas sobre las columnas generadas indexadas (sin leer payload).
+
+En la siguiente corrida, antes de paginar una ventana con fingerprint, se le
+pregunta a QBO sólo conteos:
+  1. `select count(*)` de la ventana: debe ser igual a las filas guardadas,
+  2. `select count(*)` de la ventana con MetaData.LastUpdatedTime > max guardado:
+     debe ser 0 (nada creado ni modificado desde la carga).
+Ventanas por LastUpdatedTime ya cerradas al extraerse (fin <= extracción) sólo
+pueden perder filas, así que alcanza con (1). Si coincide, el tramo se omite
+(status 'skipped_unchanged'); si algo falla o difiere, se extrae como siempre.
+
+Runtime var `skip_unchanged`: 'on' (default) | 'off'.
+Registros borrados en QBO que siguen en RAW hacen que la ventana nunca coincida:
+se re-extrae (seguro); mode=reconcile muestra esas diferencias.
+"""
+from datetime import datetime, timezone
+
+import psycopg
+
+from default_repo.utils.qbo_json import dumps
+from default_repo.utils.raw_load import pg_conn_str
+from default_repo.utils.reconcile import RAW_COLUMNS, window_filter
+
+LOOKUP_SQL = """
+SELECT realm_id, window_start_utc, window_end_utc, row_count, max_updated_utc, extracted_at_utc
+FROM raw.window_fingerprints
+WHERE entity = %(entity)s
+  AND filter_field = %(filter_field)s
+  AND realm_id = ANY(%(realms)s)
+  AND window_start_utc >= %(min_start)s
+  AND window_end_utc <= %(max_end)s;
+"""
+
+SAVE_SQL = """
+INSERT INTO raw.window_fingerprints (
+    realm_id, entity, filter_field, window_start_utc, window_end_utc,
+    row_count, max_updated_utc, extracted_at_utc
+)
+SELECT %(realm_id)s, %(entity)s, %(filter_field)s, %(start)s, %(end)s,
+       count(*), max(r.last_updated_time), %(extracted_at)s
+FROM raw.qb_{entity} r
+WHERE r.realm_id = %(realm_id)s AND {predicate}
+ON CONFLICT (realm_id, entity, filter_field, window_start_utc, window_end_utc) DO UPDATE SET
+    row_count = EXCLUDED.row_count,
+    max_updated_utc = EXCLUDED.max_updated_utc,
+    extracted_at_utc = EXCLUDED.extracted_at_utc,
+    saved_at_utc = now();
+"""
+
+
+def _now_utc_iso():
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def _parse_iso(iso_z):
+    return datetime.fromisoformat(iso_z.replace('Z', '+00:00'))
+
+
+def _iso(dt):
+    return dt.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def enabled(kwargs):
+    return str(kwargs.get('skip_unchanged') or 'on').lower() not in ('off', 'false', '0', 'no')
+
+
+def attach_fingerprints(entity, filter_field, jobs, kwargs):
+    """
+    Agrega 'fingerprint' a los jobs (tramos con 'realm_id') que ya tienen uno guardado.
+    Una sola query para toda la corrida; sin base o con skip_unchanged=off no hace nada.
+    """
+    if not enabled(kwargs) or not jobs or filter_field.lower() not in RAW_COLUMNS:
+        return jobs
+    try:
+        with psycopg.connect(pg_conn_str()) as conn:
+            rows = conn.execute(LOOKUP_SQL, {
+                "entity": entity, "filter_field": filter_field,
+                "realms": sorted({j['realm_id'] for j in jobs}),
+                "min_start": min(j['start'] for j in jobs), "max_end": max(j['end'] for j in jobs),
+            }).fetchall()
+    except psycopg.Error as e:
+        print(dumps({
+            "phase": "extract", "entity": entity, "ts": _now_utc_iso(),
+            "stage": "fingerprint", "status": "unavailable", "error": str(e)
+        }))
+        return jobs
+
+    saved = {(realm, start, end): (n, max_updated, extracted_at)
+             for realm, start, end, n, max_updated, extracted_at in rows}
+    for j in jobs:
+        end = _parse_iso(j['end'])
+        fp = saved.get((j['realm_id'], _parse_iso(j['start']), end))
+        if fp is not None:
+            n, max_updated, extracted_at = fp
+            j['fingerprint'] = {
+                "rows": n,
+                "max_updated": _iso(max_updated) if max_updated else None,
+                "closed": filter_field.lower() == 'metadata.lastupdatedtime' and end <= extracted_at,
+            }
+    return jobs
+
+
+def window_unchanged(entity, t, count_fn):
+    """
+    True si QBO confirma el fingerprint del tramo.
+    count_fn(updated_after=None) -> count(*) de la ventana (con updated_after: sólo
+    filas con LastUpdatedTime posterior). Cualquier error → False (se extrae).
+    """
+    fp = t.get('fingerprint')
+    if not fp:
+        return False
+    try:
+        if count_fn() != fp['rows']:
+            return False
+        if fp['closed'] or fp['rows'] == 0:
+            return True
+        return fp['max_updated'] is not None and count_fn(fp['max_updated']) == 0
+    except Exception as e:
+        print(dumps({
+            "phase": "extract", "entity": entity, "ts": _now_utc_iso(),
+            "stage": "fingerprint", "status": "check_failed", "realm_id": t.get('realm_id'),
+            "start": t.get('start'), "end": t.get('end'), "error": str(e)
+        }))
+        return False
+
+
+def save_fingerprints(entity, windows, conn_str=None):
+    """
+    Guarda el fingerprint de las ventanas ya cargadas (desde RAW, columnas indexadas).
+    Un error de base se loguea y no interrumpe el pipeline.
+    """
+    windows = [w for w in windows if (w.get("filter_field") or '').lower() in RAW_COLUMNS]
+    if not windows:
+        return 0
+    try:
+        with psycopg.connect(conn_str or pg_conn_str()) as conn:
+            with conn.cursor() as cur:
+                for w in windows:
+                    ent = w.get("entity", entity)
+                    predicate = window_filter(w["filter_field"], "%(start)s::timestamptz", "%(end)s::timestamptz")
+                    cur.execute(SAVE_SQL.format(entity=ent, predicate=predicate), {
+                        "realm_id": w["realm_id"], "entity": ent, "filter_field": w["filter_field"],
+                        "start": w["start"], "end": w["end"], "extracted_at": w["ingested_at_utc"],
+                    })
+    except psycopg.Error as e:
+        print(dumps({
+            "phase": "load", "entity": entity, "ts": _now_utc_iso(),
+            "stage": "fingerprint", "status": "save_failed", "error": str(e)
+        }))
+        return 0
+    return len(windows)
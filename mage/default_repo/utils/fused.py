@@ -0,0 +1,214 @@
+"""
+Modo fused: extract + load solapados dentro de un mismo bloque.
+
+    fetch workers ──(páginas)──▶ cola acotada ──▶ load workers ──▶ Postgres
+
+- Los fetch workers toman tramos y entregan cada página a la cola en cuanto llega.
+- La cola tiene tamaño máximo (`queue_pages`): si los loaders se atrasan, `put`
+  bloquea y la extracción se frena (backpressure) en vez de acumular memoria.
+- Cada load worker mantiene su propia conexión y hace COMMIT por página.
+- Métricas de utilización por etapa (profundidad de cola, tiempo ocupado/ocioso)
+  se loguean periódicamente y al final con phase="pipeline".
+
+El tiempo total tiende a max(extract, load) en lugar de extract + load.
+"""
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+import psycopg
+
+from default_repo.utils.qbo_json import dumps
+from default_repo.utils.raw_load import upsert_records, upsert_window
+
+_DONE = object()
+
+
+def _now_utc_iso():
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+class _StageStats:
+    """Acumuladores thread-safe de utilización por etapa."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fetch_busy = 0.0      # pidiendo páginas a QBO
+        self.fetch_blocked = 0.0   # esperando lugar en la cola (backpressure)
+        self.load_busy = 0.0       # escribiendo en Postgres
+        self.load_idle = 0.0       # esperando páginas
+        self.pages = 0
+        self.rows = 0
+        self.depth_sum = 0
+        self.depth_samples = 0
+        self.depth_max = 0
+
+    def add(self, **deltas):
+        with self.lock:
+            for k, v in deltas.items():
+                setattr(self, k, getattr(self, k) + v)
+
+    def sample_depth(self, depth):
+        with self.lock:
+            self.depth_sum += depth
+            self.depth_samples += 1
+            self.depth_max = max(self.depth_max, depth)
+
+    def snapshot(self, wall, queue_pages, fetch_workers, load_workers):
+        with self.lock:
+            fetch_capacity = max(wall * fetch_workers, 1e-9)
+            load_capacity = max(wall * load_workers, 1e-9)
+            return {
+                "wall_secs": round(wall, 3),
+                "fetch_workers": fetch_workers, "load_workers": load_workers,
+                "queue_pages": queue_pages,
+                "queue_depth_avg": round(self.depth_sum / self.depth_samples, 2) if self.depth_samples else 0,
+                "queue_depth_max": self.depth_max,
+                "pages": self.pages, "rows": self.rows,
+                "fetch_busy_secs": round(self.fetch_busy, 3),
+                "fetch_blocked_secs": round(self.fetch_blocked, 3),
+                "load_busy_secs": round(self.load_busy, 3),
+                "load_idle_secs": round(self.load_idle, 3),
+                "fetch_utilization": round(self.fetch_busy / fetch_capacity, 3),
+                "load_utilization": round(self.load_busy / load_capacity, 3),
+            }
+
+
+def run_fused(entity, tramos, fetch_tramo, conn_str,
+              fetch_workers=2, load_workers=2, queue_pages=8, log_every_secs=10):
+    """
+    Ejecuta extract+load solapados.
+
+    fetch_tramo(t, window_ref, emit) -> window | None
+        Extrae un tramo; por cada página llama emit(window, page_records)
+        (bloquea si la cola está llena). Devuelve el dict de ventana con métricas.
+
+    Devuelve (windows, stats). Las métricas de cada ventana se completan con
+    rows_inserted / rows_updated / rows_unchanged. Errores de cualquier worker
+    se relanzan al final, después de drenar la cola.
+    """
+    pages_q = queue.Queue(maxsize=queue_pages)
+    tramos_q = queue.Queue()
+    for ref, t in enumerate(tramos):
+        tramos_q.put((ref, t))
+
+    stats = _StageStats()
+    windows = {}
+    errors = []
+    stop = threading.Event()       # un fetch falló: no tomar más tramos
+    finished = threading.Event()   # fin del monitor
+    metrics_lock = threading.Lock()
+    local = threading.local()      # tiempo bloqueado por fetcher
+
+    def emit(window, page_records):
+        t0 = time.perf_counter()
+        pages_q.put((window, page_records))   # backpressure
+        blocked = time.perf_counter() - t0
+        local.blocked = getattr(local, 'blocked', 0.0) + blocked
+        stats.add(fetch_blocked=blocked)
+        stats.sample_depth(pages_q.qsize())
+
+    def fetcher():
+        while not stop.is_set():
+            try:
+                ref, t = tramos_q.get_nowait()
+            except queue.Empty:
+                return
+            t0 = time.perf_counter()
+            local.blocked = 0.0
+            try:
+                window = fetch_tramo(t, ref, emit)
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+                return
+            finally:
+                # tiempo ocupado = total del tramo - tiempo bloqueado en la cola
+                stats.add(fetch_busy=(time.perf_counter() - t0) - local.blocked)
+            if window is not None:
+                windows[ref] = window
+
+    def loader():
+        window_ids = {}
+        failed = False
+        conn = None
+        try:
+            conn = psycopg.connect(conn_str)
+        except Exception as e:
+            errors.append(e)
+            failed = True
+        while True:
+            t0 = time.perf_counter()
+            item = pages_q.get()
+            stats.add(load_idle=time.perf_counter() - t0)
+            if item is _DONE:
+                break
+            if failed:
+                continue   # drena la cola para no bloquear a los fetchers
+            window, page_records = item
+            t1 = time.perf_counter()
+            try:
+                ref = window["window_ref"]
+                ent = window.get("entity", entity)   # pipeline combinado: entidad por ventana
+                with conn.cursor() as cur:
+                    if ref not in window_ids:
+                        window_ids[ref] = upsert_window(cur, ent, window)
+                    counts = upsert_records(cur, ent, page_records, window_ids[ref],
+                                            window["ingested_at_utc"], window["realm_id"])
+                conn.commit()
+            except Exception as e:
+                errors.append(e)
+                failed = True
+                stop.set()
+                continue
+            stats.add(load_busy=time.perf_counter() - t1, pages=1, rows=len(page_records))
+            with metrics_lock:
+                m = window["metrics"]
+                m['rows_inserted'] = m.get('rows_inserted', 0) + counts["inserted"]
+                m['rows_updated'] = m.get('rows_updated', 0) + counts["updated"]
+                m['rows_unchanged'] = m.get('rows_unchanged', 0) + counts["unchanged"]
+        if conn is not None:
+            conn.close()
+
+    def monitor(t_start):
+        while not finished.wait(log_every_secs):
+            print(dumps({
+                "phase": "pipeline", "entity": entity, "ts": _now_utc_iso(),
+                "status": "running", "queue_depth": pages_q.qsize(),
+                **stats.snapshot(time.perf_counter() - t_start, queue_pages,
+                                 fetch_workers, load_workers)
+            }))
+
+    t_start = time.perf_counter()
+    fetchers = [threading.Thread(target=fetcher, name=f"fetch-{i}", daemon=True)
+                for i in range(fetch_workers)]
+    loaders = [threading.Thread(target=loader, name=f"load-{i}", daemon=True)
+               for i in range(load_workers)]
+    mon = threading.Thread(target=monitor, args=(t_start,), daemon=True)
+    for th in fetchers + loaders + [mon]:
+        th.start()
+
+    for th in fetchers:
+        th.join()
+    for _ in loaders:
+        pages_q.put(_DONE)
+    for th in loaders:
+        th.join()
+    finished.set()
+
+    summary = stats.snapshot(time.perf_counter() - t_start, queue_pages,
+                             fetch_workers, load_workers)
+    print(dumps({
+        "phase": "pipeline", "entity": entity, "ts": _now_utc_iso(),
+        "status": "failed" if errors else "done", **summary
+    }))
+
+    if errors:
+        raise errors[0]
+
+    ordered = [windows[ref] for ref in sorted(windows)]
+    for w in ordered:
+        if w["metrics"].get('status') == 'extracted':
+            w["metrics"]['status'] = 'loaded'
+    return ordered, summary
@@ -0,0 +1,375 @@
+"""
+Extractor QBO genérico por entidad: la única pila HTTP de los extractores.
+
+Reintentos, circuit breaker, AIMD y límite por realm, cache de respuestas,
+telemetría, prefetch y 401 → token nuevo, parametrizados por la config de la
+entidad (name, qbo_entity, filter_field; ver utils/entities.py). Lo usan el
+pipeline combinado (qb_all_backfill, un `QboClient` para todas las entidades) y
+extract_qbo_{invoices,customers,items} (un cliente por bloque con su config).
+Cada cliente tiene:
+  - una requests.Session (keep-alive, pool de conexiones HTTP),
+  - el token por realm (utils/realms.token_cache): un refresh por realm, no por entidad,
+  - el presupuesto de requests por realm (utils/rate_limit.py).
+"""
+import base64
+import os
+import time
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from default_repo.utils.qbo_json import loads, dumps
+from default_repo.utils.rate_limit import permit, penalize, observe, concurrency, MAX_CONCURRENT
+from default_repo.utils.rate_limit import close as close_limiter
+from default_repo.utils.prefetch import iter_pages
+from default_repo.utils.realms import realm_secret, token_cache
+from default_repo.utils.fingerprint import window_unchanged
+from default_repo.utils.response_cache import cached_response, replaying, store_response
+from default_repo.utils.telemetry import observe_auth, observe_request, observe_retry
+
+# QBO_TOKEN_URL / QBO_BASE_URL apuntan a otro servidor (ej. benchmarks/qbo_mock_server.py)
+TOKEN_URL = os.environ.get("QBO_TOKEN_URL") or "https://oauth.platform.intuit.com/oauth2/v1/tokens/bearer"
+QBO_BASE  = (os.environ.get("QBO_BASE_URL") or "https://sandbox-quickbooks.api.intuit.com").rstrip("/")   # sandbox
+
+MAX_ATTEMPTS_PER_REQ = 6
+BACKOFF_BASE_SECONDS = 1.5
+BACKOFF_CAP_SECONDS  = 30
+
+
+def _now_utc_iso():
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def _qbo_time(iso_z):
+    """Campos TIMESTAMP: QBO prefiere offset explícito +00:00."""
+    return iso_z.replace('Z', '+00:00') if iso_z.endswith('Z') else iso_z
+
+
+def _qbo_date(iso_z):
+    """Campos DATE (TxnDate): sólo YYYY-MM-DD."""
+    return (iso_z or "")[:10]
+
+
+def new_metrics():
+    return {
+        'pages_read': 0, 'rows_read': 0,
+        'rows_inserted': 0, 'rows_updated': 0,
+        'duration_secs': 0.0, 'status': 'pending'
+    }
+
+
+def entity_where(cfg, start_iso, end_iso):
+    """where por rango [start, end) sobre el filter_field de la entidad."""
+    field = cfg['filter_field']
+    if field.lower() == 'txndate':
+        start_val, end_val = _qbo_date(start_iso), _qbo_date(end_iso)
+    else:
+        start_val, end_val = _qbo_time(start_iso), _qbo_time(end_iso)
+    return (
+        f"where {field} >= '{start_val}' "
+        f"and   {field} <  '{end_val}' "
+    )
+
+
+class QboClient:
+    """Sesión HTTP + tokens por realm compartidos por todas las entidades."""
+
+    def __init__(self, entity='all'):
+        self.entity = entity   # etiqueta de los logs/telemetría de auth
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_CONCURRENT * 2)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def close(self):
+        """Fin de bloque: sesión HTTP y conexiones del límite compartido (utils/rate_limit.py)."""
+        self.session.close()
+        close_limiter()
+
+    # ---- Auth ----
+    def access_token(self, realm_id, force=False):
+        """access_token del realm (cacheado; force=True lo renueva ante 401)."""
+        if replaying():   # QBO_CACHE=replay: sin red
+            return "replay"
+        if not force:
+            cached = token_cache.get(realm_id)
+            if cached:
+                return cached
+
+        client_id = realm_secret('QBO_CLIENT_ID', realm_id)
+        client_secret = realm_secret('QBO_CLIENT_SECRET', realm_id)
+        refresh_token = realm_secret('QBO_REFRESH_TOKEN', realm_id)
+        if not all([client_id, client_secret, refresh_token]):
+            raise Exception("Faltan secretos QBO: QBO_CLIENT_ID / QBO_CLIENT_SECRET / QBO_REFRESH_TOKEN")
+
+        basic = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
+        headers = {
+            "Authorization": f"Basic {basic}",
+            "Accept": "application/json",
+            "Content-Type": "application/x-www-form-urlencoded",
+        }
+        data = {"grant_type": "refresh_token", "refresh_token": refresh_token}
+        t_auth = time.perf_counter()
+        resp = self.session.post(TOKEN_URL, headers=headers, data=data, timeout=30)
+        observe_auth(self.entity, resp.status_code, time.perf_counter() - t_auth)
+
+        print(dumps({
+            "phase": "auth", "entity": self.entity, "ts": _now_utc_iso(), "realm_id": realm_id,
+            "status_code": resp.status_code, "ok": resp.ok
+        }))
+
+        if resp.status_code == 400 and "invalid_grant" in (resp.text or ""):
+            raise PermissionError("invalid_grant: refresh_token inválido/expirado/rotado. Reautorizar QBO.")
+        if resp.status_code != 200:
+            raise Exception(f"Token error {resp.status_code}: {resp.text}")
+
+        js = resp.json()
+        token_cache.put(realm_id, js["access_token"], js.get("expires_in"))
+        return js["access_token"]
+
+    # ---- Requests ----
+    def post(self, url, headers, data, entity, label, realm_id, metrics=None):
+        """POST con reintentos/backoff, circuit breaker y límite/AIMD por realm."""
+        cached = cached_response(entity, url, data, realm_id, label)
+        if cached is not None:
+            return cached
+
+        attempts = 0
+        while True:
+            attempts += 1
+            if attempts > 1 and metrics is not None:
+                metrics['retries'] = metrics.get('retries', 0) + 1   # historial (utils/autotune.py)
+            t_req = time.perf_counter()
+            try:
+                with permit(realm_id):
+                    t_req = time.perf_counter()
+                    resp = self.session.post(url, headers=headers, data=data, timeout=60)
+                latency = time.perf_counter() - t_req
+            except Exception as e:
+                observe(realm_id, None)
+                observe_request(entity, label, 'error', time.perf_counter() - t_req)
+                print(dumps({
+                    "phase": "extract", "entity": entity, "stage": label, "ts": _now_utc_iso(),
+                    "attempt": attempts, "transport_error": str(e),
+                    "concurrency": concurrency(realm_id)
+                }))
+                if attempts >= MAX_ATTEMPTS_PER_REQ:
+                    raise TimeoutError(f"circuit_breaker: transporte fallido {attempts} veces")
+                observe_retry(entity, 'transport')
+                time.sleep(min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS ** attempts))
+                continue
+
+            observe(realm_id, resp.status_code, latency)
+            observe_request(entity, label, resp.status_code, latency, len(resp.content or b''))   # utils/telemetry.py
+
+            print(dumps({
+                "phase": "extract", "entity": entity, "stage": label, "ts": _now_utc_iso(),
+                "attempt": attempts, "status_code": resp.status_code,
+                "latency_secs": round(latency, 3), "concurrency": concurrency(realm_id)
+            }))
+
+            if resp.status_code == 200:
+                store_response(entity, url, data, realm_id, resp)
+                return resp
+
+            if resp.status_code in (429,) or 500 <= resp.status_code < 600:
+                if attempts >= MAX_ATTEMPTS_PER_REQ:
+                    raise TimeoutError(f"circuit_breaker: {resp.status_code} tras {attempts} intentos")
+                observe_retry(entity, '429' if resp.status_code == 429 else '5xx')
+                backoff = min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS ** attempts)
+                if resp.status_code == 429:
+                    penalize(realm_id, backoff)
+                time.sleep(backoff)
+                continue
+
+            if resp.status_code == 401:
+                raise PermissionError("401 Unauthorized (token expirado).")
+
+            raise Exception(f"QBO POST error {resp.status_code}: {resp.text}")
+
+    def query(self, cfg, access_token, realm_id, sql, label, metrics=None):
+        """POST /query de QBO y devuelve el QueryResponse."""
+        url = f"{QBO_BASE}/v3/company/{realm_id}/query"
+        headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Accept": "application/json",
+            "Content-Type": "application/text",   # requerido por sandbox
+        }
+        resp = self.post(url, headers, sql, cfg['name'], f"{cfg['name']}.{label}", realm_id, metrics)
+        return loads(resp.content).get("QueryResponse", {})
+
+    def count(self, cfg, access_token, realm_id, start_iso, end_iso, metrics=None, updated_after=None):
+        """
+        select count(*) de la ventana (QueryResponse.totalCount), sin payloads.
+        updated_after: sólo filas modificadas después (chequeo de fingerprint).
+        """
+        where = entity_where(cfg, start_iso, end_iso)
+        if updated_after:
+            where += f"and MetaData.LastUpdatedTime > '{_qbo_time(updated_after)}' "
+        sql = f"select count(*) from {cfg['qbo_entity']} " + where.rstrip()
+        return int(self.query(cfg, access_token, realm_id, sql, "count", metrics).get("totalCount", 0))
+
+    # ---- Ventanas y tramos ----
+    def fetch_window(self, cfg, access_token, realm_id, start_iso, end_iso, page_size, window_ref,
+                     payload_mode='raw', on_page=None, prefetch=1, metrics=None):
+        """
+        Todos los registros de la entidad en [start_iso, end_iso).
+        Devuelve (records, pages_read, rows_read); con on_page los registros van al callback.
+        """
+        entity, qbo_entity = cfg['name'], cfg['qbo_entity']
+        where = entity_where(cfg, start_iso, end_iso)
+
+        # Conteo previo sólo para dimensionar el prefetch; si falla se pagina sin él
+        total_count = None
+        if prefetch > 1:
+            try:
+                total_count = self.count(cfg, access_token, realm_id, start_iso, end_iso, metrics)
+            except PermissionError:
+                raise
+            except Exception as e:
+                print(dumps({
+                    "phase": "extract", "entity": entity, "ts": _now_utc_iso(),
+                    "stage": "count", "status": "failed", "error": str(e)
+                }))
+
+        def fetch_page(pos):
+            sql = f"select * from {qbo_entity} " + where + f"startposition {pos} maxresults {page_size}"
+            rows = self.query(cfg, access_token, realm_id, sql, "query", metrics).get(qbo_entity, []) or []
+            print(dumps({
+                "phase": "extract", "entity": entity, "ts": _now_utc_iso(),
+                "startpos": pos, "returned_rows": len(rows), "has_more": len(rows) == page_size,
+                "concurrency": concurrency(realm_id)
+            }))
+            return rows
+
+        records = []
+        page_number = 0
+        total_rows = 0
+        for page_number, rows in iter_pages(fetch_page, page_size, prefetch, total_count):
+            page_records = []
+            for c in rows:
+                rec = {"id": c["Id"], "window_ref": window_ref, "page_number": page_number}
+                if payload_mode == 'raw':
+                    rec["payload_json"] = dumps(c)
+                else:
+                    rec["payload"] = c
+                page_records.append(rec)
+
+            if on_page is not None:
+                on_page(page_records)
+            else:
+                records.extend(page_records)
+            total_rows += len(rows)
+
+        return records, page_number, total_rows
+
+    def extract_tramo(self, cfg, t, window_ref, realm_id, payload_mode='raw', on_page=None, prefetch=1):
+        """
+        Extrae un tramo de la entidad. Devuelve (window, records); (None, []) si se omite.
+        La ventana lleva 'entity' para que el exporter/loader la cargue en raw.qb_<entity>.
+        """
+        entity = cfg['name']
+        start_iso = t.get('start')
+        end_iso   = t.get('end')
+        page_size = int(t.get('page_size', 200))
+        metrics   = t.get('metrics') or new_metrics()
+
+        if not start_iso or not end_iso:
+            metrics['status'] = 'skipped_no_dates'
+            print(dumps({
+                "phase": "extract", "entity": entity, "ts": _now_utc_iso(),
+                "status": "skip", "reason": "tramo_sin_fechas",
+                "start": start_iso, "end": end_iso
+            }))
+            return None, []
+
+        try:
+            access_token = self.access_token(realm_id)
+        except PermissionError as e:
+            metrics['status'] = 'failed_auth'
+            print(dumps({
+                "phase": "auth", "entity": entity, "ts": _now_utc_iso(), "realm_id": realm_id,
+                "status": "failed", "error": str(e),
+                "start": start_iso, "end": end_iso
+            }))
+            return None, []
+
+        # Fingerprint (utils/fingerprint.py): ventana sin cambios en QBO → se omite sin paginar
+        def count(updated_after=None):
+            return self.count(cfg, access_token, realm_id, start_iso, end_iso, metrics, updated_after)
+
+        if window_unchanged(entity, t, count):
+            metrics['status'] = 'skipped_unchanged'
+            print(dumps({
+                "phase": "extract", "entity": entity, "ts": _now_utc_iso(),
+                "status": "skip", "reason": "unchanged", "realm_id": realm_id,
+                "start": start_iso, "end": end_iso, "rows": t['fingerprint']['rows']
+            }))
+            return None, []
+
+        window = {
+            "window_ref": window_ref,
+            "entity": entity,
+            "realm_id": realm_id,
+            "tramo_id": t.get('tramo_id'),
+            "start": start_iso,
+            "end": end_iso,
+            "page_size": page_size,
+            "filter_field": cfg['filter_field'],
+            "ingested_at_utc": _now_utc_iso(),
+            "metrics": metrics,
+        }
+        emit = (lambda recs: on_page(window, recs)) if on_page is not None else None
+
+        metrics['retries'] = 0   # reintentos HTTP del tramo (raw.tramo_history)
+        t0 = time.time()
+        print(dumps({
+            "phase": "extract", "entity": entity, "ts": _now_utc_iso(),
+            "status": "start", "realm_id": realm_id, "start": start_iso, "end": end_iso,
+            "page_size": page_size, "filter_field": cfg['filter_field'],
+            "payload_mode": payload_mode, "prefetch": prefetch
+        }))
+
+        args = (cfg, access_token, realm_id, start_iso, end_iso, page_size, window_ref)
+        try:
+            records, pages_read, rows_read = self.fetch_window(
+                *args, payload_mode=payload_mode, on_page=emit, prefetch=prefetch, metrics=metrics)
+        except PermissionError:
+            # Renueva token una vez y reintenta tramo
+            args = (cfg, self.access_token(realm_id, force=True)) + args[2:]
+            records, pages_read, rows_read = self.fetch_window(
+                *args, payload_mode=payload_mode, on_page=emit, prefetch=prefetch, metrics=metrics)
+
+        metrics['pages_read']    = int(pages_read)
+        metrics['rows_read']     = int(rows_read)
+        metrics['duration_secs'] = round(time.time() - t0, 3)
+        metrics['status']        = 'extracted'
+        metrics['concurrency']   = concurrency(realm_id)
+
+        print(dumps({
+            "phase": "extract", "entity": entity, "ts": _now_utc_iso(),
+            "status": "done", "realm_id": realm_id,
+            "start": start_iso, "end": end_iso,
+            "pages_read": metrics['pages_read'],
+            "rows_read": metrics['rows_read'],
+            "duration_secs": metrics['duration_secs'],
+            "concurrency": concurrency(realm_id)
+        }))
+        return window, records
+
+
+def entity_summary(windows):
+    """Métricas agregadas por entidad: {entity: {tramos, pages_read, rows_read, ...}}."""
+    out = {}
+    for w in windows:
+        m = w.get("metrics") or {}
+        s = out.setdefault(w["entity"], {
+            "windows": 0, "pages_read": 0, "rows_read": 0,
+            "rows_inserted": 0, "rows_updated": 0, "rows_unchanged": 0, "duration_secs": 0.0,
+        })
+        s["windows"] += 1
+        for k in ("pages_read", "rows_read", "rows_inserted", "rows_updated", "rows_unchanged"):
+            s[k] += int(m.get(k) or 0)
+        s["duration_secs"] = round(s["duration_secs"] + float(m.get("duration_secs") or 0), 3)
+    return out
@@ -0,0 +1,49 @@
+"""
+Codec JSON compartido para el camino extract → load.
+
+- Usa orjson si está instalado (mucho más rápido que json de la stdlib);
+  si no, cae a json sin cambiar el comportamiento.
+- `loads` acepta bytes directamente (resp.content), sin decodificar a str antes.
+- `dumps` devuelve str: es lo que psycopg espera como parámetro JSONB/text.
+
+Modo passthrough (payload_mode='raw'): no es un passthrough de bytes (zero-copy)
+sino decode + re-encode con orjson. Cada página se parsea una sola vez (necesario
+para Id y métricas) y cada fila se vuelve a serializar en ese momento a su texto
+JSON, que viaja tal cual hasta el parámetro JSONB del exporter. Se evita retener
+dicts anidados en memoria y el json.dumps por fila en la carga. Cortar los bytes
+de la respuesta por fila sin re-codificar requeriría un parser streaming.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+HAS_ORJSON = orjson is not None
+
+
+def loads(data):
+    """bytes/str JSON → objeto Python."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj) -> str:
+    """Objeto Python → texto JSON compacto (str)."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+
+def payload_text(record: dict) -> str:
+    """
+    Texto JSON del payload de un registro del extractor, sin re-codificar
+    si ya viene en modo passthrough ('payload_json': re-serializado con orjson
+    en el extractor, no los bytes originales de la respuesta).
+    """
+    raw = record.get("payload_json")
+    if raw is not None:
+        return raw
+    return dumps(record["payload"])
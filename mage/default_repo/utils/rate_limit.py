@@ -0,0 +1,347 @@
+"""
+Límite global de requests a QBO por realm, compartido entre procesos.
+
+QBO limita ~500 requests/minuto y 10 requests concurrentes por realm, sumando
+todo lo que corre contra ese realm (los tres pipelines, workers de la cola,
+prefetch). Todo request de QboClient.post pasa por `permit(realm_id)`:
+  - token bucket (tasa sostenida + ráfaga corta),
+  - slot de concurrencia.
+
+Backends (env QBO_RATE_BACKEND):
+  - 'local' (default en corridas de un solo proceso): token bucket + semáforo en
+    memoria (sólo este proceso), sin costo por request.
+  - 'postgres': bucket y slots en Postgres (docker/schema/005_rate_limit.sql),
+    compartidos por todos los procesos y nodos. Dos round trips por request
+    (raw.qbo_acquire = token + slot, y la liberación del slot) sobre un pool chico
+    de conexiones compartido por los hilos; `close()` lo cierra al terminar el
+    bloque (QboClient.close) y al salir el proceso. Si la base no responde, el
+    proceso sigue con el backend local (se loguea una vez).
+Sin QBO_RATE_BACKEND, las corridas repartidas en varios procesos (mode=worker,
+`python -m default_repo.utils.tramo_worker`, publish_queue) pasan a 'postgres'
+con `use_shared_backend()`; QBO_RATE_BACKEND=local lo evita.
+
+Ante un 429, `penalize(realm_id, secs)` vacía el bucket compartido para que todos
+los procesos pausen juntos en lugar de reintentar cada uno por su cuenta.
+
+Concurrencia adaptativa (AIMD, por realm y por proceso): antes del permiso global,
+cada request toma un lugar bajo un límite dinámico de requests en vuelo.
+`observe(realm_id, status_code, latency)` lo ajusta:
+  - +1 tras `limit` respuestas seguidas OK y más rápidas que QBO_AIMD_LATENCY_SECS,
+  - ×QBO_AIMD_DECREASE ante 429, 5xx o error de transporte (a lo sumo un recorte
+    por ronda de requests en vuelo).
+El límite se mueve entre 1 y QBO_MAX_CONCURRENT; `concurrency(realm_id)` lo expone
+para los logs `phase: extract`.
+
+Config (env): QBO_RATE_PER_MIN (default 450), QBO_MAX_CONCURRENT (default 8),
+QBO_AIMD_START (default 2), QBO_AIMD_LATENCY_SECS (default 2.0), QBO_AIMD_DECREASE (default 0.5).
+"""
+import atexit
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import psycopg
+
+from default_repo.utils.qbo_json import dumps
+from default_repo.utils.raw_load import pg_conn_str
+
+RATE_PER_MIN = float(os.environ.get('QBO_RATE_PER_MIN') or 450)
+MAX_CONCURRENT = int(os.environ.get('QBO_MAX_CONCURRENT') or 8)
+BACKEND_ENV = (os.environ.get('QBO_RATE_BACKEND') or '').lower()   # '' = automático
+BACKEND = BACKEND_ENV or 'local'
+SLOT_TTL_SECS = 90      # > timeout de un request (60 s): un slot huérfano se libera solo
+SLOT_POLL_SECS = 0.05
+POOL_IDLE_MAX = 2       # conexiones ociosas retenidas por proceso (backend postgres)
+AIMD_START = int(os.environ.get('QBO_AIMD_START') or 2)
+AIMD_LATENCY_SECS = float(os.environ.get('QBO_AIMD_LATENCY_SECS') or 2.0)
+AIMD_DECREASE = float(os.environ.get('QBO_AIMD_DECREASE') or 0.5)
+
+
+def _now_utc_iso():
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+class TokenBucket:
+    """Token bucket thread-safe: `acquire()` bloquea hasta que hay un permiso."""
+
+    def __init__(self, rate_per_sec, burst):
+        self.rate = rate_per_sec
+        self.capacity = max(1.0, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def penalize(self, secs):
+        with self.lock:
+            self.tokens = min(self.tokens, -self.rate * secs)
+            self.updated = time.monotonic()
+
+
+class AimdLimit:
+    """Límite de requests en vuelo con aumento aditivo / disminución multiplicativa."""
+
+    def __init__(self, start=AIMD_START, floor=1, ceiling=MAX_CONCURRENT):
+        self.floor, self.ceiling = floor, max(floor, ceiling)
+        self.limit = min(self.ceiling, max(self.floor, start))
+        self.inflight = 0
+        self.successes = 0
+        self.started = 0     # requests iniciados (para recortar una vez por ronda)
+        self.cut_at = -1     # valor de `started` en el último recorte
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while self.inflight >= self.limit:
+                self.cond.wait()
+            self.inflight += 1
+            self.started += 1
+            return self.started
+
+    def release(self):
+        with self.cond:
+            self.inflight -= 1
+            self.cond.notify()
+
+    def observe(self, ticket, ok, latency):
+        with self.cond:
+            if ok:
+                if latency is not None and latency <= AIMD_LATENCY_SECS:
+                    self.successes += 1
+                    if self.successes >= self.limit and self.limit < self.ceiling:
+                        self.limit += 1
+                        self.successes = 0
+                        self.cond.notify()
+                return
+            self.successes = 0
+            # Los requests que ya estaban en vuelo al recortar no vuelven a recortar.
+            if ticket is not None and ticket <= self.cut_at:
+                return
+            self.limit = max(self.floor, int(self.limit * AIMD_DECREASE))
+            self.cut_at = self.started
+
+
+class _LocalLimiter:
+    """Backend en memoria: sólo coordina hilos de este proceso."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.realms = {}   # realm → (TokenBucket, Semaphore)
+
+    def _get(self, realm):
+        with self.lock:
+            if realm not in self.realms:
+                self.realms[realm] = (TokenBucket(RATE_PER_MIN / 60.0, burst=MAX_CONCURRENT),
+                                      threading.BoundedSemaphore(MAX_CONCURRENT))
+            return self.realms[realm]
+
+    @contextmanager
+    def permit(self, realm):
+        bucket, slots = self._get(realm)
+        bucket.acquire()
+        with slots:
+            yield
+
+    def penalize(self, realm, secs):
+        self._get(realm)[0].penalize(secs)
+
+
+class _PgLimiter:
+    """
+    Backend Postgres: estado en raw.qbo_rate_*. Las conexiones (autocommit) se
+    toman de un pool chico sólo durante cada llamada, así los hilos de prefetch
+    y de los pools por ventana no abren una conexión propia cada uno.
+    """
+
+    def __init__(self, conn_str):
+        self.conn_str = conn_str
+        self.lock = threading.Lock()
+        self.idle = []
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+
+    @contextmanager
+    def _conn(self):
+        with self.lock:
+            conn = self.idle.pop() if self.idle else None
+        if conn is None or conn.closed:
+            conn = psycopg.connect(self.conn_str, autocommit=True)
+        try:
+            yield conn
+        except psycopg.Error:
+            conn.close()
+            raise
+        finally:
+            with self.lock:
+                keep = not conn.closed and len(self.idle) < POOL_IDLE_MAX
+                if keep:
+                    self.idle.append(conn)
+            if not keep:
+                conn.close()
+
+    def _call(self, sql, params):
+        with self._conn() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    def _acquire(self, realm, holder):
+        """Token + slot en una llamada (raw.qbo_acquire); espera y reintenta hasta obtener ambos."""
+        rate = RATE_PER_MIN / 60.0
+        while True:
+            wait, slot = self._call(
+                "SELECT out_wait, out_slot FROM raw.qbo_acquire(%s, %s, %s, %s, %s, %s)",
+                (realm, rate, float(MAX_CONCURRENT), MAX_CONCURRENT, holder, float(SLOT_TTL_SECS))
+            )
+            if slot is not None:
+                return slot
+            time.sleep(SLOT_POLL_SECS if wait is None else min(wait, 5.0))
+
+    @contextmanager
+    def permit(self, realm):
+        holder = f"{self.holder}:{threading.get_ident()}"
+        slot = self._acquire(realm, holder)
+        try:
+            yield
+        finally:
+            self._call("SELECT raw.qbo_release_slot(%s, %s, %s)", (realm, slot, holder))
+
+    def penalize(self, realm, secs):
+        self._call("SELECT raw.qbo_penalize(%s, %s, %s)", (realm, RATE_PER_MIN / 60.0, float(secs)))
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+
+_lock = threading.Lock()
+_local = _LocalLimiter()
+_aimd = {}            # realm → AimdLimit
+_tickets = threading.local()
+_shared = None        # _PgLimiter una vez inicializado
+_degraded = False     # la base falló: este proceso sigue con el backend local
+
+
+def _degrade(e):
+    global _degraded
+    with _lock:
+        if _degraded:
+            return
+        _degraded = True
+    print(dumps({
+        "phase": "rate_limit", "ts": _now_utc_iso(), "status": "degraded",
+        "backend": "local", "error": str(e)
+    }))
+
+
+def use_shared_backend(reason):
+    """
+    Corrida multi-proceso: pasa al backend postgres salvo que QBO_RATE_BACKEND
+    esté seteado (una elección explícita siempre gana). Devuelve el backend vigente.
+    """
+    global BACKEND
+    with _lock:
+        if BACKEND_ENV or BACKEND == 'postgres':
+            return BACKEND
+        BACKEND = 'postgres'
+    print(dumps({
+        "phase": "rate_limit", "ts": _now_utc_iso(), "status": "shared",
+        "backend": "postgres", "reason": reason
+    }))
+    return BACKEND
+
+
+def _limiter():
+    global _shared
+    if BACKEND != 'postgres' or _degraded:
+        return _local
+    with _lock:
+        if _shared is None:
+            _shared = _PgLimiter(pg_conn_str())
+        return _shared
+
+
+def _aimd_for(realm):
+    with _lock:
+        if realm not in _aimd:
+            _aimd[realm] = AimdLimit()
+        return _aimd[realm]
+
+
+def concurrency(realm_id=None):
+    """Límite AIMD actual de requests en vuelo para el realm (este proceso)."""
+    return _aimd_for(realm_id or 'default').limit
+
+
+def observe(realm_id, status_code, latency=None):
+    """
+    Realimenta el AIMD con el resultado del último request del hilo
+    (status_code None = error de transporte).
+    """
+    ok = status_code is not None and status_code != 429 and status_code < 500
+    _aimd_for(realm_id or 'default').observe(getattr(_tickets, 'ticket', None), ok, latency)
+
+
+@contextmanager
+def permit(realm_id=None):
+    """Espera un lugar AIMD, un permiso de tasa y un slot de concurrencia para el realm."""
+    realm = realm_id or 'default'
+    aimd = _aimd_for(realm)
+    _tickets.ticket = aimd.acquire()
+    try:
+        with _global_permit(realm):
+            yield
+    finally:
+        aimd.release()
+
+
+@contextmanager
+def _global_permit(realm):
+    try:
+        ctx = _limiter().permit(realm)
+        ctx.__enter__()
+    except psycopg.Error as e:
+        _degrade(e)
+        ctx = _local.permit(realm)
+        ctx.__enter__()
+    try:
+        yield
+    finally:
+        try:
+            ctx.__exit__(None, None, None)
+        except psycopg.Error as e:
+            _degrade(e)   # el slot vence solo tras SLOT_TTL_SECS
+
+
+def penalize(realm_id=None, secs=0.0):
+    """429 recibido: pausa a todos los que comparten el realm durante `secs`."""
+    realm = realm_id or 'default'
+    try:
+        _limiter().penalize(realm, secs)
+    except psycopg.Error as e:
+        _degrade(e)
+        _local.penalize(realm, secs)
+
+
+def close():
+    """Cierra las conexiones del backend postgres (fin de bloque; se reabren si hace falta)."""
+    with _lock:
+        shared = _shared
+    if shared is not None:
+        shared.close()
+
+
+atexit.register(close)
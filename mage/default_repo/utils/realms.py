@@ -0,0 +1,113 @@
+"""
+Multi-realm: varias compañías QBO desde los mismos pipelines.
+
+Config:
+  - Secret QBO_REALMS: 'realm[:peso],realm[:peso],...' (ej. '9130:3,4620,7781').
+    Si no existe se usa QBO_REALM_ID (un realm, peso 1): el caso de siempre.
+  - Runtime var `realms` (misma sintaxis) elige/pondera los realms de una corrida.
+  - Credenciales por realm: QBO_CLIENT_ID_<realm>, QBO_CLIENT_SECRET_<realm>,
+    QBO_REFRESH_TOKEN_<realm>; si no existen, las globales (misma app Intuit).
+
+Cada realm tiene su propio token cacheado (`token_cache`) y su propio presupuesto
+de requests (utils/rate_limit.py ya es por realm). `fair_order` intercala los
+tramos de todos los realms con weighted round-robin suave: el pool compartido
+los toma en ese orden, así una compañía grande no deja sin turno a las chicas.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from mage_ai.data_preparation.shared.secrets import get_secret_value
+
+TOKEN_MARGIN_SECS = 300   # renovar 5 min antes de que expire
+
+
+def _secret(name):
+    try:
+        return get_secret_value(name)
+    except Exception:
+        return None
+
+
+def parse_realms(spec):
+    """'a:3,b' → [('a', 3), ('b', 1)]"""
+    realms = []
+    for part in str(spec or '').replace(';', ',').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        realm, _, weight = part.partition(':')
+        realms.append((realm.strip(), max(1, int(weight or 1))))
+    return realms
+
+
+def load_realms(kwargs):
+    """Realms de la corrida: runtime var `realms` > secret QBO_REALMS > QBO_REALM_ID."""
+    spec = kwargs.get('realms') or _secret('QBO_REALMS') or _secret('QBO_REALM_ID')
+    realms = parse_realms(spec)
+    if not realms:
+        raise Exception("Falta QBO_REALM_ID (o QBO_REALMS) en Secrets.")
+    return realms
+
+
+def realm_secret(name, realm_id):
+    """Secreto específico del realm (NAME_<realm>) o el global."""
+    return (_secret(f"{name}_{realm_id}") if realm_id else None) or _secret(name)
+
+
+class TokenCache:
+    """access_token por realm hasta poco antes de `expires_in`."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = {}   # realm → (token, expires_at monotonic)
+
+    def get(self, realm_id):
+        with self.lock:
+            token, expires_at = self.tokens.get(realm_id, (None, 0))
+        return token if time.monotonic() < expires_at else None
+
+    def put(self, realm_id, token, expires_in):
+        with self.lock:
+            self.tokens[realm_id] = (token, time.monotonic() + int(expires_in or 3600) - TOKEN_MARGIN_SECS)
+
+    def invalidate(self, realm_id):
+        with self.lock:
+            self.tokens.pop(realm_id, None)
+
+
+token_cache = TokenCache()
+
+
+def fair_order(realms, tramos):
+    """
+    Un job por (realm, tramo), intercalados por smooth weighted round-robin.
+    Cada job es una copia del tramo con 'realm_id' y métricas propias.
+    """
+    pending = {realm: deque(
+        {**t, 'realm_id': realm, 'metrics': dict(t['metrics']) if t.get('metrics') else None}
+        for t in tramos
+    ) for realm, _ in realms}
+    weights = dict(realms)
+    current = {realm: 0 for realm in weights}
+    jobs = []
+    while any(pending.values()):
+        active = [r for r in weights if pending[r]]
+        total = sum(weights[r] for r in active)
+        for r in active:
+            current[r] += weights[r]
+        pick = max(active, key=lambda r: current[r])
+        current[pick] -= total
+        jobs.append(pending[pick].popleft())
+    return jobs
+
+
+def run_pool(fn, jobs, workers=1):
+    """fn(ref, job) sobre los jobs en orden con un pool compartido; resultados en orden."""
+    if workers <= 1:
+        for ref, job in enumerate(jobs):
+            yield fn(ref, job)
+        return
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='realm-pool') as pool:
+        yield from pool.map(fn, range(len(jobs)), jobs)
@@ -0,0 +1,134 @@
+"""
+mode=repair: trae por Id los customers/items que las facturas referencian y no están en RAW.
+
+Customers se extraen por ventana de MetaData.CreateTime, así que un CustomerRef
+(o ItemRef) puede apuntar a un registro que nunca entró en una ventana cargada.
+En vez de re-backfills amplios:
+
+  1. una query anti-join sobre columnas generadas de raw.qb_invoices
+     (customer_ref, 002; item_refs, docker/schema/012_invoice_item_refs.sql)
+     contra la PK (realm_id, id) de raw.qb_customers / raw.qb_items,
+  2. `select * from <Entity> where Id in ('1', '2', ...)` en lotes de
+     `repair_batch` ids (default 100) por request; los que no vuelven se
+     reintentan con `Active = false` (QBO excluye inactivos por defecto),
+  3. upsert a RAW en una transacción por realm (utils/raw_load.py), con una
+     ventana filter_field='ids' en raw.extract_windows.
+
+Los ids que QBO tampoco devuelve (borrados o fusionados) se loguean como not_found.
+"""
+import re
+from datetime import datetime, timezone
+
+import psycopg
+
+from default_repo.utils.qbo_json import dumps
+from default_repo.utils.raw_load import new_counts, pg_conn_str, upsert_records, upsert_window
+
+REPAIR_BATCH = 100
+MAX_BATCH = 1000   # maxresults máximo de QBO
+REPAIR_START = '1970-01-01T00:00:00Z'
+
+MISSING_SQL = {
+    'customers': """
+        SELECT DISTINCT i.realm_id, i.customer_ref
+        FROM raw.qb_invoices i
+        WHERE i.realm_id = ANY(%(realms)s)
+          AND i.customer_ref IS NOT NULL
+          AND NOT EXISTS (
+            SELECT 1 FROM raw.qb_customers c
+            WHERE c.realm_id = i.realm_id AND c.id = i.customer_ref
+          );
+    """,
+    'items': """
+        SELECT DISTINCT i.realm_id, ref.id
+        FROM raw.qb_invoices i
+        CROSS JOIN LATERAL jsonb_array_elements_text(i.item_refs) AS ref(id)
+        WHERE i.realm_id = ANY(%(realms)s)
+          AND NOT EXISTS (
+            SELECT 1 FROM raw.qb_items it
+            WHERE it.realm_id = i.realm_id AND it.id = ref.id
+          );
+    """,
+}
+
+_ID_RE = re.compile(r'^[0-9]+$')   # los Id de QBO son numéricos; se interpolan en la query
+
+
+def _now_utc_iso():
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def missing_ids(entity, realms):
+    """{realm_id: [ids]} referenciados por raw.qb_invoices y ausentes en raw.qb_<entity>."""
+    with psycopg.connect(pg_conn_str()) as conn:
+        rows = conn.execute(MISSING_SQL[entity], {"realms": [r for r, _ in realms]}).fetchall()
+    out = {}
+    for realm_id, rid in rows:
+        if _ID_RE.match(rid or ''):
+            out.setdefault(realm_id, []).append(rid)
+    return {realm_id: sorted(ids, key=int) for realm_id, ids in out.items()}
+
+
+def batches(ids, size=REPAIR_BATCH):
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def ids_where(ids, inactive=False):
+    """where Id in (...) [and Active = false]."""
+    quoted = ", ".join(f"'{i}'" for i in ids)
+    return f"where Id in ({quoted})" + (" and Active = false" if inactive else "")
+
+
+def fetch_ids(query, qbo_entity, ids, batch, metrics):
+    """
+    Registros de `ids` desde QBO, `batch` ids por request.
+    query(sql, label) -> QueryResponse. Los que no vuelven se piden como inactivos.
+    """
+    batch = max(1, min(int(batch), MAX_BATCH))
+    rows = {}
+    for chunk in batches(ids, batch):
+        for inactive in (False, True):
+            sql = f"select * from {qbo_entity} {ids_where(chunk, inactive)} maxresults {len(chunk)}"
+            found = query(sql, "repair_inactive" if inactive else "repair").get(qbo_entity) or []
+            metrics['pages_read'] += 1
+            metrics['rows_read'] += len(found)
+            rows.update((row.get("Id"), row) for row in found)
+            chunk = [i for i in chunk if i not in rows]
+            if not chunk:
+                break
+    return list(rows.values())
+
+
+def repair_window(realm_id, batch=REPAIR_BATCH):
+    """Ventana de la reparación (una por realm y corrida) para raw.extract_windows."""
+    now = _now_utc_iso()
+    return {
+        "window_ref": f"ids:{realm_id}",
+        "realm_id": realm_id,
+        "tramo_id": None,
+        "start": REPAIR_START,
+        "end": now,
+        "page_size": batch,
+        "filter_field": "ids",
+        "ingested_at_utc": now,
+        "metrics": {
+            'pages_read': 0, 'rows_read': 0,
+            'rows_inserted': 0, 'rows_updated': 0,
+            'duration_secs': 0.0, 'status': 'pending'
+        },
+    }
+
+
+def load_rows(entity, window, rows):
+    """Upsert de los registros traídos por Id (una transacción). Devuelve los conteos."""
+    records = [{"id": row.get("Id"), "payload_json": dumps(row), "page_number": 1} for row in rows]
+    with psycopg.connect(pg_conn_str()) as conn:
+        with conn.cursor() as cur:
+            window_id = upsert_window(cur, entity, window)
+            counts = upsert_records(cur, entity, records, window_id, window["ingested_at_utc"],
+                                    window["realm_id"], new_counts())
+    window["metrics"]['rows_inserted'] = counts["inserted"]
+    window["metrics"]['rows_updated'] = counts["updated"]
+    window["metrics"]['status'] = 'loaded'
+    return counts
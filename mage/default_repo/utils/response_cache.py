@@ -0,0 +1,156 @@
+"""
+Cache en disco de respuestas QBO y record/replay, para iterar loaders sin API.
+
+Toda respuesta 200 de QboClient.post (utils/qbo_client.py, todos los extractores) puede
+guardarse como un archivo gzip direccionado por contenido:
+
+    <QBO_CACHE_DIR>/<entity>/<k[:2]>/<k>.gz,   k = sha256(entity, realm, endpoint, SQL)
+
+Modos (env QBO_CACHE):
+  - 'off' (default): sin cache,
+  - 'on': lee del cache si la entrada tiene menos de QBO_CACHE_TTL_SECS; si no,
+    va a QBO y guarda la respuesta,
+  - 'record': siempre va a QBO y guarda (refresca lo grabado),
+  - 'replay': sólo cache, sin red ni token; una respuesta no grabada es un error
+    (LookupError). Ignora el TTL.
+
+Un hit no pasa por el límite por realm ni el AIMD (utils/rate_limit.py): no
+consume cuota. El tamaño total se acota con QBO_CACHE_MAX_MB; al pasarlo se
+borran las entradas usadas hace más tiempo (mtime, que se renueva en cada hit)
+hasta quedar en el 90%.
+
+Ojo: con 'on' los count(*) de fingerprint/reconcile también salen del cache;
+para validar contra QBO usar 'off' o 'record'.
+"""
+import gzip
+import hashlib
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+from default_repo.utils.qbo_json import dumps, loads
+
+DEFAULT_CACHE_DIR = '/home/src/mage_data/qbo_cache'
+MODE = (os.environ.get('QBO_CACHE') or 'off').lower()
+CACHE_DIR = os.environ.get('QBO_CACHE_DIR') or DEFAULT_CACHE_DIR
+TTL_SECS = float(os.environ.get('QBO_CACHE_TTL_SECS') or 86400)
+MAX_BYTES = int(float(os.environ.get('QBO_CACHE_MAX_MB') or 2048) * 1024 * 1024)
+COMPRESS_LEVEL = 3
+
+_lock = threading.Lock()
+_size = None   # bytes en disco; se calcula en la primera escritura
+
+
+def _now_utc_iso():
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+class CachedResponse:
+    """Lo que los extractores usan de requests.Response."""
+    status_code = 200
+    ok = True
+
+    def __init__(self, content):
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return loads(self.content)
+
+
+def replaying():
+    return MODE == 'replay'
+
+
+def _path(entity, url, data, realm_id):
+    body = data if isinstance(data, str) else dumps(data)
+    key = hashlib.sha256("\n".join((entity, str(realm_id), urlsplit(url).path, body)).encode()).hexdigest()
+    return os.path.join(CACHE_DIR, entity, key[:2], f"{key}.gz")
+
+
+def cached_response(entity, url, data, realm_id, label):
+    """CachedResponse si hay entrada válida; None si hay que ir a QBO."""
+    if MODE not in ('on', 'replay'):
+        return None
+    path = _path(entity, url, data, realm_id)
+    try:
+        age = time.time() - os.stat(path).st_mtime
+        if MODE == 'on' and age > TTL_SECS:
+            return None
+        with gzip.open(path, 'rb') as f:
+            content = f.read()
+        os.utime(path)   # recencia para el desalojo
+    except (OSError, EOFError):
+        if MODE == 'replay':
+            raise LookupError(f"replay: sin respuesta grabada para {label} (realm {realm_id})") from None
+        return None
+
+    print(dumps({
+        "phase": "extract", "entity": entity, "stage": label, "ts": _now_utc_iso(),
+        "cache": "hit", "age_secs": round(age, 1), "bytes": len(content)
+    }))
+    return CachedResponse(content)
+
+
+def store_response(entity, url, data, realm_id, resp):
+    """Guarda una respuesta 200 (modos 'on' y 'record'). Un error de disco no corta la extracción."""
+    if MODE not in ('on', 'record'):
+        return
+    path = _path(entity, url, data, realm_id)
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(tmp, 'wb', compresslevel=COMPRESS_LEVEL) as f:
+            f.write(resp.content)
+        os.replace(tmp, path)   # atómico: un lector nunca ve un archivo a medias
+        written = os.path.getsize(path)
+    except OSError as e:
+        print(dumps({
+            "phase": "extract", "entity": entity, "ts": _now_utc_iso(),
+            "cache": "store_failed", "error": str(e)
+        }))
+        return
+    _account(written)
+
+
+def _entries():
+    for root, _, files in os.walk(CACHE_DIR):
+        for name in files:
+            if name.endswith('.gz'):
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield st.st_mtime, st.st_size, path
+
+
+def _account(written):
+    global _size
+    with _lock:
+        if _size is None:
+            _size = sum(size for _, size, _ in _entries())
+        else:
+            _size += written
+        if _size <= MAX_BYTES:
+            return
+        evicted, target = 0, MAX_BYTES * 0.9
+        for _, size, path in sorted(_entries()):
+            if _size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            _size -= size
+            evicted += 1
+    print(dumps({
+        "phase": "extract", "ts": _now_utc_iso(), "cache": "evicted",
+        "entries": evicted, "bytes": _size, "max_bytes": MAX_BYTES
+    }))
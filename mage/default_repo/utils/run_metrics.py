@@ -0,0 +1,196 @@
+"""
+Métricas por corrida y por tramo persistidas en raw.extract_runs / raw.extract_tramos
+(docker/schema/014_extract_runs.sql), con vistas de rows/s, pages/s, tasa de
+reintentos y ventanas más lentas.
+
+- record_extract: el extractor, al terminar, registra una fila por tramo (ventana,
+  páginas, filas, reintentos, duración) y la corrida. En fused/worker la carga ya
+  ocurrió: los conteos inserted/updated/unchanged del tramo van en el mismo paso.
+- record_load: el exporter completa cada tramo con lo que cargó (load_records deja
+  inserted/updated/unchanged en window['metrics']) y cierra la corrida.
+
+El run_id (el mismo de raw.tramo_history) viaja en cada ventana (window['run_id'])
+del extractor al exporter. Los totales de la corrida se recalculan desde sus tramos,
+así varios workers de la misma corrida suman. Runtime var `run_metrics`: 'on'
+(default) | 'off'. Un error de base se loguea y no interrumpe el pipeline.
+"""
+from datetime import datetime, timezone
+
+import psycopg
+
+from default_repo.utils.qbo_json import dumps
+from default_repo.utils.raw_load import pg_conn_str
+from default_repo.utils.tramo_queue import new_run_id
+
+# Runtime vars que se guardan con la corrida
+PARAM_KEYS = ('fecha_inicio', 'fecha_fin', 'chunk', 'page_size', 'prefetch_pages', 'fetch_workers',
+              'load_workers', 'handoff', 'payload_mode', 'realms')
+
+RUN_SQL = """
+INSERT INTO raw.extract_runs (
+    run_id, entity, mode, status, started_at_utc, extracted_at_utc, loaded_at_utc, params
+)
+VALUES (
+    %(run_id)s, %(entity)s, %(mode)s, %(status)s, %(started)s, %(extracted)s, %(loaded)s, %(params)s
+)
+ON CONFLICT (run_id, entity) DO UPDATE SET
+    status = EXCLUDED.status,
+    started_at_utc = LEAST(raw.extract_runs.started_at_utc, EXCLUDED.started_at_utc),
+    extracted_at_utc = GREATEST(raw.extract_runs.extracted_at_utc, EXCLUDED.extracted_at_utc),
+    loaded_at_utc = COALESCE(EXCLUDED.loaded_at_utc, raw.extract_runs.loaded_at_utc);
+"""
+
+TRAMO_SQL = """
+INSERT INTO raw.extract_tramos (
+    run_id, entity, realm_id, filter_field, window_start_utc, window_end_utc, tramo_id, chunk,
+    page_size, pages_read, rows_read, rows_inserted, rows_updated, rows_unchanged, retries,
+    extract_secs, status, started_at_utc, loaded_at_utc
+)
+VALUES (
+    %(run_id)s, %(entity)s, %(realm_id)s, %(filter_field)s, %(start)s, %(end)s, %(tramo_id)s, %(chunk)s,
+    %(page_size)s, %(pages_read)s, %(rows_read)s, %(inserted)s, %(updated)s, %(unchanged)s, %(retries)s,
+    %(extract_secs)s, %(status)s, %(started)s, %(loaded)s
+)
+ON CONFLICT (run_id, entity, realm_id, filter_field, window_start_utc, window_end_utc) DO UPDATE SET
+    pages_read = EXCLUDED.pages_read,
+    rows_read = EXCLUDED.rows_read,
+    rows_inserted = EXCLUDED.rows_inserted,
+    rows_updated = EXCLUDED.rows_updated,
+    rows_unchanged = EXCLUDED.rows_unchanged,
+    retries = EXCLUDED.retries,
+    extract_secs = EXCLUDED.extract_secs,
+    status = EXCLUDED.status,
+    started_at_utc = EXCLUDED.started_at_utc,
+    loaded_at_utc = EXCLUDED.loaded_at_utc;
+"""
+
+TRAMO_LOAD_SQL = """
+UPDATE raw.extract_tramos SET
+    rows_inserted = %(inserted)s, rows_updated = %(updated)s, rows_unchanged = %(unchanged)s,
+    status = 'loaded', loaded_at_utc = now()
+WHERE run_id = %(run_id)s AND entity = %(entity)s AND realm_id = %(realm_id)s
+  AND filter_field = %(filter_field)s AND window_start_utc = %(start)s AND window_end_utc = %(end)s;
+"""
+
+# Totales de la corrida = suma de sus tramos (vale para varios workers con el mismo run_id)
+REFRESH_RUN_SQL = """
+UPDATE raw.extract_runs r SET
+    realms = t.realms, tramos = t.tramos, pages_read = t.pages_read, rows_read = t.rows_read,
+    rows_inserted = t.rows_inserted, rows_updated = t.rows_updated, rows_unchanged = t.rows_unchanged,
+    retries = t.retries
+FROM (
+    SELECT array_agg(DISTINCT realm_id ORDER BY realm_id) AS realms, count(*) AS tramos,
+           sum(pages_read) AS pages_read, sum(rows_read) AS rows_read,
+           coalesce(sum(rows_inserted), 0) AS rows_inserted, coalesce(sum(rows_updated), 0) AS rows_updated,
+           coalesce(sum(rows_unchanged), 0) AS rows_unchanged, sum(retries) AS retries
+    FROM raw.extract_tramos
+    WHERE run_id = %(run_id)s AND entity = %(entity)s
+) t
+WHERE r.run_id = %(run_id)s AND r.entity = %(entity)s;
+"""
+
+RUN_LOAD_SQL = """
+UPDATE raw.extract_runs SET status = 'loaded', loaded_at_utc = now(), load_secs = %(load_secs)s
+WHERE run_id = %(run_id)s AND entity = %(entity)s;
+"""
+
+
+def _now_utc_iso():
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def enabled(kwargs):
+    return str(kwargs.get('run_metrics') or 'on').lower() not in ('off', 'false', '0', 'no')
+
+
+def _log_failure(entity, stage, error):
+    print(dumps({
+        "phase": "metrics", "entity": entity, "ts": _now_utc_iso(),
+        "status": f"{stage}_failed", "error": str(error)
+    }))
+
+
+def _key(w, entity, run_id):
+    return {
+        "run_id": run_id, "entity": w.get("entity", entity), "realm_id": w["realm_id"],
+        "filter_field": w["filter_field"], "start": w["start"], "end": w["end"],
+    }
+
+
+def record_extract(entity, windows, kwargs, mode, chunk=None, run_id=None, loaded=False, conn_str=None):
+    """
+    Registra la corrida y sus tramos al terminar la extracción; devuelve el run_id
+    (generado si no viene) y lo deja en cada ventana para el exporter.
+    loaded=True (fused/worker): los tramos ya traen inserted/updated/unchanged.
+    """
+    run_id = run_id or new_run_id(entity)
+    if not windows:
+        return run_id
+    for w in windows:
+        w["run_id"] = run_id
+    if not enabled(kwargs):
+        return run_id
+
+    now = datetime.now(timezone.utc)
+    status = 'loaded' if loaded else 'extracted'
+    tramos, started = [], {}
+    for w in windows:
+        m = w.get("metrics") or {}
+        row = {
+            **_key(w, entity, run_id),
+            "tramo_id": w.get("tramo_id"), "chunk": chunk, "page_size": w["page_size"],
+            "pages_read": int(m.get('pages_read') or 0), "rows_read": int(m.get('rows_read') or 0),
+            "inserted": m.get('rows_inserted') if loaded else None,
+            "updated": m.get('rows_updated') if loaded else None,
+            "unchanged": m.get('rows_unchanged') if loaded else None,
+            "retries": int(m.get('retries') or 0), "extract_secs": float(m.get('duration_secs') or 0.0),
+            "status": status, "started": w["ingested_at_utc"], "loaded": now if loaded else None,
+        }
+        tramos.append(row)
+        started[row["entity"]] = min(started.get(row["entity"], row["started"]), row["started"])
+
+    params = dumps({k: str(kwargs[k]) for k in PARAM_KEYS if kwargs.get(k) is not None})
+    runs = [{
+        "run_id": run_id, "entity": name, "mode": mode, "status": status, "started": first,
+        "extracted": now, "loaded": now if loaded else None, "params": params,
+    } for name, first in started.items()]
+
+    try:
+        with psycopg.connect(conn_str or pg_conn_str()) as conn:
+            with conn.cursor() as cur:
+                cur.executemany(RUN_SQL, runs)
+                cur.executemany(TRAMO_SQL, tramos)
+                cur.executemany(REFRESH_RUN_SQL, [{"run_id": run_id, "entity": r["entity"]} for r in runs])
+    except psycopg.Error as e:
+        _log_failure(entity, "run_metrics", e)
+    return run_id
+
+
+def record_load(entity, windows, load_secs, conn_str=None):
+    """Completa los tramos cargados por el exporter (inserted/updated/unchanged) y cierra la corrida."""
+    rows = []
+    for w in windows or []:
+        if not w.get("run_id"):
+            continue   # extractor anterior o run_metrics=off
+        m = w.get("metrics") or {}
+        rows.append({
+            **_key(w, entity, w["run_id"]),
+            "inserted": int(m.get('rows_inserted') or 0), "updated": int(m.get('rows_updated') or 0),
+            "unchanged": int(m.get('rows_unchanged') or 0),
+        })
+    if not rows:
+        return 0
+
+    runs = list({(r["run_id"], r["entity"]): None for r in rows})
+    try:
+        with psycopg.connect(conn_str or pg_conn_str()) as conn:
+            with conn.cursor() as cur:
+                cur.executemany(TRAMO_LOAD_SQL, rows)
+                params = [{"run_id": run_id, "entity": name, "load_secs": round(load_secs, 3)}
+                          for run_id, name in runs]
+                cur.executemany(REFRESH_RUN_SQL, params)
+                cur.executemany(RUN_LOAD_SQL, params)
+    except psycopg.Error as e:
+        _log_failure(entity, "run_metrics", e)
+        return 0
+    return len(rows)
@@ -0,0 +1,147 @@
+"""
+mode=snapshot: entidad completa en páginas grandes y diff contra RAW por SyncToken.
+
+Para dimensiones chicas (items, customers) los tramos por fecha cuestan más que
+traer la entidad entera: sin ventanas, sin tramos vacíos, `maxresults 1000`
+(máximo de QBO) y con `Active IN (true, false)` para incluir los inactivos
+(en QBO "borrar" un item o customer lo deja inactivo). Las páginas van con
+`orderby Id`: sin orden explícito QBO no garantiza que startposition recorra
+las filas sin saltos ni repetidos.
+
+Por realm, en una sola transacción:
+  1. lee (id, sync_token) de raw.qb_<entity>,
+  2. upsert sólo de filas nuevas o con SyncToken distinto (utils/raw_load.py),
+  3. ids de RAW que ya no vienen en QBO → deleted_at_utc = now()
+     (docker/schema/009_snapshot.sql); si reaparecen se limpia la marca.
+
+Una falla a mitad de la descarga hace rollback: nunca se marcan borrados con un
+snapshot incompleto. Tampoco si el snapshot trajo menos ids distintos que el
+count(*) tomado al empezar (`expected`: páginas corridas o filas borradas durante
+la descarga); las filas nuevas/cambiadas se cargan igual y el próximo snapshot
+marca los borrados. Un snapshot vacío contra RAW con filas no marca nada
+(realm o credenciales equivocadas, no una compañía vaciada).
+Cada snapshot queda como una ventana [1970-01-01, ingested_at_utc) con
+filter_field='snapshot' en raw.extract_windows.
+"""
+from datetime import datetime, timezone
+
+import psycopg
+
+from default_repo.utils.qbo_json import dumps
+from default_repo.utils.raw_load import new_counts, upsert_records, upsert_window
+
+SNAPSHOT_PAGE_SIZE = 1000
+SNAPSHOT_START = '1970-01-01T00:00:00Z'
+
+KNOWN_SQL = "SELECT id, sync_token, deleted_at_utc IS NOT NULL FROM raw.qb_{entity} WHERE realm_id = %s"
+
+MARK_DELETED_SQL = """
+UPDATE raw.qb_{entity} SET deleted_at_utc = %(ts)s
+WHERE realm_id = %(realm_id)s AND id = ANY(%(ids)s) AND deleted_at_utc IS NULL
+"""
+
+RESTORE_SQL = """
+UPDATE raw.qb_{entity} SET deleted_at_utc = NULL
+WHERE realm_id = %(realm_id)s AND id = ANY(%(ids)s)
+"""
+
+
+def _now_utc_iso():
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def snapshot_where():
+    """Todos los registros, activos e inactivos."""
+    return "where Active IN (true, false) "
+
+
+def snapshot_page(start_position, max_results):
+    """Paginación del snapshot con orden estable por Id."""
+    return f"orderby Id startposition {start_position} maxresults {max_results}"
+
+
+def snapshot_window(realm_id):
+    """Ventana del snapshot (una por realm y corrida) para raw.extract_windows."""
+    now = _now_utc_iso()
+    return {
+        "window_ref": f"snapshot:{realm_id}",
+        "realm_id": realm_id,
+        "tramo_id": None,
+        "start": SNAPSHOT_START,
+        "end": now,
+        "page_size": SNAPSHOT_PAGE_SIZE,
+        "filter_field": "snapshot",
+        "ingested_at_utc": now,
+        "metrics": {
+            'pages_read': 0, 'rows_read': 0,
+            'rows_inserted': 0, 'rows_updated': 0,
+            'duration_secs': 0.0, 'status': 'pending'
+        },
+    }
+
+
+def _sync_token(row):
+    token = row.get("SyncToken")
+    return int(token) if token is not None else None
+
+
+def apply_snapshot(conn_str, entity, window, pages, expected=None):
+    """
+    Aplica el snapshot de un realm. `pages` = iterable de (page_number, rows) de QBO.
+    expected: count(*) de QBO al empezar; con menos ids distintos no se marcan borrados.
+    Devuelve los conteos inserted/updated/unchanged/skipped + deleted/restored.
+    """
+    realm_id = window["realm_id"]
+    metrics = window["metrics"]
+    counts = {**new_counts(), "deleted": 0, "restored": 0}
+
+    with psycopg.connect(conn_str) as conn:
+        with conn.cursor() as cur:
+            cur.execute(KNOWN_SQL.format(entity=entity), (realm_id,))
+            known = {rid: (token, deleted) for rid, token, deleted in cur.fetchall()}
+            window_id = upsert_window(cur, entity, window)
+
+            seen = set()
+            restored = []
+            for page_number, rows in pages:
+                metrics['pages_read'] = page_number
+                metrics['rows_read'] += len(rows)
+                changed = []
+                for row in rows:
+                    rid = row.get("Id")
+                    seen.add(rid)
+                    prev = known.get(rid)
+                    if prev is not None and prev[1]:
+                        restored.append(rid)
+                    if prev is not None and prev[0] == _sync_token(row):
+                        counts["unchanged"] += 1
+                        continue
+                    changed.append({"id": rid, "payload_json": dumps(row), "page_number": page_number})
+                upsert_records(cur, entity, changed, window_id, window["ingested_at_utc"], realm_id, counts)
+
+            if restored:
+                cur.execute(RESTORE_SQL.format(entity=entity), {"realm_id": realm_id, "ids": restored})
+                counts["restored"] = cur.rowcount
+
+            gone = [rid for rid, (_, deleted) in known.items() if rid not in seen and not deleted]
+            if gone and not seen:
+                print(dumps({
+                    "phase": "load", "entity": entity, "ts": _now_utc_iso(), "realm_id": realm_id,
+                    "status": "snapshot_empty", "reason": "skip_mark_deleted", "raw_rows": len(known)
+                }))
+            elif gone and expected is not None and len(seen) < expected:
+                print(dumps({
+                    "phase": "load", "entity": entity, "ts": _now_utc_iso(), "realm_id": realm_id,
+                    "status": "snapshot_incomplete", "reason": "skip_mark_deleted",
+                    "seen": len(seen), "expected": expected, "gone": len(gone)
+                }))
+            elif gone:
+                cur.execute(MARK_DELETED_SQL.format(entity=entity), {
+                    "realm_id": realm_id, "ids": gone, "ts": window["ingested_at_utc"],
+                })
+                counts["deleted"] = cur.rowcount
+
+    metrics['rows_inserted'] = counts["inserted"]
+    metrics['rows_updated'] = counts["updated"]
+    metrics['status'] = 'loaded'
+    return counts
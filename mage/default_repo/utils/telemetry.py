@@ -0,0 +1,333 @@
+"""
+Telemetría de extracción y carga: histogramas de latencia, bytes, reintentos, 429 y
+rows/s por entidad, en formato de texto de Prometheus (sin dependencias).
+
+Qué se mide:
+  - extract: cada intento de request a QBO (QboClient.post) con
+    latencia y status ('error' = transporte), bytes de respuesta, reintentos por motivo
+    (429, 5xx, transport) y cada refresh de token (QboClient.access_token);
+  - load: cada upsert a RAW (utils/raw_load.py; una fila en load_records, una página
+    en fused/worker, un lote en repair) y cada ventana registrada;
+  - rows/s por entidad y fase al cerrar el bloque (report).
+
+Salidas (ambas opcionales):
+  - QBO_METRICS_DIR: al cerrar cada bloque se escribe <dir>/qbo_<entity>_<fase>.prom
+    (para el textfile collector de node_exporter). Cada archivo lleva sólo las familias
+    de su fase, así dos bloques del mismo proceso no repiten series.
+  - QBO_METRICS_PORT: servidor HTTP en ese puerto con GET /metrics (uno por proceso,
+    se levanta con la primera observación).
+
+report(fase, entity, rows, secs) imprime además una línea `status: telemetry` con lo
+medido desde el report anterior de esa fase y entidad: requests por status, p50/p95/p99
+de latencia, bytes, reintentos, 429, refresh de token y lotes a Postgres.
+
+Los contadores son acumulados del proceso (semántica de Prometheus): si Mage corre
+varios pipelines en el mismo proceso, el endpoint los suma; los resúmenes no.
+"""
+import os
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from default_repo.utils.qbo_json import dumps
+
+METRICS_DIR = os.environ.get('QBO_METRICS_DIR') or None
+METRICS_PORT = int(os.environ.get('QBO_METRICS_PORT') or 0)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+_lock = threading.Lock()
+_families = []
+_reported = {}     # (fase, entity) → snapshot de las series al último report
+_server = None
+
+
+def _now_utc_iso():
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}" if pairs else ""
+
+
+def _num(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Family:
+    """Familia de métricas con etiquetas fijas; `phase` elige el archivo .prom."""
+    kind = None
+
+    def __init__(self, name, help_text, labels, phase):
+        self.name, self.help, self.label_names, self.phase = name, help_text, labels, phase
+        self.series = {}   # tuple(valores de etiquetas) → estado
+        _families.append(self)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def snapshot(self):
+        return {k: (list(v) if isinstance(v, list) else v) for k, v in self.series.items()}
+
+
+class Counter(_Family):
+    kind = 'counter'
+
+    def inc(self, labels, n=1):
+        self.series[labels] = self.series.get(labels, 0) + n
+
+    def lines(self, keys):
+        return [f"{self.name}{_labels(self.label_names, k)} {_num(self.series[k])}" for k in keys]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, labels, value):
+        self.series[labels] = value
+
+
+class Histogram(_Family):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels, phase, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels, phase)
+        self.buckets = buckets
+
+    def observe(self, labels, value):
+        state = self.series.get(labels)
+        if state is None:
+            state = self.series[labels] = [0] * (len(self.buckets) + 2)   # buckets..., count, sum
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[i] += 1
+                break
+        state[-2] += 1
+        state[-1] += value
+
+    def lines(self, keys):
+        out = []
+        for k in keys:
+            state, cumulative = self.series[k], 0
+            for bound, n in zip(self.buckets, state):
+                cumulative += n
+                out.append(f"{self.name}_bucket{_labels(self.label_names, k, [('le', _num(bound))])} {cumulative}")
+            out.append(f"{self.name}_bucket{_labels(self.label_names, k, [('le', '+Inf')])} {state[-2]}")
+            out.append(f"{self.name}_count{_labels(self.label_names, k)} {state[-2]}")
+            out.append(f"{self.name}_sum{_labels(self.label_names, k)} {round(state[-1], 6)}")
+        return out
+
+    def quantile(self, state, q):
+        """Como histogram_quantile de Prometheus: interpolación lineal dentro del bucket."""
+        total = state[-2]
+        if not total:
+            return None
+        rank, cumulative, lower = q * total, 0, 0.0
+        for bound, n in zip(self.buckets, state):
+            if n and cumulative + n >= rank:
+                return round(lower + (bound - lower) * (rank - cumulative) / n, 4)
+            cumulative += n
+            lower = bound
+        return self.buckets[-1]   # cae en +Inf: el último límite es la mejor cota
+
+
+# ====== Familias ======
+REQUEST_SECONDS = Histogram('qbo_request_duration_seconds', 'Latencia de cada intento de request a QBO.',
+                            ('entity', 'stage', 'status'), 'extract')
+RESPONSE_BYTES = Counter('qbo_response_bytes_total', 'Bytes recibidos de QBO (respuestas 200).',
+                         ('entity', 'stage'), 'extract')
+RETRIES = Counter('qbo_request_retries_total', 'Reintentos de requests a QBO por motivo.',
+                  ('entity', 'reason'), 'extract')
+THROTTLED = Counter('qbo_throttled_total', 'Respuestas 429 de QBO.', ('entity',), 'extract')
+AUTH_SECONDS = Histogram('qbo_auth_duration_seconds', 'Latencia del refresh de access_token.',
+                         ('entity', 'status'), 'extract')
+EXTRACT_RPS = Gauge('qbo_extract_rows_per_second', 'Filas extraídas por segundo en la última corrida.',
+                    ('entity',), 'extract')
+DB_SECONDS = Histogram('qbo_db_batch_duration_seconds', 'Latencia de cada lote escrito en RAW.',
+                       ('entity', 'op'), 'load')
+DB_ROWS = Counter('qbo_db_rows_total', 'Filas enviadas a RAW.', ('entity', 'op'), 'load')
+LOAD_RPS = Gauge('qbo_load_rows_per_second', 'Filas cargadas por segundo en la última corrida.',
+                 ('entity',), 'load')
+
+
+# ====== Observaciones ======
+def observe_request(entity, stage, status, latency, nbytes=0):
+    """Un intento de request a QBO; status = código HTTP o 'error' (transporte)."""
+    _ensure_server()
+    status = str(status)
+    with _lock:
+        REQUEST_SECONDS.observe((entity, stage, status), latency)
+        if status == '200':
+            RESPONSE_BYTES.inc((entity, stage), nbytes)
+        elif status == '429':
+            THROTTLED.inc((entity,))
+
+
+def observe_retry(entity, reason):
+    """reason: '429' | '5xx' | 'transport'."""
+    with _lock:
+        RETRIES.inc((entity, reason))
+
+
+def observe_auth(entity, status, latency):
+    _ensure_server()
+    with _lock:
+        AUTH_SECONDS.observe((entity, str(status)), latency)
+
+
+def observe_db(entity, op, secs, rows=0):
+    """Un lote a Postgres; op: 'upsert' | 'window'."""
+    _ensure_server()
+    with _lock:
+        DB_SECONDS.observe((entity, op), secs)
+        if rows:
+            DB_ROWS.inc((entity, op), rows)
+
+
+# ====== Exposición ======
+def render(phase=None, entity=None):
+    """Texto Prometheus de las familias (de una fase y/o entidad si se pide)."""
+    out = []
+    with _lock:
+        for fam in _families:
+            if phase and fam.phase != phase:
+                continue
+            keys = sorted(k for k in fam.series if entity is None or k[0] == entity)
+            if keys:
+                out.extend(fam.header() + fam.lines(keys))
+    return "\n".join(out) + "\n"
+
+
+def _write_textfile(phase, entity):
+    path = os.path.join(METRICS_DIR, f"qbo_{entity}_{phase}.prom")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(render(phase, entity))
+        os.replace(tmp, path)   # el collector nunca lee un archivo a medias
+    except OSError as e:
+        print(dumps({"phase": phase, "entity": entity, "ts": _now_utc_iso(),
+                     "telemetry": "write_failed", "error": str(e)}))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def _ensure_server():
+    global _server
+    if not METRICS_PORT or _server is not None:
+        return
+    with _lock:
+        if _server is not None:
+            return
+        try:
+            _server = ThreadingHTTPServer(('0.0.0.0', METRICS_PORT), _MetricsHandler)
+        except OSError as e:
+            # Puerto tomado (ej. otro proceso de Mage ya lo sirve): no reintentar
+            _server = False
+            print(dumps({"ts": _now_utc_iso(), "telemetry": "endpoint_failed",
+                         "port": METRICS_PORT, "error": str(e)}))
+            return
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+
+
+# ====== Resumen por bloque ======
+def _delta(fam, key, prev):
+    cur, old = fam.series[key], prev.get(key)
+    if old is None:
+        return cur
+    if isinstance(cur, list):
+        return [a - b for a, b in zip(cur, old)]
+    return cur - old
+
+
+def _merge(states):
+    merged = None
+    for s in states:
+        merged = list(s) if merged is None else [a + b for a, b in zip(merged, s)]
+    return merged
+
+
+def _summary(phase, entity):
+    """Métricas de la fase y entidad desde el report anterior; actualiza el snapshot."""
+    prev = _reported.get((phase, entity), {})
+    deltas = {}
+    for fam in _families:
+        if fam.phase != phase:
+            continue
+        old = prev.get(fam.name, {})
+        deltas[fam.name] = {k: _delta(fam, k, old) for k in fam.series if k[0] == entity}
+    _reported[(phase, entity)] = {fam.name: fam.snapshot() for fam in _families if fam.phase == phase}
+
+    def hist(fam, keys):
+        state = _merge(deltas[fam.name][k] for k in keys)
+        if not state or not state[-2]:
+            return None
+        out = {"count": state[-2], "avg_secs": round(state[-1] / state[-2], 4)}
+        out.update({f"p{int(q * 100)}_secs": fam.quantile(state, q) for q in QUANTILES})
+        return out
+
+    if phase == 'extract':
+        req = deltas[REQUEST_SECONDS.name]
+        by_status = {}
+        for (_, _, status), state in req.items():
+            if state[-2]:
+                by_status[status] = by_status.get(status, 0) + state[-2]
+        return {
+            "requests": hist(REQUEST_SECONDS, list(req)),
+            "requests_ok": hist(REQUEST_SECONDS, [k for k in req if k[2] == '200']),
+            "responses": by_status,
+            "bytes": sum(deltas[RESPONSE_BYTES.name].values()),
+            "retries": {k[1]: n for k, n in deltas[RETRIES.name].items() if n},
+            "throttled": sum(deltas[THROTTLED.name].values()),
+            "auth": hist(AUTH_SECONDS, list(deltas[AUTH_SECONDS.name])),
+        }
+    db = deltas[DB_SECONDS.name]
+    return {
+        "db_batches": {k[1]: hist(DB_SECONDS, [k]) for k in db if db[k][-2]},
+        "db_rows": {k[1]: n for k, n in deltas[DB_ROWS.name].items() if n},
+    }
+
+
+def report(phase, entity, rows, secs):
+    """
+    Cierre de bloque: gauge de rows/s, archivo .prom (QBO_METRICS_DIR) y línea de
+    resumen `status: telemetry`. phase: 'extract' | 'load'.
+    """
+    rows_per_sec = round(rows / secs, 1) if secs and secs > 0 else None
+    with _lock:
+        if rows_per_sec is not None:
+            (EXTRACT_RPS if phase == 'extract' else LOAD_RPS).set((entity,), rows_per_sec)
+        summary = _summary(phase, entity)
+    if METRICS_DIR:
+        _write_textfile(phase, entity)
+    print(dumps({
+        "phase": phase, "entity": entity, "ts": _now_utc_iso(), "status": "telemetry",
+        "rows": rows, "secs": round(secs, 3), "rows_per_sec": rows_per_sec, **summary
+    }))
+
+
+def rows_read(windows):
+    """Filas extraídas según las métricas por tramo de las ventanas."""
+    return sum(int((w.get('metrics') or {}).get('rows_read') or 0) for w in windows or [])
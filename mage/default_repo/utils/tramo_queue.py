@@ -0,0 +1,349 @@
+"""
+Cola de tramos en Postgres (raw.tramo_queue, docker/schema/004_tramo_queue.sql).
+
+    chunk_fecha_* (publish_queue=true) ──▶ raw.tramo_queue ◀── N workers
+
+- `publish` inserta los tramos de una corrida (run_id); re-publicar es no-op.
+- `claim` toma el siguiente tramo con FOR UPDATE SKIP LOCKED: varios workers
+  (en el mismo nodo o en otros) nunca reciben el mismo tramo a la vez.
+  Con varios realms, primero el realm con menos tramos en curso (reparto justo).
+- Cada reclamo es un lease de `lease_secs`; un hilo de heartbeat lo renueva
+  mientras el tramo se procesa. Si el worker muere, el lease vence y otro
+  worker lo vuelve a reclamar (la carga RAW es idempotente).
+- `complete` / `fail` sólo aplican si el lease sigue siendo del worker.
+  Tras `max_attempts` fallos el tramo queda en 'failed'; un lease vencido sin
+  intentos restantes (worker caído en el último intento) también (`sweep_expired`).
+- Un worker no sale mientras quede algo de la corrida en 'pending' o 'leased':
+  espera al próximo lease_expires_at (reintentos diferidos, leases de otros workers).
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import psycopg
+
+from default_repo.utils.qbo_json import dumps
+from default_repo.utils.raw_load import upsert_records, upsert_window
+
+LEASE_SECS = 600
+MAX_ATTEMPTS = 5
+RETRY_DELAY_SECS = 30
+POLL_MAX_SECS = 30   # espera máxima entre sondeos cuando sólo quedan tramos en curso o diferidos
+
+PUBLISH_SQL = """
+INSERT INTO raw.tramo_queue (
+    run_id, entity, realm_id, tramo_id, window_start_utc, window_end_utc, page_size
+)
+VALUES (%(run_id)s, %(entity)s, %(realm_id)s, %(tramo_id)s, %(start)s, %(end)s, %(page_size)s)
+ON CONFLICT (run_id, entity, realm_id, window_start_utc, window_end_utc) DO NOTHING;
+"""
+
+# Reclamables: pendientes, o leased con el lease vencido (worker caído).
+# En 'pending', lease_expires_at es el "no antes de" del reintento tras un fallo.
+CLAIM_SQL = """
+UPDATE raw.tramo_queue q SET
+    status = 'leased',
+    leased_by = %(worker_id)s,
+    lease_expires_at = now() + make_interval(secs => %(lease_secs)s),
+    attempts = q.attempts + 1,
+    updated_at_utc = now()
+WHERE q.queue_id = (
+    SELECT c.queue_id FROM raw.tramo_queue c
+    WHERE c.entity = %(entity)s
+      AND (%(run_id)s::text IS NULL OR c.run_id = %(run_id)s)
+      AND c.realm_id = ANY(%(realms)s)
+      AND c.status IN ('pending', 'leased')
+      AND (c.lease_expires_at IS NULL OR c.lease_expires_at < now())
+      AND c.attempts < %(max_attempts)s
+    ORDER BY (SELECT count(*) FROM raw.tramo_queue l
+              WHERE l.entity = c.entity AND l.realm_id = c.realm_id
+                AND l.status = 'leased' AND l.lease_expires_at >= now()),
+             c.window_start_utc
+    FOR UPDATE SKIP LOCKED
+    LIMIT 1
+)
+RETURNING q.queue_id, q.run_id, q.realm_id, q.tramo_id, q.window_start_utc,
+          q.window_end_utc, q.page_size, q.attempts;
+"""
+
+RENEW_SQL = """
+UPDATE raw.tramo_queue
+SET lease_expires_at = now() + make_interval(secs => %(lease_secs)s), updated_at_utc = now()
+WHERE queue_id = %(queue_id)s AND leased_by = %(worker_id)s AND status = 'leased';
+"""
+
+COMPLETE_SQL = """
+UPDATE raw.tramo_queue
+SET status = 'done', metrics = %(metrics)s::jsonb, last_error = NULL,
+    lease_expires_at = NULL, updated_at_utc = now()
+WHERE queue_id = %(queue_id)s AND leased_by = %(worker_id)s AND status = 'leased';
+"""
+
+# Vuelve a 'pending' (reintento diferido RETRY_DELAY_SECS * intentos) hasta agotar
+# intentos; después queda en 'failed'.
+FAIL_SQL = """
+UPDATE raw.tramo_queue
+SET status = CASE WHEN attempts >= %(max_attempts)s THEN 'failed' ELSE 'pending' END,
+    last_error = %(error)s,
+    lease_expires_at = now() + make_interval(secs => %(retry_delay)s * attempts),
+    updated_at_utc = now()
+WHERE queue_id = %(queue_id)s AND leased_by = %(worker_id)s AND status = 'leased';
+"""
+
+# Leases vencidos sin intentos restantes: nadie puede reclamarlos y FAIL_SQL no
+# corre (el worker murió), así que pasan a 'failed' aquí.
+SWEEP_SQL = """
+UPDATE raw.tramo_queue
+SET status = 'failed', last_error = COALESCE(last_error, 'lease_expired'),
+    lease_expires_at = NULL, updated_at_utc = now()
+WHERE entity = %(entity)s
+  AND (%(run_id)s::text IS NULL OR run_id = %(run_id)s)
+  AND realm_id = ANY(%(realms)s)
+  AND status = 'leased' AND lease_expires_at < now()
+  AND attempts >= %(max_attempts)s;
+"""
+
+# Lo que todavía puede correr: cuántos tramos y segundos hasta el próximo reclamable.
+REMAINING_SQL = """
+SELECT count(*), GREATEST(extract(epoch FROM min(lease_expires_at) - now()), 0)
+FROM raw.tramo_queue
+WHERE entity = %(entity)s
+  AND (%(run_id)s::text IS NULL OR run_id = %(run_id)s)
+  AND realm_id = ANY(%(realms)s)
+  AND status IN ('pending', 'leased');
+"""
+
+
+def _now_utc_iso():
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def _iso(dt):
+    return dt.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def new_run_id(entity):
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    return f"{entity}_{stamp}_{uuid.uuid4().hex[:8]}"
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def publish(conn_str, entity, run_id, tramos):
+    """
+    Publica tramos (con 'realm_id', ver utils/realms.fair_order) en la cola.
+    Devuelve cuántos eran nuevos.
+    """
+    with psycopg.connect(conn_str) as conn:
+        with conn.cursor() as cur:
+            published = 0
+            for t in tramos:
+                cur.execute(PUBLISH_SQL, {
+                    "run_id": run_id, "entity": entity, "realm_id": t['realm_id'],
+                    "tramo_id": t.get('tramo_id'),
+                    "start": t['start'], "end": t['end'],
+                    "page_size": int(t.get('page_size', 200)),
+                })
+                published += cur.rowcount
+        conn.commit()
+    return published
+
+
+def claim(conn, entity, worker_id, realms, run_id=None,
+          lease_secs=LEASE_SECS, max_attempts=MAX_ATTEMPTS):
+    """
+    Reclama un tramo de alguno de `realms` (conn en autocommit). Devuelve
+    (queue_id, tramo) o None si no queda nada reclamable. `tramo` tiene la
+    forma de chunk_fecha más 'realm_id'.
+    """
+    row = conn.execute(CLAIM_SQL, {
+        "entity": entity, "worker_id": worker_id, "run_id": run_id, "realms": list(realms),
+        "lease_secs": lease_secs, "max_attempts": max_attempts,
+    }).fetchone()
+    if row is None:
+        return None
+    queue_id, run_id, realm_id, tramo_id, start, end, page_size, attempts = row
+    return queue_id, {
+        'tramo_id': tramo_id, 'run_id': run_id, 'realm_id': realm_id, 'attempt': attempts,
+        'start': _iso(start), 'end': _iso(end), 'page_size': page_size,
+        'metrics': {
+            'pages_read': 0, 'rows_read': 0,
+            'rows_inserted': 0, 'rows_updated': 0,
+            'duration_secs': 0.0, 'status': 'pending'
+        },
+    }
+
+
+def sweep_expired(conn, entity, realms, run_id=None, max_attempts=MAX_ATTEMPTS):
+    """Pasa a 'failed' los leases vencidos sin intentos restantes. Devuelve cuántos."""
+    return conn.execute(SWEEP_SQL, {
+        "entity": entity, "run_id": run_id, "realms": list(realms), "max_attempts": max_attempts,
+    }).rowcount
+
+
+def remaining(conn, entity, realms, run_id=None):
+    """
+    (tramos en 'pending'/'leased', segundos hasta el próximo lease_expires_at).
+    Con 0 tramos la corrida terminó para estos realms.
+    """
+    count, wait = conn.execute(REMAINING_SQL, {
+        "entity": entity, "run_id": run_id, "realms": list(realms),
+    }).fetchone()
+    return count, float(wait or 0.0)
+
+
+class _Heartbeat:
+    """Renueva el lease cada lease_secs/3 mientras el tramo se procesa."""
+
+    def __init__(self, conn, lock, queue_id, worker_id, lease_secs):
+        self.conn, self.lock = conn, lock
+        self.params = {"queue_id": queue_id, "worker_id": worker_id, "lease_secs": lease_secs}
+        self.interval = max(1.0, lease_secs / 3.0)
+        self.stop = threading.Event()
+        self.lost = False
+        self.thread = threading.Thread(target=self._run, name="lease-heartbeat", daemon=True)
+
+    def _run(self):
+        while not self.stop.wait(self.interval):
+            try:
+                with self.lock:
+                    renewed = self.conn.execute(RENEW_SQL, self.params).rowcount
+            except Exception:
+                continue   # el próximo intento vuelve a probar; el lease dura 3 intervalos
+            if not renewed:
+                self.lost = True
+                return
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+
+
+def run_worker(entity, fetch_tramo, conn_str, realms, run_id=None, worker_id=None,
+               lease_secs=LEASE_SECS, max_attempts=MAX_ATTEMPTS, max_tramos=None):
+    """
+    Reclama tramos de `realms` hasta que no quede nada de la corrida en 'pending'
+    ni 'leased' (o hasta `max_tramos`). Si no hay nada reclamable pero sí
+    reintentos diferidos o leases de otros workers, espera al próximo vencimiento.
+
+    fetch_tramo(t, window_ref, emit) -> (window, status)
+        Igual que en utils/fused.py: cada página se entrega a emit(window, records)
+        y aquí se carga a RAW con COMMIT por página. window None con status
+        'skipped*' (sin fechas, sin cambios) es una omisión deliberada: el tramo
+        se completa. window None con otro status es un fallo (reintento / 'failed').
+
+    Devuelve (windows, summary).
+    """
+    worker_id = worker_id or default_worker_id()
+    qconn = psycopg.connect(conn_str, autocommit=True)   # cola + heartbeat
+    qlock = threading.Lock()
+    lconn = psycopg.connect(conn_str)                    # carga RAW
+    windows = []
+    summary = {"worker_id": worker_id, "run_id": run_id, "claimed": 0,
+               "done": 0, "skipped": 0, "failed": 0, "lease_lost": 0, "expired": 0,
+               "waits": 0, "rows": 0}
+    t_start = time.perf_counter()
+
+    try:
+        while max_tramos is None or summary["claimed"] < max_tramos:
+            with qlock:
+                claimed = claim(qconn, entity, worker_id, realms, run_id, lease_secs, max_attempts)
+                if claimed is None:
+                    summary["expired"] += sweep_expired(qconn, entity, realms, run_id, max_attempts)
+                    left, wait = remaining(qconn, entity, realms, run_id)
+            if claimed is None:
+                if not left:
+                    break
+                # Reintentos diferidos (FAIL_SQL) o tramos de otros workers: esperar y volver a sondear
+                summary["waits"] += 1
+                time.sleep(min(max(wait, 1.0), POLL_MAX_SECS))
+                continue
+            queue_id, t = claimed
+            summary["claimed"] += 1
+            print(dumps({
+                "phase": "queue", "entity": entity, "ts": _now_utc_iso(),
+                "status": "claimed", "worker_id": worker_id, "queue_id": queue_id,
+                "run_id": t['run_id'], "realm_id": t['realm_id'],
+                "start": t['start'], "end": t['end'],
+                "attempt": t['attempt']
+            }))
+
+            window_ids = {}
+
+            def emit(window, page_records):
+                ref = window["window_ref"]
+                with lconn.cursor() as cur:
+                    if ref not in window_ids:
+                        window_ids[ref] = upsert_window(cur, entity, window)
+                    counts = upsert_records(cur, entity, page_records, window_ids[ref],
+                                            window["ingested_at_utc"], window["realm_id"])
+                lconn.commit()
+                m = window["metrics"]
+                m['rows_inserted'] = m.get('rows_inserted', 0) + counts["inserted"]
+                m['rows_updated'] = m.get('rows_updated', 0) + counts["updated"]
+                m['rows_unchanged'] = m.get('rows_unchanged', 0) + counts["unchanged"]
+
+            params = {"queue_id": queue_id, "worker_id": worker_id, "max_attempts": max_attempts}
+            with _Heartbeat(qconn, qlock, queue_id, worker_id, lease_secs) as hb:
+                try:
+                    window, fetch_status = fetch_tramo(t, len(windows), emit)
+                    skipped = window is None and str(fetch_status or '').startswith('skipped')
+                    error = None if window is not None or skipped else (fetch_status or "tramo_omitido")
+                except Exception as e:
+                    lconn.rollback()
+                    window, skipped, error = None, False, f"{type(e).__name__}: {e}"
+
+            with qlock:
+                if skipped:
+                    applied = qconn.execute(COMPLETE_SQL, {
+                        **params, "metrics": dumps(t['metrics'])}).rowcount
+                elif error is None:
+                    window["metrics"]['status'] = 'loaded'
+                    applied = qconn.execute(COMPLETE_SQL, {
+                        **params, "metrics": dumps(window["metrics"])}).rowcount
+                else:
+                    applied = qconn.execute(FAIL_SQL, {
+                        **params, "error": error, "retry_delay": RETRY_DELAY_SECS}).rowcount
+
+            if not applied or hb.lost:
+                # Otro worker tomó el tramo tras vencer el lease; la carga es idempotente.
+                summary["lease_lost"] += 1
+                status = "lease_lost"
+            elif skipped:
+                summary["skipped"] += 1
+                status = fetch_status
+            elif error is None:
+                summary["done"] += 1
+                summary["rows"] += window["metrics"].get('rows_read', 0)
+                status = "done"
+            else:
+                summary["failed"] += 1
+                status = "failed"
+            if window is not None:
+                windows.append(window)
+
+            print(dumps({
+                "phase": "queue", "entity": entity, "ts": _now_utc_iso(),
+                "status": status, "worker_id": worker_id, "queue_id": queue_id,
+                "start": t['start'], "end": t['end'], "error": error,
+                "metrics": window["metrics"] if window is not None else t['metrics']
+            }))
+    finally:
+        qconn.close()
+        lconn.close()
+
+    summary["wall_secs"] = round(time.perf_counter() - t_start, 3)
+    print(dumps({
+        "phase": "queue", "entity": entity, "ts": _now_utc_iso(),
+        "status": "worker_exit", **summary
+    }))
+    return windows, summary
@@ -0,0 +1,55 @@
+"""
+Worker standalone de la cola de tramos (fuera de un pipeline de Mage).
+
+    python -m default_repo.utils.tramo_worker --entity invoices [--run-id ID] [--workers 4]
+                                              [--realms 9130,4620]
+
+Reutiliza el extractor del bloque (extract_qbo_<entity>._run_worker), así que
+las credenciales salen de los mismos Mage Secrets. Se puede lanzar en
+cualquier nodo con acceso a Postgres/QBO; todos comparten raw.tramo_queue y,
+salvo QBO_RATE_BACKEND explícito, el límite de requests por realm en Postgres.
+"""
+import argparse
+import importlib
+import threading
+
+from default_repo.utils.realms import load_realms
+
+ENTITIES = ('customers', 'invoices', 'items')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Procesa tramos de raw.tramo_queue.")
+    parser.add_argument('--entity', required=True, choices=ENTITIES)
+    parser.add_argument('--run-id', default=None, help="sólo tramos de esta corrida")
+    parser.add_argument('--realms', default=None, help="default: QBO_REALMS / QBO_REALM_ID")
+    parser.add_argument('--workers', type=int, default=1, help="workers en este proceso")
+    parser.add_argument('--payload-mode', default='raw', choices=('raw', 'dict'))
+    parser.add_argument('--prefetch-pages', type=int, default=1)
+    parser.add_argument('--lease-secs', type=int, default=None)
+    parser.add_argument('--max-tramos', type=int, default=None, help="por worker")
+    args = parser.parse_args(argv)
+
+    block = importlib.import_module(f'default_repo.transformers.extract_qbo_{args.entity}')
+    realms = load_realms({'realms': args.realms})
+
+    kwargs = {'run_id': args.run_id, 'lease_secs': args.lease_secs, 'max_tramos': args.max_tramos}
+    errors = []
+
+    def work():
+        try:
+            block._run_worker([], realms, args.payload_mode, args.prefetch_pages, **kwargs)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, name=f"worker-{i}") for i in range(max(1, args.workers))]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    if errors:
+        raise errors[0]
+
+
+if __name__ == '__main__':
+    main()